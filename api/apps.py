@@ -1,5 +1,28 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+
+from api.db import apply_sqlite_pragmas
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from api.events import publish_lab_change
+        from api.models import (
+            Lab,
+            Issue,
+            Experiment,
+            IssueComment,
+            CheckIn,
+            lab_changed,
+        )
+        from api.search import index_instance, unindex_instance, unindex_lab
+
+        connection_created.connect(apply_sqlite_pragmas)
+        for model in [Issue, Experiment, IssueComment, CheckIn]:
+            post_save.connect(index_instance, sender=model)
+            post_delete.connect(unindex_instance, sender=model)
+        post_delete.connect(unindex_lab, sender=Lab)
+        lab_changed.connect(publish_lab_change)
@@ -0,0 +1,209 @@
+import datetime
+import json
+from typing import Dict, Iterable, Iterator, List, Tuple, Type
+
+from django.db import models, transaction, connection
+from django.db.models import Max
+
+from api.models import (
+    Lab,
+    Issue,
+    QueueItem,
+    IssueDescriptionHistoryItem,
+    IssueStateHistoryItem,
+    IssueComment,
+    IssueCommentHistoryItem,
+    Experiment,
+    ExperimentTermsHistoryItem,
+    ExperimentEndDateHistoryItem,
+    CheckIn,
+    LabStats,
+)
+from api.search import index_lab
+
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 2000
+
+# Exported models and the lookup from each to its lab, in an order where every
+# record comes after the ones it references
+EXPORT_MODELS: List[Tuple[Type[models.Model], str]] = [
+    (Issue, "lab"),
+    (QueueItem, "lab"),
+    (IssueDescriptionHistoryItem, "issue__lab"),
+    (IssueStateHistoryItem, "issue__lab"),
+    (IssueComment, "issue__lab"),
+    (IssueCommentHistoryItem, "comment__issue__lab"),
+    (Experiment, "lab"),
+    (Experiment.issues.through, "experiment__lab"),
+    (ExperimentTermsHistoryItem, "experiment__lab"),
+    (ExperimentEndDateHistoryItem, "experiment__lab"),
+    (CheckIn, "lab"),
+    (CheckIn.experiments.through, "checkin__lab"),
+]
+
+
+def record_type(model: Type[models.Model]) -> str:
+    return model._meta.model_name
+
+
+def _encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Can't encode {type(value).__name__} as JSON")
+
+
+def _line(type_name: str, fields: dict) -> str:
+    return json.dumps({"type": type_name, "fields": fields}, default=_encode) + "\n"
+
+
+def export_lab(lab: Lab, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    # Yields one NDJSON line per record. Rows are read as dicts in chunks from
+    # the database cursor, so memory use doesn't depend on the lab's size, and
+    # in a single transaction so the export is a consistent snapshot
+    with transaction.atomic():
+        # Only the lab's own settings; its version and modified time belong to
+        # the database it's in
+        yield _line(
+            record_type(Lab),
+            {
+                field.attname: getattr(lab, field.attname)
+                for field in Lab._meta.concrete_fields
+                if field.editable
+            },
+        )
+        for model, lab_lookup in EXPORT_MODELS:
+            type_name = record_type(model)
+            rows = (
+                model.objects.filter(**{lab_lookup: lab})
+                .order_by("pk")
+                .values(*[field.attname for field in model._meta.concrete_fields])
+            )
+            for row in rows.iterator(chunk_size=chunk_size):
+                yield _line(type_name, row)
+
+
+# Models whose primary keys other records refer to, and so have to be remapped
+# on import. The rest get new keys from the database
+REFERENCED_MODELS = (Issue, IssueComment, Experiment, CheckIn)
+
+
+class LabImportError(Exception):
+    pass
+
+
+class LabImporter:
+    # Rebuilds an exported lab as a new lab with bulk inserts. Records keep
+    # their numbers and timestamps but get new primary keys, allocated up front
+    # so that records referencing them can be inserted without reading them back
+
+    def __init__(self, batch_size: int = IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.models = {record_type(model): model for model, _ in EXPORT_MODELS}
+        self.lab = None
+        self.id_maps: Dict[Type[models.Model], Dict[int, int]] = {}
+        self.next_ids: Dict[Type[models.Model], int] = {}
+        self.free_ids: Dict[Type[models.Model], List[int]] = {}
+        self.pending: List[models.Model] = []
+        self.counts: Dict[str, int] = {}
+
+    def run(self, lines: Iterable[str]) -> Lab:
+        with transaction.atomic():
+            for line in lines:
+                if line.strip():
+                    self.add(json.loads(line))
+            if self.lab is None:
+                raise LabImportError("No lab record found")
+            self.flush()
+            # Bulk inserts skip the post_save receivers that index records, and
+            # the counting in save()
+            index_lab(self.lab.pk)
+            LabStats.rebuild(self.lab.pk)
+        return self.lab
+
+    def add(self, record: dict) -> None:
+        type_name, fields = record["type"], record["fields"]
+        if type_name == record_type(Lab):
+            if self.lab is not None:
+                raise LabImportError("More than one lab record found")
+            # Creating the lab first also takes SQLite's write lock before any
+            # primary keys are allocated
+            self.lab = self.build(Lab, fields)
+            self.lab.save()
+            self.id_maps[Lab] = {fields["id"]: self.lab.pk}
+            return
+        if self.lab is None:
+            raise LabImportError("Records must come after their lab record")
+        if type_name not in self.models:
+            raise LabImportError(f"Unknown record type {type_name!r}")
+
+        model = self.models[type_name]
+        if self.pending and type(self.pending[0]) is not model:
+            self.flush()
+        self.pending.append(self.build(model, fields))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def build(self, model: Type[models.Model], fields: dict) -> models.Model:
+        values = {}
+        for field in model._meta.concrete_fields:
+            if field.attname not in fields:
+                continue
+            value = fields[field.attname]
+            if field.primary_key:
+                if model not in REFERENCED_MODELS:
+                    continue
+                value = self.allocate_id(model, value)
+            elif field.is_relation:
+                try:
+                    value = self.id_maps[field.related_model][value]
+                except KeyError:
+                    raise LabImportError(
+                        f"{model._meta.model_name} references missing "
+                        f"{field.related_model._meta.model_name} {value}"
+                    )
+            elif value is not None:
+                value = field.to_python(value)
+            values[field.attname] = value
+        return model(**values)
+
+    def allocate_id(self, model: Type[models.Model], old_id: int) -> int:
+        ids = self.free_ids.get(model)
+        if not ids:
+            ids = self.free_ids[model] = self.reserve_ids(model)
+        new_id = ids.pop()
+        self.id_maps.setdefault(model, {})[old_id] = new_id
+        return new_id
+
+    def reserve_ids(self, model: Type[models.Model]) -> List[int]:
+        # Keys for the next batch_size records of model, last first. Where the
+        # table has a sequence (PostgreSQL) they're taken from it, so that
+        # concurrent imports and inserts never get the same ones. SQLite has
+        # none, but the import holds its write lock from the lab's creation on
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+                    "FROM generate_series(1, %s)",
+                    [model._meta.db_table, model._meta.pk.column, self.batch_size],
+                )
+                return sorted((row[0] for row in cursor.fetchall()), reverse=True)
+        if model not in self.next_ids:
+            last = model.objects.aggregate(Max("pk"))["pk__max"]
+            self.next_ids[model] = (last or 0) + 1
+        start = self.next_ids[model]
+        self.next_ids[model] += self.batch_size
+        return list(range(start + self.batch_size - 1, start - 1, -1))
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        model = type(self.pending[0])
+        # Left to Django, which caps statements at what the backend allows
+        model.objects.bulk_create(self.pending)
+        type_name = record_type(model)
+        self.counts[type_name] = self.counts.get(type_name, 0) + len(self.pending)
+        self.pending = []
+
+
+def import_lab(lines: Iterable[str], batch_size: int = IMPORT_BATCH_SIZE) -> Lab:
+    return LabImporter(batch_size=batch_size).run(lines)
@@ -0,0 +1,233 @@
+from typing import Dict, List, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+
+from api.models import (
+    Lab,
+    LabSequence,
+    WithHistory,
+    Counted,
+    record_history,
+    update_counters,
+)
+from api.search import update_index
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+
+BATCH_MAX_OPERATIONS = 1000
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=[CREATE, UPDATE, DELETE])
+    number = serializers.IntegerField(required=False)
+    data = serializers.DictField(required=False, default=dict)
+
+    def validate(self, attrs):
+        if attrs["op"] != CREATE and "number" not in attrs:
+            raise serializers.ValidationError({"number": "This field is required."})
+        return attrs
+
+
+class BatchMixin:
+    # Adds a batch action to a lab's numbered resources, applying a list of
+    # create, update and delete operations in one transaction using bulk queries
+    # instead of a save() per instance. Either every operation is applied or,
+    # if any is invalid, none are
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request, *args, **kwargs) -> Response:
+        operations = BatchOperationSerializer(data=request.data, many=True)
+        operations.is_valid(raise_exception=True)
+        operations = operations.validated_data
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f"At most {BATCH_MAX_OPERATIONS} operations are allowed per batch."
+            )
+        lab_pk = int(self.kwargs["lab_pk"])
+        model = self.get_serializer_class().Meta.model
+
+        with transaction.atomic():
+            # Locked before the first read: on SQLite a transaction that reads and
+            # then writes fails outright if another batch wrote in between
+            try:
+                Lab.lock(lab_pk)
+            except Lab.DoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            numbers = [op["number"] for op in operations if op["op"] != CREATE]
+            instances = {
+                instance.number: instance
+                for instance in model.objects.select_for_update().filter(
+                    lab=lab_pk, deleted=False, number__in=numbers
+                )
+            }
+
+            results = [self.validate_operation(op, instances) for op in operations]
+            if any("errors" in result for result in results):
+                return Response(
+                    [
+                        {
+                            "status": result.get(
+                                "status", status.HTTP_424_FAILED_DEPENDENCY
+                            ),
+                            "errors": result.get("errors", {}),
+                        }
+                        for result in results
+                    ],
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            written, related = apply_operations(model, lab_pk, operations, results)
+            changes = [(model, instance.pk) for instance in written] + related
+            Lab.touch(lab_pk, changes + self.batch_written(written))
+
+            # Not get_queryset(), which leaves out records the batch marked deleted
+            fresh = self.prefetch_relations(model.objects.filter(lab=lab_pk)).in_bulk(
+                [instance.pk for instance in written]
+            )
+            response = []
+            for op, instance in zip(operations, written):
+                if op["op"] == DELETE:
+                    response.append({"status": status.HTTP_204_NO_CONTENT})
+                else:
+                    response.append(
+                        {
+                            "status": (
+                                status.HTTP_201_CREATED
+                                if op["op"] == CREATE
+                                else status.HTTP_200_OK
+                            ),
+                            "data": self.get_serializer(fresh[instance.pk]).data,
+                        }
+                    )
+        return Response(response)
+
+    def validate_operation(self, op: dict, instances: Dict[int, object]) -> dict:
+        instance = None
+        if op["op"] != CREATE:
+            instance = instances.get(op["number"])
+            if instance is None:
+                return {
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "errors": {"number": ["Not found."]},
+                }
+        if op["op"] == DELETE:
+            return {"instance": instance}
+
+        serializer = self.get_serializer(
+            instance, data=op["data"], partial=op["op"] == UPDATE
+        )
+        if not serializer.is_valid():
+            return {"status": status.HTTP_400_BAD_REQUEST, "errors": serializer.errors}
+        return {"instance": instance, "serializer": serializer}
+
+    def batch_written(self, instances: List[object]) -> List[Tuple[type, int]]:
+        # Hook for work that save() signals would otherwise have done. Returns
+        # any further changes for the lab's change log, as (model, pk)
+        return []
+
+
+def apply_operations(
+    model, lab_pk: int, operations, results
+) -> Tuple[List[object], List[Tuple[type, int]]]:
+    # Returns the written instances, and the (model, pk) of related records
+    # whose to-many relations changed with them
+    now = timezone.now()
+    numbers = iter(
+        LabSequence.reserve(
+            lab_pk, model._meta.model_name, sum(op["op"] == CREATE for op in operations)
+        )
+    )
+    written = []
+    created = []
+    updated = []
+    update_fields = {"modified"}
+    assignments = []
+    for op, result in zip(operations, results):
+        instance = result["instance"]
+        if op["op"] == DELETE:
+            instance.deleted = True
+            update_fields.add("deleted")
+        else:
+            serializer = result["serializer"]
+            data = dict(serializer.validated_data)
+            for field in serializer.fields.values():
+                if isinstance(field, ManyRelatedField) and field.source in data:
+                    assignments.append(
+                        (len(written), field.source, data.pop(field.source))
+                    )
+            if op["op"] == CREATE:
+                instance = model(
+                    **data, lab_id=lab_pk, number=next(numbers), created=now
+                )
+            else:
+                for attr, value in data.items():
+                    setattr(instance, attr, value)
+                update_fields.update(data)
+        instance.modified = now
+        written.append(instance)
+        (created if op["op"] == CREATE else updated).append(instance)
+
+    if created:
+        model.objects.bulk_create(created)
+        # bulk_create doesn't set primary keys on every backend, so read them back
+        # by number
+        pks = dict(
+            model.objects.filter(
+                lab=lab_pk, number__in=[instance.number for instance in created]
+            ).values_list("number", "pk")
+        )
+        for instance in created:
+            instance.pk = pks[instance.number]
+    if updated:
+        model.objects.bulk_update(updated, sorted(update_fields))
+    related = set_many(
+        model, [(written[i], source, values) for i, source, values in assignments]
+    )
+    if issubclass(model, WithHistory):
+        record_history(written)
+    if issubclass(model, Counted):
+        update_counters(written)
+    update_index(model, written)
+    return written, related
+
+
+def set_many(model, assignments) -> List[Tuple[type, int]]:
+    # Replaces to-many relations with bulk deletes and inserts on their through
+    # tables. assignments are (instance, relation name, related objects).
+    # Returns the (model, pk) of related objects that were added or removed
+    changed = []
+    by_source: Dict[str, list] = {}
+    for instance, source, values in assignments:
+        by_source.setdefault(source, []).append((instance, values))
+    for source, pairs in by_source.items():
+        descriptor = getattr(model, source)
+        field = descriptor.field
+        if descriptor.reverse:
+            own, other = field.m2m_reverse_field_name(), field.m2m_field_name()
+        else:
+            own, other = field.m2m_field_name(), field.m2m_reverse_field_name()
+        related_model = field.model if descriptor.reverse else field.related_model
+        through = descriptor.through
+        old_rows = through.objects.filter(
+            **{f"{own}__in": [instance.pk for instance, _ in pairs]}
+        )
+        old_links = set(old_rows.values_list(f"{own}_id", f"{other}_id"))
+        old_rows.delete()
+        new_links = {
+            (instance.pk, value.pk) for instance, values in pairs for value in values
+        }
+        through.objects.bulk_create(
+            through(**{f"{own}_id": own_pk, f"{other}_id": other_pk})
+            for own_pk, other_pk in new_links
+        )
+        changed.extend(
+            (related_model, other_pk) for _, other_pk in old_links ^ new_links
+        )
+    return changed
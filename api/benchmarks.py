@@ -0,0 +1,384 @@
+import asyncio
+import resource
+import statistics
+import threading
+from datetime import date, timedelta
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+from asgiref.sync import sync_to_async
+
+from django.db import connection
+from django.test import Client
+from django.urls import URLResolver, get_resolver, reverse
+
+from api.models import Lab, Issue, IssueComment, Experiment, CheckIn
+
+
+def seed_lab(
+    issues: int = 100,
+    comments_per_issue: int = 2,
+    experiments: int = 10,
+    check_ins: int = 30,
+) -> Lab:
+    lab = Lab.objects.create()
+    issue_instances = [
+        Issue.objects.create(lab=lab, title=f"Issue {i}", description="x" * 200)
+        for i in range(issues)
+    ]
+    for issue in issue_instances:
+        for i in range(comments_per_issue):
+            IssueComment.objects.create(issue=issue, body=f"Comment {i}")
+    experiment_instances = []
+    for i in range(experiments):
+        experiment = Experiment.objects.create(
+            lab=lab,
+            title=f"Experiment {i}",
+            terms="y" * 200,
+            description="z" * 200,
+            end_date="2020-01-01",
+        )
+        experiment.issues.set(issue_instances[i::experiments])
+        experiment_instances.append(experiment)
+    for i in range(check_ins):
+        check_in = CheckIn.objects.create(
+            lab=lab,
+            retrospective=f"Check-in {i}",
+            local_date=date.today() - timedelta(days=i),
+        )
+        check_in.experiments.set(experiment_instances)
+    return lab
+
+
+def _percentile(durations: List[float], percent: int) -> float:
+    # Of sorted durations
+    return durations[min(len(durations) - 1, int(len(durations) * percent / 100))]
+
+
+def time_requests(
+    client: Client, url: str, repeat: int, **headers: str
+) -> Dict[str, float]:
+    durations: List[float] = []
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        # Rather than CaptureQueriesContext, whose log each request resets
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(url, **headers)
+            durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return {
+        "status": response.status_code,
+        "median_ms": statistics.median(durations),
+        "p90_ms": _percentile(durations, 90),
+        "p95_ms": _percentile(durations, 95),
+        "p99_ms": _percentile(durations, 99),
+        "queries": len(queries) / repeat,
+        "bytes": len(getattr(response, "content", b"")),
+    }
+
+
+def peak_memory_kb(client: Client, url: str, **headers: str) -> float:
+    # Peak of the memory allocated while handling a request
+    tracemalloc.start()
+    try:
+        client.get(url, **headers)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def wire_cost(
+    client: Client, url: str, repeat: int, **headers: str
+) -> Dict[str, float]:
+    # Bytes on the wire and the median CPU time of a request, which includes
+    # rendering and compressing the response
+    cpu: List[float] = []
+    for _ in range(repeat):
+        start = time.process_time()
+        response = client.get(url, **headers)
+        body = response.getvalue()
+        cpu.append((time.process_time() - start) * 1000)
+    return {
+        "status": response.status_code,
+        "encoding": response.get("Content-Encoding", "identity"),
+        "bytes": len(body),
+        "cpu_ms": statistics.median(cpu),
+    }
+
+
+async def time_event_fanout(
+    application, lab_id: int, subscribers: int, events: int, publish: Callable
+) -> Dict[str, float]:
+    # Opens subscribers event streams on an ASGI application in this event
+    # loop, then calls publish (a sync function that changes the lab) events
+    # times, timing how long each change takes to reach every subscriber
+    closed = asyncio.get_running_loop().create_future()
+    state = {"connected": 0, "received": 0, "target": subscribers}
+    progress = asyncio.Event()
+
+    async def receive():
+        await closed
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        body = message.get("body", b"")
+        if body.startswith(b": connected"):
+            state["connected"] += 1
+        elif body.startswith(b"event:"):
+            state["received"] += 1
+        if state["connected"] == subscribers and state["received"] >= state["target"]:
+            progress.set()
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": f"/api/dev/labs/{lab_id}/events/",
+        "headers": [],
+    }
+    start = time.perf_counter()
+    streams = [
+        asyncio.ensure_future(application(dict(scope), receive, send))
+        for _ in range(subscribers)
+    ]
+    state["target"] = 0
+    await progress.wait()
+    connect_s = time.perf_counter() - start
+    threads = threading.active_count()
+
+    durations: List[float] = []
+    for i in range(1, events + 1):
+        progress.clear()
+        state["target"] = subscribers * i
+        start = time.perf_counter()
+        await sync_to_async(publish)()
+        await progress.wait()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    closed.set_result(None)
+    await asyncio.gather(*streams)
+    durations.sort()
+    return {
+        "subscribers": subscribers,
+        "connect_s": connect_s,
+        "threads": threads,
+        "median_fanout_ms": statistics.median(durations),
+        "max_fanout_ms": durations[-1],
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+# Requests made by the in-process load generators below, as from a JSON client
+BENCHMARK_HOST = "testserver"
+
+
+async def asgi_get(application, path: str) -> Tuple[int, bytes]:
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [
+                (b"host", BENCHMARK_HOST.encode()),
+                (b"accept", b"application/json"),
+            ],
+        },
+        receive,
+        send,
+    )
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def wsgi_get(application, path: str) -> Tuple[int, bytes]:
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "HTTP_HOST": BENCHMARK_HOST,
+        "HTTP_ACCEPT": "application/json",
+    }
+    setup_testing_defaults(environ)
+    status = []
+    body = application(environ, lambda s, headers: status.append(s))
+    try:
+        return int(status[0].split()[0]), b"".join(body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+def _summary(durations: List[float], elapsed: float) -> Dict[str, float]:
+    durations.sort()
+    return {
+        "requests_per_s": len(durations) / elapsed,
+        "median_ms": statistics.median(durations),
+        "p95_ms": _percentile(durations, 95),
+    }
+
+
+def time_wsgi_load(
+    application, path: str, requests: int, concurrency: int
+) -> Dict[str, float]:
+    # Like a threaded WSGI server, with concurrency threads
+    def get(_) -> float:
+        start = time.perf_counter()
+        wsgi_get(application, path)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        durations = list(executor.map(get, range(requests)))
+    return _summary(durations, time.perf_counter() - start)
+
+
+async def time_asgi_load(
+    application, path: str, requests: int, concurrency: int
+) -> Dict[str, float]:
+    # concurrency requests in flight at a time on this event loop
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get() -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            await asgi_get(application, path)
+            return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    durations = await asyncio.gather(*[get() for _ in range(requests)])
+    return _summary(list(durations), time.perf_counter() - start)
+
+
+# Query strings for routes that need one to do any work
+ROUTE_QUERIES = {
+    "lab-changes": {"since": 0},
+    "lab-search": {"q": "issue"},
+}
+
+
+def get_routes(prefixes: Tuple[str, ...] = ("api/", "metrics")) -> List[tuple]:
+    # (name, route, URL kwargs) of every route under prefixes that answers
+    # GETs, skipping format suffixes. Unnamed routes go by their route
+    def walk(patterns, prefix=""):
+        for pattern in patterns:
+            route = prefix + str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns, route)
+                continue
+            actions = getattr(pattern.callback, "actions", None)
+            kwargs = list(pattern.pattern.regex.groupindex)
+            if (actions is None or "get" in actions) and "format" not in kwargs:
+                yield pattern.name or route, route, kwargs
+
+    return [
+        route
+        for route in walk(get_resolver().url_patterns)
+        if route[1].startswith(prefixes)
+    ]
+
+
+def route_urls(lab: Lab) -> Dict[str, str]:
+    # A URL for each route, pointing at the first of each kind of record in lab
+    issue = lab.issues.order_by("number").first()
+    comment = IssueComment.objects.filter(issue=issue).first()
+    urls = {}
+    for name, route, kwargs in get_routes():
+        values = {
+            "lab_pk": lab.pk,
+            "pk": comment.pk if name.startswith("issue-comments") else lab.pk,
+            "number": 1,
+            # Comment routes take the issue's id
+            "issue_number": issue.pk,
+        }
+        if name == route:
+            url = "/" + route
+        else:
+            url = reverse(name, kwargs={k: values[k] for k in kwargs})
+        if name in ROUTE_QUERIES:
+            url += "?" + urlencode(ROUTE_QUERIES[name])
+        urls[name] = url
+    return urls
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_http(application) -> Tuple[WSGIServer, str]:
+    # A local threaded HTTP server for application, on a free port. Stop it
+    # with server.shutdown()
+    server = make_server(
+        "127.0.0.1",
+        0,
+        application,
+        server_class=_ThreadingWSGIServer,
+        handler_class=_QuietHandler,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def time_http_load(url: str, requests: int, concurrency: int) -> Dict[str, float]:
+    def get(_) -> float:
+        start = time.perf_counter()
+        try:
+            with urlopen(
+                Request(url, headers={"Accept": "application/json"})
+            ) as response:
+                response.read()
+        except HTTPError as e:
+            # Still a response, like a 304
+            e.read()
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        durations = list(executor.map(get, range(requests)))
+    return _summary(durations, time.perf_counter() - start)
+
+
+def compare_results(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float
+) -> List[str]:
+    # Regressions from baseline: any extra query, or a median latency more than
+    # tolerance (a fraction) over the baseline's
+    regressions = []
+    for name, result in results.items():
+        base: Optional[dict] = baseline.get(name)
+        if base is None:
+            continue
+        if result["queries"] > base["queries"]:
+            regressions.append(
+                f"{name}: {result['queries']:g} queries, was {base['queries']:g}"
+            )
+        if result["median_ms"] > base["median_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: median {result['median_ms']:.2f} ms, "
+                f"was {base['median_ms']:.2f} ms"
+            )
+    return regressions
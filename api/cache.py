@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from api.models import lab_changed
+
+
+class BaseResponseCache:
+    # Entries are rendered responses keyed by, among other things, their lab's
+    # version, so a change to a lab makes all of its entries (and only its
+    # entries) unreachable even without invalidate()
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, lab_id: int, key: str) -> Optional[Any]:
+        value = self._get(lab_id, key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, lab_id: int, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, lab_id: int) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _get(self, lab_id: int, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+
+class LRUResponseCache(BaseResponseCache):
+    def __init__(self, max_entries: int = 1000):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lab_keys: Dict[int, set] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, lab_id: int, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, lab_id: int, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (lab_id, value)
+            self._entries.move_to_end(key)
+            self._lab_keys.setdefault(lab_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_lab_id, _) = self._entries.popitem(last=False)
+                self._discard_lab_key(old_lab_id, old_key)
+
+    def invalidate(self, lab_id: int) -> None:
+        with self._lock:
+            for key in self._lab_keys.pop(lab_id, ()):
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {**super().stats(), "entries": len(self._entries)}
+
+    def _discard_lab_key(self, lab_id: int, key: str) -> None:
+        keys = self._lab_keys.get(lab_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._lab_keys[lab_id]
+
+
+class DjangoResponseCache(BaseResponseCache):
+    # Stores entries in one of settings.CACHES, e.g. a local-memory or file
+    # backend. Entries left behind by a lab's old versions expire by timeout
+
+    def __init__(self, alias: str = "default", timeout: Optional[int] = 300):
+        super().__init__()
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _get(self, lab_id: int, key: str) -> Optional[Any]:
+        return self.cache.get(self._key(key))
+
+    def set(self, lab_id: int, key: str, value: Any) -> None:
+        self.cache.set(self._key(key), value, self.timeout)
+
+    @staticmethod
+    def _key(key: str) -> str:
+        return f"response:{key}"
+
+
+_response_cache: Optional[BaseResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[BaseResponseCache]:
+    global _response_cache
+    config = getattr(settings, "RESPONSE_CACHE", None)
+    if not config:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                backend = import_string(config["BACKEND"])
+                _response_cache = backend(**config.get("OPTIONS", {}))
+    return _response_cache
+
+
+def invalidate_lab(sender, lab_id: int, **kwargs) -> None:
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate(lab_id)
+
+
+lab_changed.connect(invalidate_lab)
@@ -0,0 +1,160 @@
+import re
+import zlib
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from api.metrics import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response compression negotiated from Accept-Encoding: zstd and brotli when
+# their packages are installed, and gzip always. Streamed responses are
+# compressed chunk by chunk, each flushed as it's produced, so that clients
+# don't wait for the end of an export to read the start of it. Install
+# this after MetricsMiddleware, so that metrics see the compressed size
+
+# Levels that cost little CPU for most of the size reduction on JSON
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + 15)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+# The encodings available, in order of preference between equal q-values
+ENCODINGS = {}
+if zstandard is not None:
+    ENCODINGS["zstd"] = _Zstd
+if brotli is not None:
+    ENCODINGS["br"] = _Brotli
+ENCODINGS["gzip"] = _Gzip
+
+_ACCEPT_ENCODING = re.compile(r"\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*(?:,|$)")
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    encodings = {}
+    for name, q in _ACCEPT_ENCODING.findall(header):
+        try:
+            encodings[name.lower()] = float(q) if q else 1.0
+        except ValueError:
+            pass
+    return encodings
+
+
+def negotiate(header: str) -> Optional[str]:
+    # The available encoding the client prefers, if any
+    accepted = accepted_encodings(header)
+    best = None
+    for name in ENCODINGS:
+        q = accepted.get(name, accepted.get("*", 0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (name, q)
+    return best[0] if best else None
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    compressor = ENCODINGS[encoding]()
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(encoding: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = ENCODINGS[encoding]()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush()
+        if compressed:
+            yield compressed
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    # Like django.middleware.gzip.GZipMiddleware, with more encodings
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header("Content-Encoding"):
+            return response
+        if (
+            not response.streaming
+            and len(response.content) < settings.COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                encoding, response.streaming_content
+            )
+            del response["Content-Length"]
+        else:
+            with timed("compress"):
+                content = compress(encoding, response.content)
+            # Already compressed, or too random to compress
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response["Content-Length"] = str(len(content))
+
+        # The compressed body isn't byte-for-byte the same as the uncompressed
+        # one, which a strong ETag would promise
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
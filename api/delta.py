@@ -0,0 +1,79 @@
+import json
+import re
+from difflib import SequenceMatcher
+from typing import List, Union
+
+# A delta rebuilds a text from the one before it. Each op is either an
+# [offset, length] slice to copy from the old text or a string to insert
+Delta = List[Union[List[int], str]]
+
+# Words, runs of whitespace and single punctuation characters, so that small
+# edits to long single-line texts still diff to small deltas
+_TOKEN = re.compile(r"\w+|\s+|[^\w\s]")
+
+# Above this many tokens between the common prefix and suffix, texts are diffed
+# by line instead, which keeps saves fast at some cost in delta size
+MAX_TOKEN_DIFF_TOKENS = 2000
+
+
+def diff(old: str, new: str) -> Delta:
+    # Most edits touch one place, so strip the common ends before matching
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    delta: Delta = []
+    if prefix:
+        delta.append([0, prefix])
+    _diff_middle(old, new, prefix, len(old) - suffix, len(new) - suffix, delta)
+    if suffix:
+        _copy(delta, len(old) - suffix, suffix)
+    return delta
+
+
+def _diff_middle(old: str, new: str, start: int, old_end: int, new_end: int, delta):
+    old_tokens = _TOKEN.findall(old, start, old_end)
+    new_tokens = _TOKEN.findall(new, start, new_end)
+    if len(old_tokens) + len(new_tokens) > MAX_TOKEN_DIFF_TOKENS:
+        old_tokens = old[start:old_end].splitlines(keepends=True)
+        new_tokens = new[start:new_end].splitlines(keepends=True)
+    offsets = [start]
+    for token in old_tokens:
+        offsets.append(offsets[-1] + len(token))
+
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            _copy(delta, offsets[i1], offsets[i2] - offsets[i1])
+        elif tag in ("replace", "insert"):
+            inserted = "".join(new_tokens[j1:j2])
+            if delta and isinstance(delta[-1], str):
+                delta[-1] += inserted
+            else:
+                delta.append(inserted)
+
+
+def _copy(delta: Delta, offset: int, length: int) -> None:
+    last = delta[-1] if delta else None
+    if isinstance(last, list) and last[0] + last[1] == offset:
+        last[1] += length
+    else:
+        delta.append([offset, length])
+
+
+def apply(old: str, delta: Delta) -> str:
+    return "".join(
+        op if isinstance(op, str) else old[op[0] : op[0] + op[1]] for op in delta
+    )
+
+
+def dumps(delta: Delta) -> str:
+    return json.dumps(delta, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(value: str) -> Delta:
+    return json.loads(value)
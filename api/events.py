@@ -0,0 +1,208 @@
+import asyncio
+import json
+import threading
+from typing import Dict, List, Optional, Set
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from api.models import Lab
+
+# Server-sent events telling clients that a lab changed, so they can fetch its
+# changes (see api.sync) instead of polling. Served by a plain ASGI app (routed
+# to in lifelab_server.asgi) rather than a Django view, so each subscriber is a
+# coroutine waiting on a queue, not a thread
+
+# Seconds between comments sent to idle connections, so that proxies don't
+# time them out
+KEEPALIVE_INTERVAL = 15
+
+# Events a subscriber can fall behind by before more are dropped. Every event
+# only says that the lab changed, so a dropped one loses nothing
+MAX_PENDING_EVENTS = 16
+
+
+# Queued to a subscription alongside events
+KEEPALIVE = object()
+CLOSED = object()
+
+
+class Subscription:
+    def __init__(self, lab_id: int):
+        self.lab_id = lab_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def deliver(self, event) -> None:
+        # Only called on the subscription's event loop
+        if event is CLOSED or self.queue.qsize() < MAX_PENDING_EVENTS:
+            self.queue.put_nowait(event)
+
+
+class BaseBroker:
+    # Fans events out to the subscribers of each lab. publish() may be called
+    # from any thread. A broker backed by an external pub/sub service would
+    # publish to it, and pass what it receives on to a LocalBroker's deliver(),
+    # so that subscribers in every worker get events from all of them
+
+    def publish(self, lab_id: int, event: dict) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, lab_id: int) -> Subscription:
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        raise NotImplementedError
+
+    def subscriber_count(self, lab_id: Optional[int] = None) -> int:
+        raise NotImplementedError
+
+
+class LocalBroker(BaseBroker):
+    # Delivers events to subscribers in this process only
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, lab_id: int, event: dict) -> None:
+        self.deliver(lab_id, event)
+
+    def deliver(self, lab_id: int, event: dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(lab_id, ()))
+        # One callback per event loop rather than per subscriber
+        by_loop: Dict[asyncio.AbstractEventLoop, List[Subscription]] = {}
+        for subscription in subscriptions:
+            by_loop.setdefault(subscription.loop, []).append(subscription)
+        for loop, group in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver_all, group, event)
+            except RuntimeError:
+                # The loop has been closed
+                pass
+
+    def subscribe(self, lab_id: int) -> Subscription:
+        subscription = Subscription(lab_id)
+        with self._lock:
+            self._subscriptions.setdefault(lab_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.lab_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.lab_id]
+
+    def subscriber_count(self, lab_id: Optional[int] = None) -> int:
+        with self._lock:
+            if lab_id is not None:
+                return len(self._subscriptions.get(lab_id, ()))
+            return sum(map(len, self._subscriptions.values()))
+
+
+def _deliver_all(subscriptions: List[Subscription], event: dict) -> None:
+    for subscription in subscriptions:
+        subscription.deliver(event)
+
+
+_broker: Optional[BaseBroker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Optional[BaseBroker]:
+    global _broker
+    config = getattr(settings, "EVENT_BROKER", None)
+    if not config:
+        return None
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = import_string(config["BACKEND"])
+                _broker = backend(**config.get("OPTIONS", {}))
+    return _broker
+
+
+def publish_lab_change(sender, lab_id: int, **kwargs) -> None:
+    # lab_changed receiver. Waits for the change to be committed, so that
+    # clients reacting to the event can read it
+    broker = get_broker()
+    if broker is not None:
+        transaction.on_commit(lambda: broker.publish(lab_id, {"lab": lab_id}))
+
+
+def _format(event: dict) -> bytes:
+    return f"event: change\ndata: {json.dumps(event)}\n\n".encode()
+
+
+async def _close_on_disconnect(receive, subscription: Subscription) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    subscription.deliver(CLOSED)
+
+
+async def _respond(send, status: int, body: bytes) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lab_events(scope, receive, send, lab_id: int) -> None:
+    # ASGI app streaming a lab's change events until the client disconnects
+    if scope["method"] != "GET":
+        return await _respond(send, 405, b"Method not allowed")
+    broker = get_broker()
+    if broker is None:
+        return await _respond(send, 404, b"Events are disabled")
+    if not await sync_to_async(Lab.objects.filter(pk=lab_id).exists)():
+        return await _respond(send, 404, b"Not found")
+
+    subscription = broker.subscribe(lab_id)
+    watcher = asyncio.ensure_future(_close_on_disconnect(receive, subscription))
+    keepalive = None
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"access-control-allow-origin", b"*"),
+                    # Stops nginx from buffering the stream
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b": connected\n\n",
+                "more_body": True,
+            }
+        )
+        # Idle connections cost a coroutine waiting on its queue and a timer
+        while True:
+            keepalive = subscription.loop.call_later(
+                KEEPALIVE_INTERVAL, subscription.deliver, KEEPALIVE
+            )
+            event = await subscription.queue.get()
+            keepalive.cancel()
+            if event is CLOSED:
+                break
+            body = b": keepalive\n\n" if event is KEEPALIVE else _format(event)
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        broker.unsubscribe(subscription)
+        watcher.cancel()
+        if keepalive is not None:
+            keepalive.cancel()
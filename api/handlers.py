@@ -0,0 +1,81 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+from lifelab_server.urls import API_BASE
+
+# GETs of the endpoints clients poll most: a lab and its issues, experiments
+# and check-ins. Only ones that never write, so not today's check-in, which a
+# GET creates when there's none yet
+HOT_READ_PATHS = [
+    re.compile(rf"^/{API_BASE}labs/\d+/$"),
+    re.compile(rf"^/{API_BASE}labs/\d+/issues/$"),
+    re.compile(rf"^/{API_BASE}labs/\d+/experiments/$"),
+    re.compile(rf"^/{API_BASE}labs/\d+/check-ins/$"),
+]
+
+
+class ReadPoolASGIHandler(ASGIHandler):
+    # Django 3.0 has no async views or ORM, and its ASGI handler runs every
+    # request on the one thread that sync_to_async shares, so a worker serves
+    # a request at a time. This runs GETs of the hot read endpoints on a pool
+    # of threads instead, through the same middleware and views, so their
+    # responses are unchanged. Everything else keeps to the shared thread
+
+    def __init__(self, threads: int = None):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(
+            threads or settings.ASGI_READ_THREADS, thread_name_prefix="asgi-read"
+        )
+
+    async def get_response(self, request):
+        if request.method == "GET" and any(
+            path.match(request.path) for path in HOT_READ_PATHS
+        ):
+            return await sync_to_async(
+                self.get_pooled_response, thread_sensitive=False, executor=self.executor
+            )(request)
+        return await sync_to_async(super().get_response)(request)
+
+    def get_pooled_response(self, request):
+        # What the request_started signal does for the shared thread
+        close_old_connections()
+        return super().get_response(request)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        # Django 3.0 iterates streamed bodies on the event loop, where the
+        # queries that produce an export's parts aren't allowed. Each part is
+        # produced on the shared thread instead, like the rest of the request
+        headers = [
+            (str(name).encode("ascii"), str(value).encode("latin1"))
+            for name, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append(
+                (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+        parts = iter(response)
+        next_part = sync_to_async(next)
+        while True:
+            part = await next_part(parts, None)
+            if part is None:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close)()
@@ -0,0 +1,41 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import time_event_fanout
+from api.models import Lab
+from lifelab_server.asgi import application
+
+
+class Command(BaseCommand):
+    help = (
+        "Holds many idle event streams open on the ASGI application in one "
+        "process and times how long lab changes take to reach all of them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", type=int, default=5000)
+        parser.add_argument("--events", type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Committed, so that the streams' own connections can see it
+        lab = Lab.objects.create()
+        try:
+            result = asyncio.run(
+                time_event_fanout(
+                    application,
+                    lab.pk,
+                    options["subscribers"],
+                    options["events"],
+                    lambda: Lab.touch(lab.pk),
+                )
+            )
+        finally:
+            lab.delete()
+        self.stdout.write(
+            f"{result['subscribers']} subscribers connected in "
+            f"{result['connect_s']:.2f} s using {result['threads']} threads\n"
+            f"fan-out median {result['median_fanout_ms']:.2f} ms, "
+            f"max {result['max_fanout_ms']:.2f} ms\n"
+            f"peak memory {result['max_rss_mb']:.0f} MB"
+        )
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from rest_framework.settings import api_settings
+
+from api.benchmarks import seed_lab, wire_cost
+from api.compression import ENCODINGS
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the size and CPU cost of lab responses in each wire format "
+        "and compression the server supports"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--issues", type=int, default=200)
+        parser.add_argument("--experiments", type=int, default=20)
+        parser.add_argument("--check-ins", type=int, default=30)
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        lab = seed_lab(
+            issues=options["issues"],
+            experiments=options["experiments"],
+            check_ins=options["check_ins"],
+        )
+        formats = {
+            renderer.format: renderer.media_type
+            for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+            if renderer.format != "api"
+        }
+        urls = {
+            "issues": f"/api/dev/labs/{lab.pk}/issues/",
+            "experiments": f"/api/dev/labs/{lab.pk}/experiments/",
+            "check-ins": f"/api/dev/labs/{lab.pk}/check-ins/",
+            # NDJSON whatever the Accept header
+            "export": f"/api/dev/labs/{lab.pk}/export/",
+        }
+        client = Client()
+        self.stdout.write(
+            f"{'route':<12} {'format':<8} {'encoding':<9} {'bytes':>9} "
+            f"{'of json':>8} {'cpu ms':>8}"
+        )
+        try:
+            # Timing rendering each time, not cache hits
+            with override_settings(RESPONSE_CACHE=None):
+                for name, url in urls.items():
+                    baseline = None
+                    for format, media_type in formats.items():
+                        if name == "export" and format != "json":
+                            continue
+                        for encoding in ["identity", *ENCODINGS]:
+                            result = wire_cost(
+                                client,
+                                url,
+                                options["repeat"],
+                                HTTP_ACCEPT=media_type,
+                                HTTP_ACCEPT_ENCODING=encoding,
+                            )
+                            baseline = baseline or result["bytes"]
+                            self.stdout.write(
+                                f"{name:<12} {format:<8} {result['encoding']:<9} "
+                                f"{result['bytes']:>9} "
+                                f"{result['bytes'] / baseline:>8.1%} "
+                                f"{result['cpu_ms']:>8.2f}"
+                            )
+        finally:
+            lab.delete()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+
+from api.benchmarks import seed_lab, time_requests
+
+
+class Command(BaseCommand):
+    help = "Compares full and conditional (304) GETs of a synthetic lab's endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--issues", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Everything is seeded in a transaction that is rolled back afterwards
+        with transaction.atomic():
+            lab = seed_lab(issues=options["issues"])
+            client = Client()
+            urls = [
+                f"/api/dev/labs/{lab.pk}/",
+                f"/api/dev/labs/{lab.pk}/issues/",
+                f"/api/dev/labs/{lab.pk}/check-ins/today/",
+            ]
+            self.stdout.write(
+                f"{'url':<40} {'mode':<12} {'status':>6} {'median ms':>10} "
+                f"{'p95 ms':>8} {'queries':>8} {'bytes':>9}"
+            )
+            for url in urls:
+                etag = client.get(url)["ETag"]
+                for mode, headers in (
+                    ("full", {}),
+                    ("unchanged", {"HTTP_IF_NONE_MATCH": etag}),
+                ):
+                    result = time_requests(client, url, options["repeat"], **headers)
+                    self.stdout.write(
+                        f"{url:<40} {mode:<12} {result['status']:>6} "
+                        f"{result['median_ms']:>10.2f} {result['p95_ms']:>8.2f} "
+                        f"{result['queries']:>8.1f} {result['bytes']:>9}"
+                    )
+            transaction.set_rollback(True)
@@ -0,0 +1,81 @@
+import asyncio
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from api.benchmarks import (
+    seed_lab,
+    asgi_get,
+    wsgi_get,
+    time_asgi_load,
+    time_wsgi_load,
+)
+from api.handlers import ReadPoolASGIHandler
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the hot read endpoints served through WSGI, Django's ASGI "
+        "handler and the thread-pooled ASGI handler, under concurrent load"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--issues", type=int, default=200)
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help="Leave the response cache on, measuring cache hits instead",
+        )
+
+    def handle(self, *args, **options):
+        # Committed, so that every handler thread's connection can see it
+        lab = seed_lab(issues=options["issues"])
+        try:
+            if options["cache"]:
+                self.run(lab, options)
+            else:
+                with override_settings(RESPONSE_CACHE=None):
+                    self.run(lab, options)
+        finally:
+            lab.delete()
+
+    def run(self, lab, options):
+        wsgi = WSGIHandler()
+        handlers = {
+            "wsgi": None,
+            "asgi": ASGIHandler(),
+            "asgi-pooled": ReadPoolASGIHandler(),
+        }
+        paths = [
+            f"/api/dev/labs/{lab.pk}/",
+            f"/api/dev/labs/{lab.pk}/issues/",
+            f"/api/dev/labs/{lab.pk}/experiments/",
+            f"/api/dev/labs/{lab.pk}/check-ins/",
+        ]
+        self.stdout.write(
+            f"{'path':<36} {'handler':<12} {'req/s':>8} {'median ms':>10} "
+            f"{'p95 ms':>8}"
+        )
+        for path in paths:
+            expected = wsgi_get(wsgi, path)
+            for name, handler in handlers.items():
+                if handler is None:
+                    result = time_wsgi_load(
+                        wsgi, path, options["requests"], options["concurrency"]
+                    )
+                else:
+                    if asyncio.run(asgi_get(handler, path)) != expected:
+                        raise CommandError(f"{name} responded differently to {path}")
+                    result = asyncio.run(
+                        time_asgi_load(
+                            handler, path, options["requests"], options["concurrency"]
+                        )
+                    )
+                self.stdout.write(
+                    f"{path:<36} {name:<12} {result['requests_per_s']:>8.0f} "
+                    f"{result['median_ms']:>10.2f} {result['p95_ms']:>8.2f}"
+                )
@@ -0,0 +1,151 @@
+import json
+import platform
+
+import django
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from api.benchmarks import (
+    seed_lab,
+    route_urls,
+    time_requests,
+    peak_memory_kb,
+    serve_http,
+    time_http_load,
+    compare_results,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times every GET route of the API against a synthetic lab, writing "
+        "results that can be compared with a baseline from an earlier run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--issues", type=int, default=200)
+        parser.add_argument("--comments-per-issue", type=int, default=2)
+        parser.add_argument("--experiments", type=int, default=20)
+        parser.add_argument("--check-ins", type=int, default=30)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--routes", nargs="+", metavar="NAME", help="Only time these routes"
+        )
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help="Leave the response cache on, timing cache hits",
+        )
+        parser.add_argument(
+            "--http",
+            action="store_true",
+            help="Also load each route through a local HTTP server",
+        )
+        parser.add_argument("--http-requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument(
+            "--baseline",
+            help="Fail on regressions from the results in this JSON file",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Fraction by which median latency may exceed the baseline's",
+        )
+
+    def handle(self, *args, **options):
+        config = {
+            name: options[name]
+            for name in [
+                "issues",
+                "comments_per_issue",
+                "experiments",
+                "check_ins",
+                "repeat",
+                "cache",
+            ]
+        }
+        # Committed, so that the HTTP server's threads can read it
+        lab = seed_lab(
+            issues=options["issues"],
+            comments_per_issue=options["comments_per_issue"],
+            experiments=options["experiments"],
+            check_ins=options["check_ins"],
+        )
+        try:
+            if options["cache"]:
+                results = self.run(lab, options)
+            else:
+                with override_settings(RESPONSE_CACHE=None):
+                    results = self.run(lab, options)
+        finally:
+            lab.delete()
+
+        report = {
+            "config": config,
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+            },
+            "routes": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            regressions = compare_results(
+                results, baseline["routes"], options["tolerance"]
+            )
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+
+    def run(self, lab, options) -> dict:
+        client = Client()
+        urls = route_urls(lab)
+        if options["routes"]:
+            unknown = set(options["routes"]) - set(urls)
+            if unknown:
+                raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+            urls = {name: urls[name] for name in options["routes"]}
+        server = None
+        if options["http"]:
+            server, base_url = serve_http(WSGIHandler())
+
+        self.stdout.write(
+            f"{'route':<30} {'status':>6} {'median ms':>10} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries':>8} {'bytes':>9} {'peak KB':>8}"
+            + (f" {'req/s':>8}" if server else "")
+        )
+        results = {}
+        try:
+            for name, url in urls.items():
+                # Warms up, and creates today's check-in before it's timed
+                client.get(url)
+                result = time_requests(client, url, options["repeat"])
+                result["peak_kb"] = peak_memory_kb(client, url)
+                line = (
+                    f"{name:<30} {result['status']:>6} {result['median_ms']:>10.2f} "
+                    f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                    f"{result['queries']:>8.1f} {result['bytes']:>9} "
+                    f"{result['peak_kb']:>8.0f}"
+                )
+                if server:
+                    result["http"] = time_http_load(
+                        base_url + url, options["http_requests"], options["concurrency"]
+                    )
+                    line += f" {result['http']['requests_per_s']:>8.0f}"
+                results[name] = result
+                self.stdout.write(line)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+        return results
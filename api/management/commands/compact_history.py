@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from api.models import (
+    IssueDescriptionHistoryItem,
+    IssueCommentHistoryItem,
+    ExperimentTermsHistoryItem,
+)
+
+HISTORY_MODELS = [
+    IssueDescriptionHistoryItem,
+    IssueCommentHistoryItem,
+    ExperimentTermsHistoryItem,
+]
+
+
+class Command(BaseCommand):
+    help = "Re-encodes text histories as snapshots and deltas"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the space that would be saved without writing anything",
+        )
+
+    def handle(self, *args, **options):
+        total_before = total_after = 0
+        for model in HISTORY_MODELS:
+            before, after = model.compact(dry_run=options["dry_run"])
+            total_before += before
+            total_after += after
+            self.stdout.write(self.report(model._meta.model_name, before, after))
+        self.stdout.write(self.report("total", total_before, total_after))
+
+    @staticmethod
+    def report(name: str, before: int, after: int) -> str:
+        saved = before - after
+        percent = 100 * saved / before if before else 0
+        return (
+            f"{name}: {before} -> {after} characters stored, "
+            f"{saved} saved ({percent:.1f}%)"
+        )
@@ -0,0 +1,80 @@
+import re
+from datetime import date
+from typing import Iterator, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import QuerySet
+
+from api.models import Experiment
+from api.views import (
+    LabIssueViewSet,
+    LabExperimentViewSet,
+    LabCheckInViewSet,
+    IssueCommentViewSet,
+)
+
+# Plan lines for a table read without an index: SQLite's "SCAN api_issue" (but
+# not "SCAN api_issue USING INDEX ...") and PostgreSQL's "Seq Scan on api_issue"
+FULL_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)$|\bSeq Scan on (\w+)", re.MULTILINE)
+
+
+def viewset_queries(lab_pk: int) -> Iterator[Tuple[str, QuerySet]]:
+    # The queries the lab viewsets run for their reads, built from the viewsets
+    # themselves
+    for viewset, name in [
+        (LabIssueViewSet, "issues"),
+        (LabExperimentViewSet, "experiments"),
+        (LabCheckInViewSet, "check-ins"),
+    ]:
+        view = viewset(action="list", kwargs={"lab_pk": lab_pk}, format_kwarg=None)
+        queryset = view.get_queryset()
+        ordering = view.pagination_class.ordering
+        yield f"{name} list", queryset
+        yield f"{name} page", queryset.order_by(ordering)[:10]
+        yield f"{name} rows", view.row_serializer_class(None).values(queryset)
+        yield f"{name} retrieve", queryset.filter(number=1)
+        if viewset is LabCheckInViewSet:
+            yield f"{name} today", queryset.filter(local_date=date.today())
+
+    # What a new check-in starts with, as in CheckInSerializer.create
+    yield "active experiments", Experiment.objects.filter(
+        lab__pk=lab_pk, deleted=False, state=Experiment.ACTIVE
+    )
+
+    view = IssueCommentViewSet(
+        action="list", kwargs={"lab_pk": lab_pk, "issue_number": 1}, format_kwarg=None
+    )
+    yield "comments page", view.get_queryset().order_by("created")[:10]
+
+
+def full_scans(plan: str) -> List[str]:
+    return [sqlite or postgres for sqlite, postgres in FULL_SCAN.findall(plan)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows the query plans of the lab endpoints' reads, to check that they "
+        "use indexes. PostgreSQL scans small tables whatever their indexes, so "
+        "run it against a populated database there"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lab", type=int, default=1)
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if any query reads a whole table",
+        )
+
+    def handle(self, *args, **options):
+        scanned = []
+        for name, queryset in viewset_queries(options["lab"]):
+            plan = queryset.explain()
+            self.stdout.write(f"{name}:")
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+            tables = full_scans(plan)
+            if tables:
+                scanned.append(f"{name} ({', '.join(tables)})")
+        if options["check"] and scanned:
+            raise CommandError(f"Full table scans: {'; '.join(scanned)}")
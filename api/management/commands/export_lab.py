@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.backup import export_lab, EXPORT_CHUNK_SIZE
+from api.models import Lab
+
+
+class Command(BaseCommand):
+    help = "Writes a lab and everything in it as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("lab_id", type=int)
+        parser.add_argument(
+            "-o", "--output", help="File to write to (defaults to standard output)"
+        )
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            lab = Lab.objects.get(pk=options["lab_id"])
+        except Lab.DoesNotExist:
+            raise CommandError(f"Lab {options['lab_id']} does not exist")
+
+        output = open(options["output"], "w") if options["output"] else sys.stdout
+        try:
+            for line in export_lab(lab, chunk_size=options["chunk_size"]):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,35 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.backup import LabImporter, LabImportError, IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Creates a new lab from an NDJSON export made by export_lab"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "input", nargs="?", help="File to read from (defaults to standard input)"
+        )
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        importer = LabImporter(batch_size=options["batch_size"])
+        input = open(options["input"]) if options["input"] else sys.stdin
+        start = time.perf_counter()
+        try:
+            lab = importer.run(input)
+        except LabImportError as e:
+            raise CommandError(str(e))
+        finally:
+            if input is not sys.stdin:
+                input.close()
+        elapsed = time.perf_counter() - start
+
+        for type_name, count in sorted(importer.counts.items()):
+            self.stdout.write(f"{type_name}: {count}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported lab {lab.pk} in {elapsed:.2f}s")
+        )
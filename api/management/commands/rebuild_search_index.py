@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index from the database"
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(f"Indexed {count} records")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q
+
+from api.models import Lab, LabStats, Issue
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts every lab's stats and issue comment counts from scratch, "
+        "reporting any counter that had drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lab", type=int, help="Only reconcile this lab")
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail on drifted counters instead of fixing them",
+        )
+
+    def handle(self, *args, **options):
+        labs = Lab.objects.order_by("pk").values_list("pk", flat=True)
+        if options["lab"] is not None:
+            labs = labs.filter(pk=options["lab"])
+        drifted = []
+        for lab_id in labs.iterator():
+            drifted.extend(self.drift(lab_id))
+            if not options["check"]:
+                LabStats.rebuild(lab_id)
+        for line in drifted:
+            self.stdout.write(line)
+        if options["check"] and drifted:
+            raise CommandError(f"{len(drifted)} counters have drifted")
+        self.stdout.write(f"{len(drifted)} counters had drifted")
+
+    @staticmethod
+    def drift(lab_id: int):
+        stored = LabStats.objects.filter(lab_id=lab_id).values().first()
+        if stored is not None:
+            for name, value in LabStats.count(lab_id).items():
+                if stored[name] != value:
+                    yield f"lab {lab_id} {name}: {stored[name]} counted as {value}"
+        issues = (
+            Issue.objects.filter(lab_id=lab_id)
+            .annotate(live=Count("comments", filter=Q(comments__deleted=False)))
+            .exclude(comment_count=F("live"))
+            .values_list("number", "comment_count", "live")
+        )
+        for number, stored_count, count in issues:
+            yield (
+                f"lab {lab_id} issue {number} comment_count: "
+                f"{stored_count} counted as {count}"
+            )
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+# Per-route request metrics, served in Prometheus' text format at /metrics.
+# Each process keeps its own, so with several workers Prometheus should scrape
+# each of them. Like the response cache's stats, they're only served to staff
+# unless DEBUG is on
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# Phases timed with timed(), besides the database queries
+PHASES = ("serialize", "render", "compress")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # One more for values over the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    def __init__(self, name: str, kind: str, help_text: str, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values: Dict[Labels, object] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        if self.kind == "histogram":
+            histogram = self.values.get(labels)
+            if histogram is None:
+                histogram = self.values[labels] = Histogram(self.buckets)
+            histogram.observe(value)
+        else:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def exposition(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for labels, value in sorted(self.values.items()):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), value.counts):
+                cumulative += count
+                le = (("le", _number(bound) if bound != "+Inf" else bound),)
+                lines.append(f"{self.name}_bucket{_labels(labels + le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(value.sum)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels: Labels) -> str:
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Metric(
+            "lifelab_http_requests_total", "counter", "Requests by status"
+        )
+        self.latency = Metric(
+            "lifelab_http_request_duration_seconds",
+            "histogram",
+            "Time to respond, from the middleware",
+            LATENCY_BUCKETS,
+        )
+        self.queries = Metric(
+            "lifelab_http_request_queries",
+            "histogram",
+            "Database queries per request",
+            QUERY_BUCKETS,
+        )
+        self.query_time = Metric(
+            "lifelab_http_request_query_seconds_total",
+            "counter",
+            "Time spent in database queries",
+        )
+        self.phases = {
+            phase: Metric(
+                f"lifelab_http_request_{phase}_seconds_total",
+                "counter",
+                f"Time spent in the {phase} phase",
+            )
+            for phase in PHASES
+        }
+        self.size = Metric(
+            "lifelab_http_response_bytes",
+            "histogram",
+            "Size of response bodies, other than streamed ones",
+            SIZE_BUCKETS,
+        )
+
+    def record(self, route: Labels, status: int, request: "RequestMetrics") -> None:
+        with self._lock:
+            self.requests.observe(route + (("status", str(status)),), 1)
+            self.latency.observe(route, request.duration)
+            self.queries.observe(route, request.queries)
+            self.query_time.observe(route, request.query_time)
+            for phase, seconds in request.phases.items():
+                self.phases[phase].observe(route, seconds)
+            if request.size is not None:
+                self.size.observe(route, request.size)
+
+    def exposition(self) -> str:
+        with self._lock:
+            metrics = [self.requests, self.latency, self.queries, self.query_time]
+            metrics += [*self.phases.values(), self.size]
+            return "\n".join(line for m in metrics for line in m.exposition()) + "\n"
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.size: Optional[int] = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+
+# The metrics of the request being handled on each thread
+_current = threading.local()
+
+
+@contextmanager
+def timed(phase: str):
+    # Adds the time spent in the block to the current request's phase, if any.
+    # Nested blocks of the same phase are only counted once
+    request = getattr(_current, "request", None)
+    if request is None or phase in _current.timing:
+        yield
+        return
+    _current.timing.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.phases[phase] += time.perf_counter() - start
+        _current.timing.discard(phase)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        _current.request = metrics
+        _current.timing = set()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.request = None
+        metrics.duration = time.perf_counter() - metrics.start
+        if not response.streaming:
+            metrics.size = len(response.content)
+
+        match = request.resolver_match
+        route = match.view_name if match else "unmatched"
+        if route != "metrics":
+            registry.record(
+                (("method", request.method), ("route", route)),
+                response.status_code,
+                metrics,
+            )
+            self.check_budgets(request, metrics)
+        return response
+
+    @staticmethod
+    def check_budgets(request, metrics: RequestMetrics) -> None:
+        if (
+            metrics.queries > settings.REQUEST_QUERY_BUDGET
+            or metrics.duration > settings.REQUEST_LATENCY_BUDGET
+        ):
+            logger.warning(
+                "%s %s took %.3f s and %d queries (%.3f s)",
+                request.method,
+                request.get_full_path(),
+                metrics.duration,
+                metrics.queries,
+                metrics.query_time,
+            )
+
+
+def metrics_view(request) -> HttpResponse:
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    return HttpResponse(
+        registry.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,72 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+QUEUE_POSITION_GAP = 1024
+
+
+def populate_queue_items(apps, schema_editor):
+    Lab = apps.get_model('api', 'Lab')
+    Issue = apps.get_model('api', 'Issue')
+    QueueItem = apps.get_model('api', 'QueueItem')
+
+    for lab in Lab.objects.all():
+        open_issue_ids = list(
+            Issue.objects.filter(lab=lab, state='OPEN', deleted=False)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        queue_order = [int(x) for x in lab.queue_order.split(',') if x]
+        # Same reconciliation the serializer used to do on read: queued issues
+        # that are still open first, then any open issues missing from the queue
+        open_issue_id_set = set(open_issue_ids)
+        ordered = [id for id in dict.fromkeys(queue_order) if id in open_issue_id_set]
+        queued = set(ordered)
+        ordered.extend(id for id in open_issue_ids if id not in queued)
+        QueueItem.objects.bulk_create(
+            QueueItem(lab=lab, issue_id=id, position=(i + 1) * QUEUE_POSITION_GAP)
+            for i, id in enumerate(ordered)
+        )
+
+
+def populate_queue_order(apps, schema_editor):
+    Lab = apps.get_model('api', 'Lab')
+    QueueItem = apps.get_model('api', 'QueueItem')
+
+    for lab in Lab.objects.all():
+        issue_ids = QueueItem.objects.filter(lab=lab).values_list('issue_id', flat=True)
+        lab.queue_order = ','.join(str(id) for id in issue_ids)
+        lab.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_auto_20200806_0810'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField()),
+                ('issue', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='queue_item', to='api.Issue')),
+                ('lab', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_items', to='api.Lab')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='queueitem',
+            index=models.Index(fields=['lab', 'position'], name='queue_item_lab_position'),
+        ),
+        migrations.RunPython(populate_queue_items, populate_queue_order),
+        migrations.RemoveField(
+            model_name='lab',
+            name='queue_order',
+        ),
+    ]
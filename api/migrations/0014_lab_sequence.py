@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_queue_item'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('value', models.IntegerField(default=0)),
+                ('lab', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences', to='api.Lab')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='labsequence',
+            constraint=models.UniqueConstraint(fields=('lab', 'name'), name='lab_sequence_unique_name_in_lab'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_lab_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['lab', 'number'], name='check_in_lab_number'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['lab', 'number'], name='experiment_lab_number'),
+        ),
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(fields=['lab', 'number'], name='issue_lab_number'),
+        ),
+        migrations.AddIndex(
+            model_name='issuecomment',
+            index=models.Index(fields=['issue', 'created'], name='issue_comment_issue_created'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+MODIFIED_MODELS = [
+    'checkin',
+    'experiment',
+    'experimentenddatehistoryitem',
+    'experimenttermshistoryitem',
+    'issue',
+    'issuecomment',
+    'issuecommenthistoryitem',
+    'issuedescriptionhistoryitem',
+    'issuestatehistoryitem',
+]
+
+
+def copy_created_to_modified(apps, schema_editor):
+    for model_name in MODIFIED_MODELS:
+        model = apps.get_model('api', model_name)
+        model.objects.update(modified=models.F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lab',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lab',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ] + [
+        migrations.AddField(
+            model_name=model_name,
+            name='modified',
+            field=models.DateTimeField(null=True),
+        )
+        for model_name in MODIFIED_MODELS
+    ] + [
+        migrations.RunPython(copy_created_to_modified, migrations.RunPython.noop),
+    ] + [
+        migrations.AlterField(
+            model_name=model_name,
+            name='modified',
+            field=models.DateTimeField(),
+        )
+        for model_name in MODIFIED_MODELS
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import pytz
+
+
+def populate_local_date(apps, schema_editor):
+    CheckIn = apps.get_model('api', 'CheckIn')
+
+    seen = set()
+    for check_in in CheckIn.objects.select_related('lab').order_by('created', 'pk'):
+        time_zone = pytz.timezone(check_in.lab.time_zone)
+        check_in.local_date = check_in.created.astimezone(time_zone).date()
+        # The old 'today' lookup could create more than one check-in for a day.
+        # Keep the first and archive the rest so that the new constraint holds
+        key = (check_in.lab_id, check_in.local_date)
+        if not check_in.deleted and key in seen:
+            check_in.deleted = True
+        if not check_in.deleted:
+            seen.add(key)
+        check_in.save(update_fields=['local_date', 'deleted'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lab',
+            name='time_zone',
+            field=models.CharField(default='America/Boise', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='checkin',
+            name='local_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_local_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='checkin',
+            name='local_date',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='checkin',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(deleted=False),
+                fields=('lab', 'local_date'),
+                name='check_in_unique_local_date_in_lab',
+            ),
+        ),
+    ]
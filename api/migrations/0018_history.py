@@ -0,0 +1,70 @@
+# Generated by Django 3.0.14 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+HISTORY = [
+    # (parent model, tracked field, history model, history field, parent field)
+    ('Issue', 'description', 'IssueDescriptionHistoryItem', 'description', 'issue'),
+    ('Issue', 'state', 'IssueStateHistoryItem', 'state', 'issue'),
+    ('IssueComment', 'body', 'IssueCommentHistoryItem', 'body', 'comment'),
+    ('Experiment', 'terms', 'ExperimentTermsHistoryItem', 'body', 'experiment'),
+    ('Experiment', 'end_date', 'ExperimentEndDateHistoryItem', 'end_date', 'experiment'),
+]
+
+
+def record_current_values(apps, schema_editor):
+    # Nothing wrote history before, so start each history with the value the
+    # field has now
+    for parent_name, field, history_name, history_field, parent_field in HISTORY:
+        parent = apps.get_model('api', parent_name)
+        history = apps.get_model('api', history_name)
+        rows = parent.objects.values_list('pk', field, 'modified')
+        history.objects.bulk_create(
+            history(
+                **{history_field: value, parent_field + '_id': pk},
+                created=modified,
+                modified=modified,
+            )
+            for pk, value, modified in rows.iterator()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_check_in_local_date'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='issuedescriptionhistoryitem',
+            name='state',
+        ),
+        migrations.AddField(
+            model_name='issuedescriptionhistoryitem',
+            name='description',
+            field=models.CharField(default='', editable=False, max_length=65536),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='issuedescriptionhistoryitem',
+            index=models.Index(fields=['issue', 'created'], name='issue_desc_history_created'),
+        ),
+        migrations.AddIndex(
+            model_name='issuestatehistoryitem',
+            index=models.Index(fields=['issue', 'created'], name='issue_state_history_created'),
+        ),
+        migrations.AddIndex(
+            model_name='issuecommenthistoryitem',
+            index=models.Index(fields=['comment', 'created'], name='comment_history_created'),
+        ),
+        migrations.AddIndex(
+            model_name='experimenttermshistoryitem',
+            index=models.Index(fields=['experiment', 'created'], name='exp_terms_history_created'),
+        ),
+        migrations.AddIndex(
+            model_name='experimentenddatehistoryitem',
+            index=models.Index(fields=['experiment', 'created'], name='exp_end_date_history_created'),
+        ),
+        migrations.RunPython(record_current_values, migrations.RunPython.noop),
+    ]
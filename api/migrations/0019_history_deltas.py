@@ -0,0 +1,58 @@
+# Generated by Django 3.0.14 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experimenttermshistoryitem',
+            name='delta',
+            field=models.CharField(blank=True, default='', editable=False, max_length=65536),
+        ),
+        migrations.AddField(
+            model_name='experimenttermshistoryitem',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='experimenttermshistoryitem',
+            name='text_hash',
+            field=models.CharField(default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='issuecommenthistoryitem',
+            name='delta',
+            field=models.CharField(blank=True, default='', editable=False, max_length=65536),
+        ),
+        migrations.AddField(
+            model_name='issuecommenthistoryitem',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='issuecommenthistoryitem',
+            name='text_hash',
+            field=models.CharField(default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='issuedescriptionhistoryitem',
+            name='delta',
+            field=models.CharField(blank=True, default='', editable=False, max_length=65536),
+        ),
+        migrations.AddField(
+            model_name='issuedescriptionhistoryitem',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='issuedescriptionhistoryitem',
+            name='text_hash',
+            field=models.CharField(default='', editable=False, max_length=16),
+        ),
+    ]
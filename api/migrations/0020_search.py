@@ -0,0 +1,82 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:30
+
+from django.db import migrations
+
+# The search index lives outside the ORM (see api.search), so it's created
+# here with SQL for each supported backend
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE api_search USING fts5("
+    " title, body,"
+    " type UNINDEXED, object_id UNINDEXED, lab_id UNINDEXED, number UNINDEXED,"
+    " tokenize = 'unicode61 remove_diacritics 2')",
+]
+
+POSTGRES_CREATE = [
+    "CREATE TABLE api_search ("
+    " type varchar(16) NOT NULL,"
+    " object_id integer NOT NULL,"
+    " lab_id integer NOT NULL,"
+    " number integer NOT NULL,"
+    " title text NOT NULL,"
+    " body text NOT NULL,"
+    " document tsvector NOT NULL DEFAULT '',"
+    " PRIMARY KEY (type, object_id))",
+    "CREATE INDEX api_search_document ON api_search USING GIN (document)",
+    "CREATE INDEX api_search_lab_id ON api_search (lab_id)",
+]
+
+POPULATE = [
+    "INSERT INTO api_search (type, object_id, lab_id, number, title, body)"
+    " SELECT 'issue', id, lab_id, number, title, description"
+    " FROM api_issue WHERE NOT deleted",
+    "INSERT INTO api_search (type, object_id, lab_id, number, title, body)"
+    " SELECT 'experiment', id, lab_id, number, title,"
+    " description || {newlines} || terms"
+    " FROM api_experiment WHERE NOT deleted",
+    "INSERT INTO api_search (type, object_id, lab_id, number, title, body)"
+    " SELECT 'comment', c.id, i.lab_id, i.number, '', c.body"
+    " FROM api_issuecomment c JOIN api_issue i ON i.id = c.issue_id"
+    " WHERE NOT c.deleted AND NOT i.deleted",
+    "INSERT INTO api_search (type, object_id, lab_id, number, title, body)"
+    " SELECT 'check_in', id, lab_id, number, '', retrospective"
+    " FROM api_checkin WHERE NOT deleted",
+]
+
+POSTGRES_POPULATE_DOCUMENT = (
+    "UPDATE api_search SET document ="
+    " setweight(to_tsvector('english', title), 'A')"
+    " || setweight(to_tsvector('english', body), 'B')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = SQLITE_CREATE + [
+            sql.format(newlines='char(10) || char(10)') for sql in POPULATE
+        ]
+    elif vendor == 'postgresql':
+        statements = POSTGRES_CREATE + [
+            sql.format(newlines="E'\\n\\n'") for sql in POPULATE
+        ] + [POSTGRES_POPULATE_DOCUMENT]
+    else:
+        return
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE api_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_history_deltas'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('record_type', models.CharField(max_length=32)),
+                ('object_id', models.IntegerField()),
+                ('lab', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='api.Lab')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['lab', 'id'], name='change_lab_id'),
+        ),
+    ]
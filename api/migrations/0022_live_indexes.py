@@ -0,0 +1,29 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_change_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(condition=models.Q(deleted=False), fields=['lab', 'number'], name='check_in_live_lab_number'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['lab', 'number'], name='experiment_live_lab_number'),
+        ),
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(condition=models.Q(deleted=False), fields=['lab', 'state'], name='experiment_live_lab_state'),
+        ),
+        migrations.AddIndex(
+            model_name='issue',
+            index=models.Index(condition=models.Q(deleted=False), fields=['lab', 'number'], name='issue_live_lab_number'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def count_comments(apps, schema_editor):
+    Issue = apps.get_model('api', 'Issue')
+    IssueComment = apps.get_model('api', 'IssueComment')
+    comment_count = (
+        IssueComment.objects.filter(issue=OuterRef('pk'), deleted=False)
+        .values('issue')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    Issue.objects.update(comment_count=Coalesce(Subquery(comment_count), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_live_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabStats',
+            fields=[
+                ('lab', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='api.Lab')),
+                ('open_issues', models.IntegerField(default=0)),
+                ('closed_issues', models.IntegerField(default=0)),
+                ('inactive_experiments', models.IntegerField(default=0)),
+                ('active_experiments', models.IntegerField(default=0)),
+                ('committed_experiments', models.IntegerField(default=0)),
+                ('check_ins', models.IntegerField(default=0)),
+                ('complete_check_ins', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('streak', models.IntegerField(default=0)),
+                ('streak_end', models.DateField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='issue',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_lab_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='checkin',
+            name='check_in_lab_number',
+        ),
+        migrations.RemoveIndex(
+            model_name='experiment',
+            name='experiment_lab_number',
+        ),
+        migrations.RemoveIndex(
+            model_name='issue',
+            name='issue_lab_number',
+        ),
+    ]
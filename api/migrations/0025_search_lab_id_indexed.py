@@ -0,0 +1,44 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:40
+
+from django.db import migrations
+
+# On SQLite the lab's id becomes an indexed column of the full-text table, so a
+# lab's search is matched against its own documents rather than filtered out of
+# every lab's matches. FTS5 can't change a column's options in place, so the
+# table is rebuilt
+
+COLUMNS = 'type, object_id, lab_id, number, title, body'
+
+
+def rebuild(schema_editor, lab_id):
+    for sql in [
+        'CREATE VIRTUAL TABLE api_search_new USING fts5('
+        ' title, body,'
+        f' type UNINDEXED, object_id UNINDEXED, {lab_id}, number UNINDEXED,'
+        " tokenize = 'unicode61 remove_diacritics 2')",
+        f'INSERT INTO api_search_new ({COLUMNS}) SELECT {COLUMNS} FROM api_search',
+        'DROP TABLE api_search',
+        'ALTER TABLE api_search_new RENAME TO api_search',
+    ]:
+        schema_editor.execute(sql)
+
+
+def index_lab_id(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        rebuild(schema_editor, 'lab_id')
+
+
+def unindex_lab_id(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        rebuild(schema_editor, 'lab_id UNINDEXED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_drop_plain_number_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_lab_id, unindex_lab_id),
+    ]
@@ -1,9 +1,19 @@
-from typing import List, Dict
+import hashlib
+from bisect import bisect_left
+from datetime import date, datetime
+from typing import Iterable, List, Dict, Optional, Sequence, Tuple
 
-from django.db import models
-from django.db.models.signals import pre_save
+import pytz
+from django.conf import settings
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import Signal
 from django.utils import timezone
 
+from api import delta as deltas
+
 OPEN = "OPEN"
 CLOSED = "CLOSED"
 ISSUE_STATE_CHOICES = [(OPEN, "Open"), (CLOSED, "Closed")]
@@ -11,6 +21,23 @@ ISSUE_STATE_CHOICES = [(OPEN, "Open"), (CLOSED, "Closed")]
 MAX_BODY_TEXT_LENGTH = 65536
 MAX_TITLE_TEXT_LENGTH = 256
 
+MAX_TIME_ZONE_LENGTH = 64
+
+# Sent with lab_id whenever anything in a lab changes
+lab_changed = Signal()
+
+
+def local_date(time_zone: str, value: Optional[datetime] = None) -> date:
+    return timezone.localdate(value, timezone=pytz.timezone(time_zone))
+
+
+# Revisions per snapshot in delta-encoded histories
+SNAPSHOT_INTERVAL = 16
+
+# Spacing between consecutive queue positions, leaving room to move an issue
+# between two others without renumbering its neighbors
+QUEUE_POSITION_GAP = 1024
+
 
 #
 # Mix-ins
@@ -26,32 +53,630 @@ class Deletable(models.Model):
 
 class WithCreatedDateTime(models.Model):
     created = models.DateTimeField()
+    modified = models.DateTimeField()
 
     def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        now = timezone.now()
         if not self.id:
-            self.created = timezone.now()
-        self.modified = timezone.now()
+            self.created = now
+        self.modified = now
         return super(WithCreatedDateTime, self).save(*args, **kwargs)
 
     class Meta:
         abstract = True
 
 
+class WithHistory(models.Model):
+    # Records a history row whenever one of history_fields changes. The values
+    # as of the last load or save are kept on the instance to diff against, so
+    # a save doesn't have to read the row back first.
+    # Maps each tracked field to (related name of its history, history field)
+    history_fields: Dict[str, Tuple[str, str]] = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(WithHistory, cls).from_db(db, field_names, values)
+        instance._history_originals = instance.history_values()
+        return instance
+
+    def history_values(self) -> Dict[str, any]:
+        # Deferred fields aren't loaded, and so are never diffed
+        return {
+            name: self.__dict__[name]
+            for name in self.history_fields
+            if name in self.__dict__
+        }
+
+    def history_changes(
+        self, update_fields: Optional[Iterable[str]] = None
+    ) -> List[models.Model]:
+        # Unsaved history rows for the tracked fields that changed. A new
+        # instance has no originals, so its initial values are recorded
+        originals = getattr(self, "_history_originals", {})
+        items = []
+        for name, value in self.history_values().items():
+            if update_fields is not None and name not in update_fields:
+                continue
+            if name in originals and originals[name] == value:
+                continue
+            related_name, history_field = self.history_fields[name]
+            rel = getattr(type(self), related_name).rel
+            item = rel.related_model(
+                **{history_field: value, rel.field.name: self},
+                created=self.modified,
+                modified=self.modified,
+            )
+            item._previous = originals.get(name)
+            items.append(item)
+        return items
+
+    def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        with transaction.atomic(savepoint=False):
+            result = super(WithHistory, self).save(*args, **kwargs)
+            record_history([self], kwargs.get("update_fields"))
+        return result
+
+    class Meta:
+        abstract = True
+
+
+def record_history(
+    instances: Iterable[WithHistory], update_fields: Optional[Iterable[str]] = None
+) -> None:
+    # Writes the history of saved instances with one insert per history model
+    items: Dict[type, List[models.Model]] = {}
+    for instance in instances:
+        for item in instance.history_changes(update_fields):
+            items.setdefault(type(item), []).append(item)
+        instance._history_originals = instance.history_values()
+    for model, batch in items.items():
+        if issubclass(model, DeltaEncoded):
+            model.encode(batch)
+        model.objects.bulk_create(batch)
+
+
+class DeltaEncoded(models.Model):
+    # History of a long text field, stored as a full snapshot followed by up to
+    # SNAPSHOT_INTERVAL - 1 deltas, each against the revision before it. A
+    # revision is rebuilt from at most that many deltas.
+    # text_field holds the text in snapshots and is empty in deltas
+    text_field: str
+    parent_field: str
+
+    # Deltas since the last snapshot
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    delta = models.CharField(
+        max_length=MAX_BODY_TEXT_LENGTH, default="", blank=True, editable=False
+    )
+    # Hash of the full text, to check a delta's base is the previous revision
+    text_hash = models.CharField(max_length=16, default="", editable=False)
+
+    @classmethod
+    def encode(cls, items: List["DeltaEncoded"]) -> None:
+        # Delta-encodes unsaved items against the text their parent had before,
+        # kept on each item by WithHistory. Falls back to a snapshot when the
+        # last stored revision isn't that text, e.g. after a concurrent edit
+        parent_attname = cls._meta.get_field(cls.parent_field).attname
+        parents = {getattr(item, parent_attname) for item in items}
+        last_pks = (
+            cls.objects.filter(**{f"{parent_attname}__in": parents})
+            .values(parent_attname)
+            .annotate(last=Max("pk"))
+            .values("last")
+        )
+        latest = {
+            parent: (depth, text_hash)
+            for parent, depth, text_hash in cls.objects.filter(
+                pk__in=last_pks
+            ).values_list(parent_attname, "depth", "text_hash")
+        }
+        for item in items:
+            parent = getattr(item, parent_attname)
+            item.encode_from(getattr(item, "_previous", None), latest.get(parent))
+            latest[parent] = (item.depth, item.text_hash)
+
+    def encode_from(self, previous: Optional[str], last: Optional[tuple]) -> None:
+        # last is the (depth, text_hash) of the parent's latest stored revision
+        text = getattr(self, self.text_field)
+        self.text_hash = text_hash(text)
+        self.depth = 0
+        self.delta = ""
+        if (
+            previous is None
+            or last is None
+            or last[1] != text_hash(previous)
+            or last[0] + 1 >= SNAPSHOT_INTERVAL
+        ):
+            return
+        encoded = deltas.dumps(deltas.diff(previous, text))
+        if len(encoded) < len(text):
+            self.depth = last[0] + 1
+            self.delta = encoded
+            setattr(self, self.text_field, "")
+
+    @classmethod
+    def decode(cls, items: List["DeltaEncoded"]) -> None:
+        # Fills in the text of loaded delta items with one query per parent,
+        # reading from the snapshot before the oldest item to the newest
+        parent_attname = cls._meta.get_field(cls.parent_field).attname
+        by_parent: Dict[int, List[DeltaEncoded]] = {}
+        for item in items:
+            if item.depth:
+                by_parent.setdefault(getattr(item, parent_attname), []).append(item)
+        for parent, pending in by_parent.items():
+            siblings = cls.objects.filter(**{parent_attname: parent})
+            start = (
+                siblings.filter(depth=0, pk__lte=min(item.pk for item in pending))
+                .order_by("-pk")
+                .values("pk")[:1]
+            )
+            texts = cls.rebuild(
+                siblings.filter(
+                    pk__gte=Subquery(start), pk__lte=max(item.pk for item in pending)
+                )
+            )
+            for item in pending:
+                setattr(item, item.text_field, texts[item.pk])
+
+    @classmethod
+    def rebuild(cls, queryset) -> Dict[int, str]:
+        # Full texts by pk for a run of one parent's revisions that starts at a
+        # snapshot
+        texts = {}
+        text = ""
+        for pk, depth, value, encoded in queryset.order_by("pk").values_list(
+            "pk", "depth", cls.text_field, "delta"
+        ):
+            text = deltas.apply(text, deltas.loads(encoded)) if depth else value
+            texts[pk] = text
+        return texts
+
+    @classmethod
+    def compact(cls, dry_run: bool = False) -> Tuple[int, int]:
+        # Re-encodes every stored history, e.g. rows written as full copies
+        # before deltas were used. Returns the stored text length before and
+        # after
+        parent_attname = cls._meta.get_field(cls.parent_field).attname
+        parents = (
+            cls.objects.order_by(parent_attname)
+            .values_list(parent_attname, flat=True)
+            .distinct()
+        )
+        before = after = 0
+        for parent in parents.iterator():
+            with transaction.atomic():
+                items = list(
+                    cls.objects.select_for_update()
+                    .filter(**{parent_attname: parent})
+                    .order_by("pk")
+                )
+                texts = cls.rebuild(cls.objects.filter(**{parent_attname: parent}))
+                previous = last = None
+                for item in items:
+                    before += len(getattr(item, cls.text_field)) + len(item.delta)
+                    setattr(item, cls.text_field, texts[item.pk])
+                    item.encode_from(previous, last)
+                    after += len(getattr(item, cls.text_field)) + len(item.delta)
+                    previous = texts[item.pk]
+                    last = (item.depth, item.text_hash)
+                if not dry_run:
+                    cls.objects.bulk_update(
+                        items, [cls.text_field, "depth", "delta", "text_hash"]
+                    )
+        return before, after
+
+    class Meta:
+        abstract = True
+
+
+def text_hash(text: str) -> str:
+    return hashlib.md5(text.encode()).hexdigest()[:16]
+
+
+class NumberedInLab(models.Model):
+    # Subclasses define `number` and `lab`; new instances get the next number in
+    # their lab from LabSequence, in the same transaction as the insert
+
+    def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        if self.pk:
+            return super(NumberedInLab, self).save(*args, **kwargs)
+        with transaction.atomic():
+            self.number = LabSequence.allocate(self.lab_id, self._meta.model_name)
+            return super(NumberedInLab, self).save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class Counted(models.Model):
+    # Keeps counters on other rows, like LabStats, up to date as instances are
+    # written, so that reads don't have to count. counters() lists the
+    # (model, pk, field) counters an instance adds one to given the values of
+    # its counted_fields; those as of the last load or save are kept on the
+    # instance to diff against, as with WithHistory
+    counted_fields: Tuple[str, ...] = ("deleted",)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Counted, cls).from_db(db, field_names, values)
+        instance._counted_originals = instance.counted_values()
+        return instance
+
+    def counted_values(self) -> Optional[Dict[str, any]]:
+        # None if any are deferred, as when deletions collect related rows
+        if any(name not in self.__dict__ for name in self.counted_fields):
+            return None
+        return {name: self.__dict__[name] for name in self.counted_fields}
+
+    def counters(self, values: Dict[str, any]) -> Tuple[Tuple[type, int, str], ...]:
+        raise NotImplementedError
+
+    def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        with transaction.atomic(savepoint=False):
+            if not self._state.adding:
+                self.lock_counted()
+            result = super(Counted, self).save(*args, **kwargs)
+            update_counters([self])
+        return result
+
+    def lock_counted(self) -> None:
+        # Locks the row, and diffs against what it holds now rather than what
+        # it held when it was loaded, so that of concurrent writers making the
+        # same change only the first counts it. The UPDATE only matches while
+        # the row is as loaded; otherwise its values are read back, or None
+        # if it's gone
+        originals = getattr(self, "_counted_originals", None)
+        if not originals:
+            return
+        rows = type(self)._base_manager.filter(pk=self.pk)
+        if not rows.filter(**originals).update(**originals):
+            self._counted_originals = locked_counted_values(type(self), [self.pk]).get(
+                self.pk
+            )
+
+    @classmethod
+    def lock_deletion(cls, sender, instance, **kwargs) -> None:
+        instance.lock_counted()
+
+    @classmethod
+    def count_deletion(cls, sender, instance, **kwargs) -> None:
+        update_counters([instance], removed=True)
+
+    class Meta:
+        abstract = True
+
+
+def lock_rows(rows: models.QuerySet, field: str) -> models.QuerySet:
+    # rows, to read locked until the transaction ends. SQLite has no row locks,
+    # so there a no-op UPDATE of field takes the database write lock before
+    # they're read, as in LabSequence.reserve. Reading first would pin the
+    # transaction to a snapshot that a concurrent commit makes too old to write
+    if connection.features.has_select_for_update:
+        return rows.select_for_update()
+    rows.update(**{field: F(field)})
+    return rows
+
+
+def locked_counted_values(model, pks: List[int]) -> Dict[int, Dict[str, any]]:
+    # The counted values of rows, locked until the transaction ends
+    rows = lock_rows(model._base_manager.filter(pk__in=pks), model.counted_fields[0])
+    return {row.pop("pk"): row for row in rows.values("pk", *model.counted_fields)}
+
+
+def update_counters(instances: Iterable[Counted], removed: bool = False) -> None:
+    # Applies what changed in the counters of saved (or removed) instances,
+    # with one update per counted row
+    deltas: Dict[Tuple[type, int], Dict[str, int]] = {}
+    for instance in instances:
+        # New instances have no originals, and loads that deferred a counted
+        # field can't be diffed
+        originals = getattr(instance, "_counted_originals", {})
+        values = instance.counted_values()
+        if originals is None or values is None or (originals == values and not removed):
+            instance._counted_originals = values
+            continue
+        previous = instance.counters(originals) if originals else ()
+        current = () if removed else instance.counters(values)
+        for counters, step in [(previous, -1), (current, 1)]:
+            for model, pk, field in counters:
+                fields = deltas.setdefault((model, pk), {})
+                fields[field] = fields.get(field, 0) + step
+        instance._counted_originals = values
+    for (model, pk), fields in deltas.items():
+        fields = {name: delta for name, delta in fields.items() if delta}
+        if not fields:
+            continue
+        updated = model.objects.filter(pk=pk).update(
+            **{name: F(name) + delta for name, delta in fields.items()}
+        )
+        if updated and model is LabStats and "complete_check_ins" in fields:
+            LabStats.objects.filter(pk=pk).update(**LabStats.latest_streak(pk))
+
+
 #
 # Models
 #
 
 
 class Lab(models.Model):
-    queue_order = models.TextField(default="")
+    # Bumped whenever the lab or anything in it changes, for conditional GETs.
+    # Only ever written through touch(), so that increments are atomic
+    version = models.BigIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
+    # Decides which day a check-in belongs to
+    time_zone = models.CharField(
+        max_length=MAX_TIME_ZONE_LENGTH, default=settings.TIME_ZONE
+    )
+
+    def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Don't write back a version that touch() may have moved past
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ("version", "modified")
+            ]
+        return super(Lab, self).save(*args, **kwargs)
+
+    @classmethod
+    def touch(cls, lab_id: int, changes: Iterable[Tuple[type, int]] = ()) -> None:
+        # Also logs the changed records, given as (model, pk). The lab's row
+        # stays locked from the update until the transaction commits, so each
+        # lab's log entries commit in the order of their ids
+        with transaction.atomic():
+            cls.objects.filter(pk=lab_id).update(
+                version=F("version") + 1, modified=timezone.now()
+            )
+            Change.objects.bulk_create(
+                Change(lab_id=lab_id, record_type=model._meta.model_name, object_id=pk)
+                for model, pk in dict.fromkeys(changes)
+            )
+        lab_changed.send(sender=cls, lab_id=lab_id)
+
+    @classmethod
+    def touch_on_change(cls, sender, instance, action=None, **kwargs) -> None:
+        # Also connected to m2m_changed, which sends pre_* and post_* actions
+        if action is not None and not action.startswith("post_"):
+            return
+        changes = [(type(instance), instance.pk)]
+        if action is not None:
+            # The other side of the relation changed too
+            changes.extend((kwargs["model"], pk) for pk in kwargs["pk_set"] or ())
+        if getattr(instance, "_queue_changed", False):
+            changes.append((Lab, instance.lab_id))
+        if isinstance(instance, Lab):
+            cls.touch(instance.pk, changes)
+        elif isinstance(instance, IssueComment):
+            cls.touch(instance.issue.lab_id, changes)
+        else:
+            cls.touch(instance.lab_id, changes)
+
+    @classmethod
+    def delete_changes(cls, sender, instance, **kwargs) -> None:
+        # A deleted lab's comments are deleted after its change log, logging
+        # their deletion again. Foreign keys are only checked on commit
+        Change.objects.filter(lab=instance.pk).delete()
+
+    @classmethod
+    def lock(cls, lab_id: int) -> None:
+        # Makes writers of the lab's queue take turns, until the transaction ends
+        lock_rows(cls.objects.filter(pk=lab_id), "version").values_list("pk").get()
+
+    def set_queue(self, issue_ids: Sequence[int]) -> None:
+        with transaction.atomic():
+            Lab.lock(self.pk)
+            items = {
+                item.issue_id: item
+                for item in QueueItem.objects.select_for_update().filter(lab=self)
+            }
+            # Issues that aren't queued (closed, deleted or unknown) are ignored,
+            # and queued issues missing from issue_ids keep their relative order
+            # after the given ones
+            ordered = [
+                items.pop(issue_id)
+                for issue_id in dict.fromkeys(issue_ids)
+                if issue_id in items
+            ]
+            ordered.extend(sorted(items.values(), key=lambda item: item.position))
+            QueueItem.reorder(ordered)
+            Lab.touch(self.pk, [(Lab, self.pk)])
+
+    def move_in_queue(
+        self, issue_id: int, before: Optional[int] = None, after: Optional[int] = None
+    ) -> None:
+        # Moves a queued issue to just before or after another. Moves are
+        # relative to where the other issue is when they're applied, so that
+        # concurrent moves of different issues all take effect
+        with transaction.atomic():
+            # Queue moves in a lab take turns, so no two get the same gap
+            Lab.lock(self.pk)
+            QueueItem.move(self.pk, issue_id, before, after)
+            Lab.touch(self.pk, [(Lab, self.pk)])
+
+
+class LabSequence(models.Model):
+    lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name="sequences")
+    name = models.CharField(max_length=32)
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lab", "name"], name="lab_sequence_unique_name_in_lab"
+            ),
+        ]
+
+    @classmethod
+    def allocate(cls, lab_id: int, name: str) -> int:
+        return cls.reserve(lab_id, name, 1)[0]
+
+    @classmethod
+    def reserve(cls, lab_id: int, name: str, count: int) -> range:
+        # The UPDATE takes the row (or, on SQLite, database) write lock before
+        # reading the new value back, so concurrent callers are serialized
+        with transaction.atomic():
+            sequence = cls.objects.filter(lab_id=lab_id, name=name)
+            if not sequence.update(value=F("value") + count):
+                cls._create(lab_id, name)
+                sequence.update(value=F("value") + count)
+            value = sequence.values_list("value", flat=True).get()
+        return range(value - count + 1, value + 1)
+
+    @classmethod
+    def _create(cls, lab_id: int, name: str) -> None:
+        # Labs that predate the sequence (or an import) may already have numbered
+        # rows, so start after the highest one
+        model = cls._meta.apps.get_model(cls._meta.app_label, name)
+        last = model.objects.filter(lab_id=lab_id).aggregate(Max("number"))
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    lab_id=lab_id, name=name, value=last["number__max"] or 0
+                )
+        except IntegrityError:
+            # Created concurrently
+            pass
+
+
+class LabStats(models.Model):
+    # Counts of a lab's live records, kept up to date by Counted. A lab's row
+    # is only built, by rebuild(), the first time its stats are read; until
+    # then there's no row for the counters to update
+    lab = models.OneToOneField(
+        Lab, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    open_issues = models.IntegerField(default=0)
+    closed_issues = models.IntegerField(default=0)
+    inactive_experiments = models.IntegerField(default=0)
+    active_experiments = models.IntegerField(default=0)
+    committed_experiments = models.IntegerField(default=0)
+    check_ins = models.IntegerField(default=0)
+    complete_check_ins = models.IntegerField(default=0)
+    # Live comments, including those on archived issues
+    comments = models.IntegerField(default=0)
+    # The latest run of consecutive days with complete check-ins
+    streak = models.IntegerField(default=0)
+    streak_end = models.DateField(null=True)
+
+    COUNTERS = [
+        "open_issues",
+        "closed_issues",
+        "inactive_experiments",
+        "active_experiments",
+        "committed_experiments",
+        "check_ins",
+        "complete_check_ins",
+        "comments",
+    ]
+
+    @classmethod
+    def for_lab(cls, lab_id: int) -> "LabStats":
+        stats = cls.objects.filter(lab_id=lab_id).first()
+        if stats is None:
+            stats = cls.rebuild(lab_id)
+        return stats
+
+    @classmethod
+    def count(cls, lab_id: int) -> Dict[str, any]:
+        # The lab's stats counted from scratch
+        issues = Issue.objects.filter(lab_id=lab_id, deleted=False).aggregate(
+            open_issues=Count("pk", filter=Q(state=OPEN)),
+            closed_issues=Count("pk", filter=Q(state=CLOSED)),
+        )
+        experiments = Experiment.objects.filter(lab_id=lab_id, deleted=False).aggregate(
+            **{
+                f"{state.lower()}_experiments": Count("pk", filter=Q(state=state))
+                for state, _ in Experiment.STATE_CHOICES
+            }
+        )
+        check_ins = CheckIn.objects.filter(lab_id=lab_id, deleted=False).aggregate(
+            check_ins=Count("pk"),
+            complete_check_ins=Count("pk", filter=Q(complete=True)),
+        )
+        comments = IssueComment.objects.filter(
+            issue__lab_id=lab_id, deleted=False
+        ).count()
+        return {
+            **issues,
+            **experiments,
+            **check_ins,
+            "comments": comments,
+            **cls.latest_streak(lab_id),
+        }
+
+    @staticmethod
+    def latest_streak(lab_id: int) -> Dict[str, any]:
+        # Reads back from the latest complete check-in, one row per day of the
+        # streak, off the (lab, local_date) index
+        dates = (
+            CheckIn.objects.filter(lab_id=lab_id, deleted=False, complete=True)
+            .order_by("-local_date")
+            .values_list("local_date", flat=True)
+        )
+        end = None
+        length = 0
+        for day in dates.iterator():
+            if end is not None and (end - day).days != length:
+                break
+            end = end or day
+            length += 1
+        return {"streak": length, "streak_end": end}
+
+    @classmethod
+    def rebuild(cls, lab_id: int) -> "LabStats":
+        # Recounts the lab's stats and its issues' comment counts
+        with transaction.atomic():
+            comment_count = (
+                IssueComment.objects.filter(issue=OuterRef("pk"), deleted=False)
+                .values("issue")
+                .annotate(count=Count("pk"))
+                .values("count")
+            )
+            Issue.objects.filter(lab_id=lab_id).update(
+                comment_count=Coalesce(Subquery(comment_count), 0)
+            )
+            stats, _ = cls.objects.update_or_create(
+                lab_id=lab_id, defaults=cls.count(lab_id)
+            )
+        return stats
+
+    def current_streak(self, today: date) -> int:
+        # A streak that ended yesterday still counts until today's check-in is due
+        if self.streak_end is None or (today - self.streak_end).days > 1:
+            return 0
+        return self.streak
+
 
+class Issue(WithHistory, Counted, NumberedInLab, Deletable, WithCreatedDateTime):
+    history_fields = {
+        "description": ("description_history", "description"),
+        "state": ("state_history", "state"),
+    }
 
-class Issue(Deletable, WithCreatedDateTime):
     state = models.CharField(max_length=10, choices=ISSUE_STATE_CHOICES, default=OPEN)
     title = models.CharField(max_length=MAX_TITLE_TEXT_LENGTH)
     description = models.CharField(max_length=MAX_BODY_TEXT_LENGTH, default="")
     number = models.IntegerField(default=1, editable=False)
     lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name="issues")
+    # Live comments, counted by IssueComment.counters()
+    comment_count = models.IntegerField(default=0, editable=False)
+
+    def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Don't write back a count that comments may have moved past
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "comment_count"
+            ]
+        return super(Issue, self).save(*args, **kwargs)
+
+    counted_fields = ("deleted", "state")
+
+    def counters(self, values: Dict[str, any]) -> Tuple[Tuple[type, int, str], ...]:
+        if values["deleted"]:
+            return ()
+        return ((LabStats, self.lab_id, f"{values['state'].lower()}_issues"),)
 
     class Meta:
         constraints = [
@@ -62,21 +687,217 @@ class Issue(Deletable, WithCreatedDateTime):
                 check=models.Q(number__gte=1), name="issue_number_gte_1"
             ),
         ]
+        indexes = [
+            # Lists only show live records, so most queries are for those
+            models.Index(
+                fields=["lab", "number"],
+                condition=models.Q(deleted=False),
+                name="issue_live_lab_number",
+            ),
+        ]
+
+
+class QueueItem(models.Model):
+    lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name="queue_items")
+    issue = models.OneToOneField(
+        Issue, on_delete=models.CASCADE, related_name="queue_item"
+    )
+    position = models.BigIntegerField()
+
+    class Meta:
+        ordering = ["position"]
+        indexes = [
+            models.Index(fields=["lab", "position"], name="queue_item_lab_position")
+        ]
 
     @classmethod
-    def generate_number(cls, sender, instance, **kwargs) -> None:
-        if not instance.pk:
-            try:
-                instance.number = (
-                    cls.objects.filter(lab=instance.lab).order_by("-number")[0].number
-                    + 1
-                )
-            except IndexError:
-                pass
+    def sync_issue(cls, sender, instance, created, **kwargs) -> None:
+        # Flags the issue for Lab.touch_on_change, which runs after this, when
+        # the lab's queue changed
+        instance._queue_changed = False
+        if instance.state == OPEN and not instance.deleted:
+            if created or not cls.objects.filter(issue=instance).exists():
+                cls.append([instance])
+                instance._queue_changed = True
+        elif not created:
+            deleted, _ = cls.objects.filter(issue=instance).delete()
+            instance._queue_changed = bool(deleted)
 
+    @classmethod
+    def sync_issues(cls, issues: List[Issue]) -> bool:
+        # Bulk counterpart of sync_issue, for issues written without save().
+        # Returns whether the queue changed
+        queued = {
+            issue.pk: issue
+            for issue in issues
+            if issue.state == OPEN and not issue.deleted
+        }
+        deleted, _ = cls.objects.filter(
+            issue__in=[issue.pk for issue in issues if issue.pk not in queued]
+        ).delete()
+        existing = set(
+            cls.objects.filter(issue__in=list(queued)).values_list(
+                "issue_id", flat=True
+            )
+        )
+        appended = [issue for pk, issue in queued.items() if pk not in existing]
+        cls.append(appended)
+        return bool(deleted or appended)
 
-class IssueDescriptionHistoryItem(WithCreatedDateTime):
-    state = models.CharField(max_length=10, choices=ISSUE_STATE_CHOICES, editable=False)
+    @classmethod
+    def append(cls, issues: List[Issue]) -> None:
+        if not issues:
+            return
+        lab_id = issues[0].lab_id
+        with transaction.atomic(savepoint=False):
+            # Or concurrent appends would read the same last position
+            Lab.lock(lab_id)
+            last = cls.objects.filter(lab_id=lab_id).aggregate(Max("position"))
+            start = last["position__max"] or 0
+            cls.objects.bulk_create(
+                cls(lab_id=lab_id, issue=issue, position=start + QUEUE_POSITION_GAP * i)
+                for i, issue in enumerate(issues, 1)
+            )
+
+    @classmethod
+    def move(
+        cls,
+        lab_id: int,
+        issue_id: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> None:
+        # Writes only the moved item's position, halfway between its new
+        # neighbors, unless they have no room left between them
+        anchor_id = before if before is not None else after
+        items = (
+            cls.objects.select_for_update()
+            .filter(lab_id=lab_id)
+            .in_bulk([issue_id, anchor_id], field_name="issue_id")
+        )
+        for queued_id in [issue_id, anchor_id]:
+            if queued_id not in items:
+                raise cls.DoesNotExist(f"Issue {queued_id} isn't in the queue.")
+        if issue_id == anchor_id:
+            return
+        item, anchor = items[issue_id], items[anchor_id]
+
+        others = cls.objects.filter(lab_id=lab_id).exclude(pk=item.pk)
+        if before is not None:
+            left = (
+                others.filter(position__lt=anchor.position)
+                .order_by("-position")
+                .values_list("position", flat=True)
+                .first()
+            )
+            right = anchor.position
+        else:
+            left = anchor.position
+            right = (
+                others.filter(position__gt=anchor.position)
+                .order_by("position")
+                .values_list("position", flat=True)
+                .first()
+            )
+        position = _between(left, right)
+        if position is not None:
+            item.position = position
+            item.save(update_fields=["position"])
+            return
+
+        ordered = list(others.select_for_update())
+        index = next(i for i, other in enumerate(ordered) if other.pk == anchor.pk)
+        ordered.insert(index if before is not None else index + 1, item)
+        cls.reorder(ordered)
+
+    @classmethod
+    def reorder(cls, ordered: List["QueueItem"]) -> None:
+        # Items on a longest increasing run of current positions stay where they
+        # are; only the others get new positions in the gaps between them
+        fixed = _longest_increasing_indices([item.position for item in ordered])
+        positions = _fill_positions(ordered, fixed)
+        if positions is None:
+            positions = [(i + 1) * QUEUE_POSITION_GAP for i in range(len(ordered))]
+
+        moved = []
+        for item, position in zip(ordered, positions):
+            if item.position != position:
+                item.position = position
+                moved.append(item)
+        cls.objects.bulk_update(moved, ["position"])
+
+
+def _longest_increasing_indices(values: Sequence[int]) -> set:
+    tails: List[int] = []
+    tail_indices: List[int] = []
+    previous: List[Optional[int]] = []
+    for i, value in enumerate(values):
+        j = bisect_left(tails, value)
+        if j == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[j] = value
+            tail_indices[j] = i
+        previous.append(tail_indices[j - 1] if j > 0 else None)
+
+    indices = set()
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.add(i)
+        i = previous[i]
+    return indices
+
+
+def _between(left: Optional[int], right: Optional[int]) -> Optional[int]:
+    # A position between two neighbors, either of which may be missing at the
+    # ends of the queue. None if they're adjacent
+    if left is None:
+        return right - QUEUE_POSITION_GAP
+    if right is None:
+        return left + QUEUE_POSITION_GAP
+    if right - left < 2:
+        return None
+    return left + (right - left) // 2
+
+
+def _fill_positions(ordered: List[QueueItem], fixed: set) -> Optional[List[int]]:
+    positions: List[Optional[int]] = [
+        item.position if i in fixed else None for i, item in enumerate(ordered)
+    ]
+    i = 0
+    while i < len(positions):
+        if positions[i] is not None:
+            i += 1
+            continue
+        end = i
+        while end < len(positions) and positions[end] is None:
+            end += 1
+        count = end - i
+        left = positions[i - 1] if i > 0 else None
+        right = positions[end] if end < len(positions) else None
+        if left is None and right is None:
+            return None
+        if right is None:
+            run = [left + QUEUE_POSITION_GAP * (j + 1) for j in range(count)]
+        elif left is None:
+            run = [right - QUEUE_POSITION_GAP * (count - j) for j in range(count)]
+        else:
+            step = (right - left) // (count + 1)
+            if step < 1:
+                # No room left between the neighbors, renumber everything
+                return None
+            run = [left + step * (j + 1) for j in range(count)]
+        positions[i:end] = run
+        i = end
+    return positions
+
+
+class IssueDescriptionHistoryItem(DeltaEncoded, WithCreatedDateTime):
+    text_field = "description"
+    parent_field = "issue"
+
+    description = models.CharField(max_length=MAX_BODY_TEXT_LENGTH, editable=False)
     issue = models.ForeignKey(
         Issue,
         on_delete=models.CASCADE,
@@ -84,6 +905,11 @@ class IssueDescriptionHistoryItem(WithCreatedDateTime):
         editable=False,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["issue", "created"], name="issue_desc_history_created")
+        ]
+
 
 class IssueStateHistoryItem(WithCreatedDateTime):
     state = models.CharField(max_length=10, choices=ISSUE_STATE_CHOICES, editable=False)
@@ -91,20 +917,57 @@ class IssueStateHistoryItem(WithCreatedDateTime):
         Issue, on_delete=models.CASCADE, related_name="state_history"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["issue", "created"], name="issue_state_history_created"
+            )
+        ]
+
+
+class IssueComment(WithHistory, Counted, Deletable, WithCreatedDateTime):
+    history_fields = {"body": ("history", "body")}
 
-class IssueComment(Deletable, WithCreatedDateTime):
     body = models.CharField(max_length=MAX_BODY_TEXT_LENGTH)
     issue = models.ForeignKey(Issue, on_delete=models.CASCADE, related_name="comments")
 
+    def counters(self, values: Dict[str, any]) -> Tuple[Tuple[type, int, str], ...]:
+        if values["deleted"]:
+            return ()
+        return (
+            (LabStats, self.issue.lab_id, "comments"),
+            (Issue, self.issue_id, "comment_count"),
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["issue", "created"], name="issue_comment_issue_created"
+            )
+        ]
+
+
+class IssueCommentHistoryItem(DeltaEncoded, WithCreatedDateTime):
+    text_field = "body"
+    parent_field = "comment"
 
-class IssueCommentHistoryItem(WithCreatedDateTime):
     body = models.CharField(max_length=MAX_BODY_TEXT_LENGTH, editable=False)
     comment = models.ForeignKey(
         IssueComment, on_delete=models.CASCADE, related_name="history"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["comment", "created"], name="comment_history_created")
+        ]
+
+
+class Experiment(WithHistory, Counted, NumberedInLab, Deletable, WithCreatedDateTime):
+    history_fields = {
+        "terms": ("terms_history", "body"),
+        "end_date": ("end_date_history", "end_date"),
+    }
 
-class Experiment(Deletable, WithCreatedDateTime):
     INACTIVE = "INACTIVE"
     ACTIVE = "ACTIVE"
     COMMITTED = "COMMITTED"
@@ -131,20 +994,32 @@ class Experiment(Deletable, WithCreatedDateTime):
                 check=models.Q(number__gte=1), name="experiment_number_gte_1"
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["lab", "number"],
+                condition=models.Q(deleted=False),
+                name="experiment_live_lab_number",
+            ),
+            # For the active experiments a new check-in starts with
+            models.Index(
+                fields=["lab", "state"],
+                condition=models.Q(deleted=False),
+                name="experiment_live_lab_state",
+            ),
+        ]
 
-    @classmethod
-    def generate_number(cls, sender, instance, **kwargs) -> None:
-        if not instance.pk:
-            try:
-                instance.number = (
-                    cls.objects.filter(lab=instance.lab).order_by("-number")[0].number
-                    + 1
-                )
-            except IndexError:
-                pass
+    counted_fields = ("deleted", "state")
+
+    def counters(self, values: Dict[str, any]) -> Tuple[Tuple[type, int, str], ...]:
+        if values["deleted"]:
+            return ()
+        return ((LabStats, self.lab_id, f"{values['state'].lower()}_experiments"),)
 
 
-class ExperimentTermsHistoryItem(WithCreatedDateTime):
+class ExperimentTermsHistoryItem(DeltaEncoded, WithCreatedDateTime):
+    text_field = "body"
+    parent_field = "experiment"
+
     body = models.CharField(max_length=MAX_BODY_TEXT_LENGTH, editable=False)
     experiment = models.ForeignKey(
         Experiment,
@@ -153,6 +1028,13 @@ class ExperimentTermsHistoryItem(WithCreatedDateTime):
         editable=False,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["experiment", "created"], name="exp_terms_history_created"
+            )
+        ]
+
 
 class ExperimentEndDateHistoryItem(WithCreatedDateTime):
     end_date = models.DateField(editable=False)
@@ -163,8 +1045,15 @@ class ExperimentEndDateHistoryItem(WithCreatedDateTime):
         editable=False,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["experiment", "created"], name="exp_end_date_history_created"
+            )
+        ]
+
 
-class CheckIn(WithCreatedDateTime, Deletable):
+class CheckIn(Counted, NumberedInLab, WithCreatedDateTime, Deletable):
     lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name="check_ins")
     experiments = models.ManyToManyField(
         Experiment, related_name="check_ins", blank=True
@@ -172,29 +1061,72 @@ class CheckIn(WithCreatedDateTime, Deletable):
     retrospective = models.CharField(max_length=MAX_BODY_TEXT_LENGTH, blank=True)
     number = models.IntegerField(editable=False, default=1)
     complete = models.BooleanField(default=False)
+    # The day this check-in is for, in its lab's time zone
+    local_date = models.DateField(editable=False)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["number", "lab"], name="check_in_unique_number_in_lab"
             ),
+            models.UniqueConstraint(
+                fields=["lab", "local_date"],
+                condition=models.Q(deleted=False),
+                name="check_in_unique_local_date_in_lab",
+            ),
             models.CheckConstraint(
                 check=models.Q(number__gte=1), name="check_in_number_gte_1"
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["lab", "number"],
+                condition=models.Q(deleted=False),
+                name="check_in_live_lab_number",
+            ),
+        ]
 
-    @classmethod
-    def generate_number(cls, sender, instance, **kwargs) -> None:
-        if not instance.pk:
-            try:
-                instance.number = (
-                    cls.objects.filter(lab=instance.lab).order_by("-number")[0].number
-                    + 1
-                )
-            except IndexError:
-                pass
+    def save(self, *args: List[any], **kwargs: Dict[str, any]):
+        if self.local_date is None:
+            self.local_date = local_date(self.lab.time_zone)
+        return super(CheckIn, self).save(*args, **kwargs)
+
+    counted_fields = ("deleted", "complete")
+
+    def counters(self, values: Dict[str, any]) -> Tuple[Tuple[type, int, str], ...]:
+        if values["deleted"]:
+            return ()
+        if values["complete"]:
+            return (
+                (LabStats, self.lab_id, "check_ins"),
+                (LabStats, self.lab_id, "complete_check_ins"),
+            )
+        return ((LabStats, self.lab_id, "check_ins"),)
+
+
+class Change(models.Model):
+    # Log of the records changed in each lab, for clients to sync from. Ids are
+    # the sync tokens; a client that has seen up to one only needs the lab's
+    # entries after it
+    id = models.BigAutoField(primary_key=True)
+    lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name="changes")
+    # The changed record's model name
+    record_type = models.CharField(max_length=32)
+    object_id = models.IntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=["lab", "id"], name="change_lab_id")]
 
 
-pre_save.connect(Issue.generate_number, sender=Issue)
-pre_save.connect(Experiment.generate_number, sender=Experiment)
-pre_save.connect(CheckIn.generate_number, sender=CheckIn)
+post_save.connect(QueueItem.sync_issue, sender=Issue)
+post_save.connect(Lab.touch_on_change, sender=Lab)
+post_save.connect(Lab.touch_on_change, sender=Issue)
+post_save.connect(Lab.touch_on_change, sender=Experiment)
+post_save.connect(Lab.touch_on_change, sender=CheckIn)
+post_save.connect(Lab.touch_on_change, sender=IssueComment)
+post_delete.connect(Lab.touch_on_change, sender=IssueComment)
+pre_delete.connect(Counted.lock_deletion, sender=IssueComment)
+post_delete.connect(Counted.count_deletion, sender=IssueComment)
+post_delete.connect(Lab.delete_changes, sender=Lab)
+m2m_changed.connect(Lab.touch_on_change, sender=Experiment.issues.through)
+m2m_changed.connect(Lab.touch_on_change, sender=CheckIn.experiments.through)
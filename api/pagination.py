@@ -0,0 +1,32 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    # Only paginates when the client asks for it with a cursor or page size, so
+    # existing clients keep getting the whole list
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.cursor_query_param not in request.query_params
+            and self.page_size_query_param not in request.query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class NumberCursorPagination(OptionalCursorPagination):
+    ordering = "number"
+
+
+class CreatedCursorPagination(OptionalCursorPagination):
+    ordering = "created"
+
+
+class HistoryCursorPagination(CursorPagination):
+    # Histories only grow, so they're always paginated, newest first
+    ordering = "-created"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 1000
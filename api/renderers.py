@@ -0,0 +1,51 @@
+from djangorestframework_camel_case import render
+from djangorestframework_camel_case.settings import api_settings
+from djangorestframework_camel_case.util import camelize
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.metrics import timed
+from api.rows import Prepared, dumps
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class CamelCaseJSONRenderer(render.CamelCaseJSONRenderer):
+    # Encodes data built by a RowSerializer as it is, rather than walking it to
+    # rename keys that are already camelCase
+    renders_prepared = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed("render"):
+            return self.render_data(data, accepted_media_type, renderer_context)
+
+    def render_data(self, data, accepted_media_type, renderer_context):
+        if not isinstance(data, Prepared):
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is None:
+            return dumps(data.data)
+        return super().render(data.data, accepted_media_type, renderer_context)
+
+
+class CamelCaseMessagePackRenderer(BaseRenderer):
+    # The same data as CamelCaseJSONRenderer, for clients that ask for it.
+    # Only listed in DEFAULT_RENDERER_CLASSES when msgpack is installed
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+    renders_prepared = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        with timed("render"):
+            if isinstance(data, Prepared):
+                data = data.data
+            else:
+                data = camelize(data, **api_settings.JSON_UNDERSCOREIZE)
+            # Dates and the like become what they would in JSON
+            return msgpack.packb(data, default=JSONEncoder().default)
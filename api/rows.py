@@ -0,0 +1,192 @@
+import json
+import re
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import Model, QuerySet
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import iri_to_uri
+from djangorestframework_camel_case.util import camelize_re, underscore_to_camel
+
+from api.metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Read-only serialization straight from .values() rows, for the lab endpoints
+# clients poll. Each RowSerializer mirrors a DRF serializer's output exactly
+# (see RowSerializerParityTest), but formats hyperlinks from a URL reversed once
+# per response rather than once per link, and emits camelCase keys so the
+# renderer doesn't have to walk the response to rename them
+
+Row = Dict[str, Any]
+
+
+def camel_case(name: str) -> str:
+    # The renaming CamelCaseJSONRenderer does
+    return re.sub(camelize_re, underscore_to_camel, name)
+
+
+def dumps(data) -> bytes:
+    # What DRF's JSONRenderer outputs with this project's settings: compact
+    # UTF-8, with no NaN, using orjson when it's installed
+    if orjson is not None:
+        content = orjson.dumps(data)
+    else:
+        content = json.dumps(
+            data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode()
+    # Escaped by JSONRenderer too, for JSON that is also valid JavaScript
+    return content.replace("\u2028".encode(), b"\\u2028").replace(
+        "\u2029".encode(), b"\\u2029"
+    )
+
+
+class Prepared:
+    # Response data built from rows, with camelCase keys and JSON values, for
+    # api.renderers.CamelCaseJSONRenderer to encode as it is
+    def __init__(self, data):
+        self.data = data
+
+
+class Field:
+    # columns are the .values() a field reads. bind() returns a function of a
+    # row, given the rows of the response, so that fields can fetch what they
+    # need for all of them at once
+    columns: List[str] = []
+
+    def bind(self, request, model, rows: List[Row]) -> Callable[[Row], Any]:
+        raise NotImplementedError
+
+
+class Column(Field):
+    def __init__(self, column: str):
+        self.columns = [column]
+
+    def bind(self, request, model, rows: List[Row]) -> Callable[[Row], Any]:
+        return itemgetter(self.columns[0])
+
+
+class DateColumn(Column):
+    def bind(self, request, model, rows: List[Row]) -> Callable[[Row], Any]:
+        column = self.columns[0]
+        return lambda row: row[column].isoformat() if row[column] else None
+
+
+class DateTimeColumn(Column):
+    # As DRF's DateTimeField renders it, in the current time zone
+    def bind(self, request, model, rows: List[Row]) -> Callable[[Row], Any]:
+        column = self.columns[0]
+        zone = timezone.get_current_timezone()
+
+        def to_representation(row: Row):
+            value = row[column]
+            if not value:
+                return None
+            value = value.astimezone(zone).isoformat()
+            if value.endswith("+00:00"):
+                value = value[:-6] + "Z"
+            return value
+
+        return to_representation
+
+
+def url_template(request, view_name: str, url_kwargs: List[str]) -> str:
+    # The absolute URL of view_name, with {0}, {1}... in place of url_kwargs.
+    # build_absolute_uri and iri_to_uri leave the placeholders' characters be
+    placeholders = {kwarg: f"__{i}__" for i, kwarg in enumerate(url_kwargs)}
+    url = iri_to_uri(
+        request.build_absolute_uri(reverse(view_name, kwargs=placeholders))
+    )
+    for i in range(len(url_kwargs)):
+        url = url.replace(f"__{i}__", f"{{{i}}}")
+    return url
+
+
+class Link(Field):
+    # A hyperlink to view_name, given the columns for each of its URL kwargs
+    def __init__(self, view_name: str, **url_kwargs: str):
+        self.view_name = view_name
+        self.url_kwargs = list(url_kwargs)
+        self.columns = list(url_kwargs.values())
+
+    def bind(self, request, model, rows: List[Row]) -> Callable[[Row], Any]:
+        template = url_template(request, self.view_name, self.url_kwargs).format
+        get = itemgetter(*self.columns)
+        if len(self.columns) == 1:
+            return lambda row: template(get(row))
+        return lambda row: template(*get(row))
+
+
+class LinkList(Field):
+    # Hyperlinks to the records of a many-to-many relation, fetched for all the
+    # rows in one query. url_kwargs name columns of the related model
+    columns = ["id"]
+
+    def __init__(self, relation: str, view_name: str, **url_kwargs: str):
+        self.relation = relation
+        self.view_name = view_name
+        self.url_kwargs = url_kwargs
+
+    def bind(self, request, model, rows: List[Row]) -> Callable[[Row], Any]:
+        field = model._meta.get_field(self.relation)
+        if field.concrete:
+            lookup = field.related_query_name()
+        else:
+            lookup = field.field.name
+        # Filtering and selecting through the same join, like prefetch_related,
+        # so that links come in the same order as with the DRF serializers
+        related = field.related_model.objects.filter(
+            **{f"{lookup}__in": [row["id"] for row in rows]}
+        ).values_list(lookup, *self.url_kwargs.values())
+        template = url_template(request, self.view_name, list(self.url_kwargs))
+        links: Dict[int, List[str]] = {}
+        for pk, *values in related:
+            links.setdefault(pk, []).append(template.format(*values))
+        return lambda row: links.get(row["id"], [])
+
+
+class RowSerializer:
+    # Subclasses set model, and fields as (name, Field) pairs in output order
+    model: Model = None
+    fields: List = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.keys, cls.columns = cls.layout(cls.fields)
+
+    @staticmethod
+    def layout(fields: List) -> Tuple[List[str], List[str]]:
+        keys = [camel_case(name) for name, _ in fields]
+        columns = list(
+            dict.fromkeys(column for _, field in fields for column in field.columns)
+        )
+        return keys, columns
+
+    def __init__(self, request, fields: Optional[Iterable[str]] = None):
+        # Given fields, only those are read and serialized
+        self.request = request
+        if fields is not None:
+            fields = set(fields)
+            self.fields = [pair for pair in self.fields if pair[0] in fields]
+            self.keys, self.columns = self.layout(self.fields)
+
+    def values(self, queryset: QuerySet, *extra: str) -> QuerySet:
+        # The queryset's rows, without the relations a DRF serializer needs.
+        # extra columns are read too, e.g. for pagination cursors
+        columns = dict.fromkeys([*self.columns, *extra])
+        return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+    def to_representation(self, rows: List[Row]) -> List[Row]:
+        with timed("serialize"):
+            getters = [
+                field.bind(self.request, self.model, rows) for _, field in self.fields
+            ]
+            pairs = list(zip(self.keys, getters))
+            return [{key: get(row) for key, get in pairs} for row in rows]
+
+    def rows(self, queryset: QuerySet) -> List[Row]:
+        return self.to_representation(list(self.values(queryset)))
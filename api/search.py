@@ -0,0 +1,274 @@
+import html
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from api.models import Lab, Issue, Experiment, IssueComment, CheckIn
+
+# Full-text index over the text of a lab's records, kept in a table outside the
+# ORM: an FTS5 virtual table on SQLite and a table with a GIN-indexed tsvector
+# on PostgreSQL. Both are created by migration 0020_search
+SEARCH_TABLE = "api_search"
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Matches are marked with control characters that can't appear in the escaped
+# text, then turned into <mark> tags once the rest has been escaped
+_START = "\x02"
+_STOP = "\x03"
+
+# Record type names, as stored in the index and returned in results
+ISSUE = "issue"
+EXPERIMENT = "experiment"
+COMMENT = "comment"
+CHECK_IN = "check_in"
+
+# (type, object id, lab id, number, title, body). number is the record's own
+# number, or its issue's for comments
+Document = Tuple[str, int, int, int, str, str]
+
+
+def document(instance) -> Optional[Document]:
+    # None for records that shouldn't be found, i.e. archived ones
+    if instance.deleted:
+        return None
+    if isinstance(instance, Issue):
+        return (
+            ISSUE,
+            instance.pk,
+            instance.lab_id,
+            instance.number,
+            instance.title,
+            instance.description,
+        )
+    if isinstance(instance, Experiment):
+        return (
+            EXPERIMENT,
+            instance.pk,
+            instance.lab_id,
+            instance.number,
+            instance.title,
+            f"{instance.description}\n\n{instance.terms}",
+        )
+    if isinstance(instance, IssueComment):
+        if instance.issue.deleted:
+            return None
+        return (
+            COMMENT,
+            instance.pk,
+            instance.issue.lab_id,
+            instance.issue.number,
+            "",
+            instance.body,
+        )
+    if isinstance(instance, CheckIn):
+        return (
+            CHECK_IN,
+            instance.pk,
+            instance.lab_id,
+            instance.number,
+            "",
+            instance.retrospective,
+        )
+    raise TypeError(f"{type(instance).__name__} isn't searchable")
+
+
+def record_type_of(model) -> str:
+    return {
+        Issue: ISSUE,
+        Experiment: EXPERIMENT,
+        IssueComment: COMMENT,
+        CheckIn: CHECK_IN,
+    }[model]
+
+
+class SQLiteSearchBackend:
+    def insert(self, cursor, documents: List[Document]) -> None:
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (type, object_id, lab_id, number, title, body)"
+            " VALUES (%s, %s, %s, %s, %s, %s)",
+            documents,
+        )
+
+    def search(
+        self, cursor, lab_id: int, query: str, limit: int, offset: int
+    ) -> List[tuple]:
+        # Each word is quoted, so FTS5 query syntax in user input is matched
+        # literally, and the last one also matches as a prefix
+        terms = ['"{}"'.format(word.replace('"', '""')) for word in query.split()]
+        if not terms:
+            return []
+        terms[-1] += "*"
+        # The lab is matched through the index too, so other labs' documents are
+        # never read. Title matches count ten times as much as body matches, and
+        # the lab's id not at all
+        match = f'lab_id : "{lab_id}" AND {{title body}} : ({" ".join(terms)})'
+        cursor.execute(
+            f"SELECT type, object_id, number,"
+            f" highlight({SEARCH_TABLE}, 0, %s, %s),"
+            f" snippet({SEARCH_TABLE}, 1, %s, %s, '…', 24),"
+            f" bm25({SEARCH_TABLE}, 10.0, 1.0, 0.0, 0.0, 0.0, 0.0) AS score"
+            f" FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+            f" ORDER BY score LIMIT %s OFFSET %s",
+            [_START, _STOP, _START, _STOP, match, limit, offset],
+        )
+        return [row[:5] + (-row[5],) for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    config = "english"
+
+    def insert(self, cursor, documents: List[Document]) -> None:
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE}"
+            " (type, object_id, lab_id, number, title, body, document)"
+            " VALUES (%s, %s, %s, %s, %s, %s,"
+            f" setweight(to_tsvector('{self.config}', %s), 'A')"
+            f" || setweight(to_tsvector('{self.config}', %s), 'B'))",
+            [document + document[4:] for document in documents],
+        )
+
+    def search(
+        self, cursor, lab_id: int, query: str, limit: int, offset: int
+    ) -> List[tuple]:
+        options = f"StartSel={_START}, StopSel={_STOP}"
+        cursor.execute(
+            "SELECT type, object_id, number,"
+            f" ts_headline('{self.config}', title, query, %s),"
+            f" ts_headline('{self.config}', body, query,"
+            " %s || ', MaxWords=24, MinWords=8'),"
+            " ts_rank_cd(document, query) AS score"
+            f" FROM {SEARCH_TABLE}, plainto_tsquery('{self.config}', %s) query"
+            " WHERE document @@ query AND lab_id = %s"
+            " ORDER BY score DESC LIMIT %s OFFSET %s",
+            [options + ", HighlightAll=true", options, query, lab_id, limit, offset],
+        )
+        return cursor.fetchall()
+
+
+def get_backend():
+    if connection.vendor == "sqlite":
+        return SQLiteSearchBackend()
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    raise NotImplementedError(f"Search isn't supported on {connection.vendor}")
+
+
+# Documents are written in chunks of this many, keeping the number of query
+# parameters within SQLite's limit
+INDEX_CHUNK_SIZE = 500
+
+
+def _delete(cursor, type_name: str, ids: List[int]) -> None:
+    if ids:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE}"
+            f" WHERE type = %s AND object_id IN ({placeholders})",
+            [type_name, *ids],
+        )
+
+
+def update_index(model, instances: Iterable) -> None:
+    # Replaces the documents of saved instances of one model, dropping those of
+    # archived ones
+    type_name = record_type_of(model)
+    backend = get_backend()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for chunk in _chunks(instances):
+            _delete(cursor, type_name, [instance.pk for instance in chunk])
+            documents = [document(instance) for instance in chunk]
+            backend.insert(cursor, [d for d in documents if d is not None])
+            if model is Issue:
+                # Comments on an archived issue go with it
+                archived = [instance.pk for instance in chunk if instance.deleted]
+                comments = IssueComment.objects.filter(issue__in=archived)
+                _delete(cursor, COMMENT, list(comments.values_list("pk", flat=True)))
+
+
+def _chunks(instances: Iterable) -> Iterator[list]:
+    chunk = []
+    for instance in instances:
+        chunk.append(instance)
+        if len(chunk) >= INDEX_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _searchable(lab_id: Optional[int] = None) -> list:
+    # Querysets of everything that could be indexed, optionally in one lab
+    querysets = [
+        Issue.objects.all(),
+        Experiment.objects.all(),
+        IssueComment.objects.select_related("issue"),
+        CheckIn.objects.all(),
+    ]
+    if lab_id is None:
+        return querysets
+    return [
+        queryset.filter(
+            **{"issue__lab" if queryset.model is IssueComment else "lab": lab_id}
+        )
+        for queryset in querysets
+    ]
+
+
+def index_instance(sender, instance, **kwargs) -> None:
+    update_index(sender, [instance])
+
+
+def unindex_instance(sender, instance, **kwargs) -> None:
+    with connection.cursor() as cursor:
+        _delete(cursor, record_type_of(sender), [instance.pk])
+
+
+def unindex_lab(sender, instance, **kwargs) -> None:
+    # Whatever of a deleted lab's records is still indexed
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE lab_id = %s", [instance.pk])
+
+
+def index_lab(lab_id: int) -> None:
+    for queryset in _searchable(lab_id):
+        update_index(queryset.model, queryset.iterator())
+
+
+def rebuild_index() -> int:
+    # Rebuilds the whole index from scratch, returning the number of documents
+    backend = get_backend()
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        for queryset in _searchable():
+            for chunk in _chunks(queryset.iterator()):
+                documents = [document(instance) for instance in chunk]
+                documents = [d for d in documents if d is not None]
+                backend.insert(cursor, documents)
+                count += len(documents)
+    # Search responses are cached by lab version
+    for lab_id in Lab.objects.values_list("pk", flat=True).iterator():
+        Lab.touch(lab_id)
+    return count
+
+
+def highlighted(text: str) -> str:
+    return html.escape(text).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def search_lab(lab_id: int, query: str, limit: int, offset: int) -> List[dict]:
+    with connection.cursor() as cursor:
+        rows = get_backend().search(cursor, lab_id, query, limit, offset)
+    return [
+        {
+            "type": type_name,
+            "id": object_id,
+            "number": number,
+            "title": highlighted(title),
+            "snippet": highlighted(snippet),
+            "score": score,
+        }
+        for type_name, object_id, number, title, snippet, score in rows
+    ]
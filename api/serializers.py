@@ -1,7 +1,12 @@
-from typing import List, Dict
+from typing import List, Dict, Iterable, Optional
 
+import pytz
 from rest_framework import serializers
-from rest_framework.relations import HyperlinkedIdentityField, HyperlinkedRelatedField
+from rest_framework.relations import (
+    HyperlinkedIdentityField,
+    HyperlinkedRelatedField,
+    ManyRelatedField,
+)
 from rest_framework_nested.relations import (
     NestedHyperlinkedRelatedField,
     NestedHyperlinkedIdentityField,
@@ -14,51 +19,94 @@ from api.models import (
     MAX_BODY_TEXT_LENGTH,
     Experiment,
     CheckIn,
-    OPEN,
+    IssueDescriptionHistoryItem,
+    IssueStateHistoryItem,
+    IssueCommentHistoryItem,
+    ExperimentTermsHistoryItem,
+    ExperimentEndDateHistoryItem,
+)
+from api.metrics import timed
+from api.rows import (
+    RowSerializer,
+    Column,
+    DateColumn,
+    DateTimeColumn,
+    Link,
+    LinkList,
 )
 
 
-class IssueIdListField(serializers.Field):
-    def to_representation(self, value) -> List:
-        queue_list = (
-            []
-            if not value.queue_order
-            else [int(x) for x in value.queue_order.split(",")]
-        )
-        open_issue_ids = [
-            issue.id
-            for issue in Issue.objects.filter(
-                lab__pk=value.pk, state=OPEN, deleted=False
+class TimedSerializerMixin:
+    # Counts the time spent building responses in the request's metrics
+    def to_representation(self, instance):
+        with timed("serialize"):
+            return super().to_representation(instance)
+
+
+class FieldSelectionMixin:
+    # Given fields, serializes only those. Given expand, embeds the records of
+    # those relations with their serializers in EMBEDDED, in place of links.
+    # Embedded records leave out their own to-many links, which would need a
+    # query per record, so that each embedded relation costs one prefetch
+    def __init__(
+        self,
+        *args,
+        fields: Optional[Iterable[str]] = None,
+        expand: Iterable[str] = (),
+        embedded: bool = False,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.selected_fields = None if fields is None else set(fields)
+        self.expand = list(expand)
+        self.embedded = embedded
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.selected_fields is not None:
+            selected = self.selected_fields.union(self.expand)
+            fields = {name: field for name, field in fields.items() if name in selected}
+        if self.embedded:
+            fields = {
+                name: field
+                for name, field in fields.items()
+                if not isinstance(field, ManyRelatedField)
+            }
+        for name in self.expand:
+            fields[name] = EMBEDDED[type(self)][name](
+                many=True, read_only=True, embedded=True
             )
-        ]
-        updated_list = []
+        return fields
 
-        for id in queue_list:
-            if id in open_issue_ids:
-                # If id is in open_issue_ids, then we don't want to add it again
-                open_issue_ids.remove(id)
-                updated_list.append(id)
 
-        # open_issue_ids is now only open issue IDs that aren't in queue_list
-        updated_list.extend(open_issue_ids)
+class IssueIdListField(serializers.Field):
+    def to_representation(self, value) -> List[int]:
+        return [item.issue_id for item in value.queue_items.all()]
 
-        if queue_list != updated_list:
-            value.queue_order = ",".join([str(x) for x in updated_list])
-            value.save()
+    def to_internal_value(self, data) -> Dict[str, List[int]]:
+        if isinstance(data, str):
+            data = [x for x in data.strip("[]").replace(" ", "").split(",") if x]
+        if not isinstance(data, list):
+            raise serializers.ValidationError("Expected a list of issue IDs.")
+        try:
+            return {"queue": [int(x) for x in data]}
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("Expected a list of issue IDs.")
 
-        return updated_list
 
-    def to_internal_value(self, data) -> Dict[str, str]:
-        internal_value = None
-        if isinstance(data, list):
-            internal_value = ",".join([str(x) for x in data])
-        elif isinstance(data, str):
-            internal_value = data[1:-1].replace(" ", "")
+class QueueMoveSerializer(serializers.Serializer):
+    # Moves issue to just before or after another queued issue, by ids
+    issue = serializers.IntegerField()
+    before = serializers.IntegerField(required=False)
+    after = serializers.IntegerField(required=False)
 
-        return {"queue_order": internal_value}
+    def validate(self, attrs):
+        if ("before" in attrs) == ("after" in attrs):
+            raise serializers.ValidationError("Give one of before and after.")
+        return attrs
 
 
-class LabSerializer(serializers.HyperlinkedModelSerializer):
+class LabSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     issues = HyperlinkedIdentityField(
         view_name="issues-list", lookup_url_kwarg="lab_pk", lookup_field="pk"
     )
@@ -70,12 +118,38 @@ class LabSerializer(serializers.HyperlinkedModelSerializer):
     )
     queue = IssueIdListField(source="*")
 
+    def validate_time_zone(self, value: str) -> str:
+        if value not in pytz.all_timezones_set:
+            raise serializers.ValidationError(f"Unknown time zone {value!r}.")
+        return value
+
+    def create(self, validated_data):
+        # A new lab has no issues to queue
+        validated_data.pop("queue", None)
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        queue = validated_data.pop("queue", None)
+        if queue is not None:
+            instance.set_queue(queue)
+        return super().update(instance, validated_data)
+
     class Meta:
         model = Lab
-        fields = ["id", "url", "issues", "experiments", "check_ins", "queue"]
+        fields = [
+            "id",
+            "url",
+            "issues",
+            "experiments",
+            "check_ins",
+            "queue",
+            "time_zone",
+        ]
 
 
-class ExperimentSerializer(serializers.HyperlinkedModelSerializer):
+class ExperimentSerializer(
+    TimedSerializerMixin, FieldSelectionMixin, serializers.HyperlinkedModelSerializer
+):
     url = NestedHyperlinkedIdentityField(
         view_name="experiments-detail",
         parent_lookup_kwargs={"lab_pk": "lab__pk"},
@@ -132,7 +206,9 @@ class ExperimentSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ["lab", "created", "check_ins"]
 
 
-class IssueSerializer(serializers.HyperlinkedModelSerializer):
+class IssueSerializer(
+    TimedSerializerMixin, FieldSelectionMixin, serializers.HyperlinkedModelSerializer
+):
     comments = NestedHyperlinkedIdentityField(
         view_name="issue-comments-list",
         parent_lookup_kwargs={"lab_pk": "lab__pk"},
@@ -173,6 +249,7 @@ class IssueSerializer(serializers.HyperlinkedModelSerializer):
             "description",
             "created",
             "comments",
+            "comment_count",
             "experiments",
             "lab",
             "deleted",
@@ -180,7 +257,9 @@ class IssueSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ["lab", "created"]
 
 
-class CheckInSerializer(serializers.HyperlinkedModelSerializer):
+class CheckInSerializer(
+    TimedSerializerMixin, FieldSelectionMixin, serializers.HyperlinkedModelSerializer
+):
     url = NestedHyperlinkedIdentityField(
         view_name="check-ins-detail",
         parent_lookup_kwargs={"lab_pk": "lab__pk"},
@@ -201,8 +280,12 @@ class CheckInSerializer(serializers.HyperlinkedModelSerializer):
 
     def create(self, validated_data) -> CheckIn:
         context_kwargs = self.context["view"].kwargs
-        lab = Lab.objects.get(pk=context_kwargs["lab_pk"])
-        instance = CheckIn.objects.create(**validated_data, lab=lab)
+        # Not reading the lab first means that, given a local_date, the insert
+        # starts the transaction and takes SQLite's write lock up front instead
+        # of failing to upgrade a read lock when racing another request
+        instance = CheckIn.objects.create(
+            **validated_data, lab_id=context_kwargs["lab_pk"]
+        )
         instance.experiments.set(
             Experiment.objects.filter(
                 lab__pk=context_kwargs["lab_pk"],
@@ -228,7 +311,9 @@ class CheckInSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ["lab", "created"]
 
 
-class IssueCommentSerializer(serializers.HyperlinkedModelSerializer):
+class IssueCommentSerializer(
+    TimedSerializerMixin, FieldSelectionMixin, serializers.HyperlinkedModelSerializer
+):
     issue = NestedHyperlinkedRelatedField(
         view_name="issues-detail",
         read_only=True,
@@ -257,3 +342,126 @@ class IssueCommentSerializer(serializers.HyperlinkedModelSerializer):
         model = IssueComment
         fields = ["id", "url", "issue", "body", "created", "deleted"]
         read_only_fields = ["created"]
+
+
+# The relations each serializer can embed with ?expand=, and how
+EMBEDDED = {
+    IssueSerializer: {
+        "experiments": ExperimentSerializer,
+        "comments": IssueCommentSerializer,
+    },
+    ExperimentSerializer: {"issues": IssueSerializer, "check_ins": CheckInSerializer},
+    CheckInSerializer: {"experiments": ExperimentSerializer},
+}
+
+
+class IssueDescriptionHistoryItemSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    class Meta:
+        model = IssueDescriptionHistoryItem
+        fields = ["created", "description"]
+
+
+class IssueStateHistoryItemSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    class Meta:
+        model = IssueStateHistoryItem
+        fields = ["created", "state"]
+
+
+class IssueCommentHistoryItemSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    class Meta:
+        model = IssueCommentHistoryItem
+        fields = ["created", "body"]
+
+
+class ExperimentTermsHistoryItemSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    class Meta:
+        model = ExperimentTermsHistoryItem
+        fields = ["created", "body"]
+
+
+class ExperimentEndDateHistoryItemSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    class Meta:
+        model = ExperimentEndDateHistoryItem
+        fields = ["created", "end_date"]
+
+
+# Row serializers for JSON reads of the lab endpoints, with the same output as
+# the serializers above (see api.rows)
+
+
+class IssueRowSerializer(RowSerializer):
+    model = Issue
+    fields = [
+        ("number", Column("number")),
+        ("id", Column("id")),
+        ("url", Link("issues-detail", lab_pk="lab_id", number="number")),
+        ("state", Column("state")),
+        ("title", Column("title")),
+        ("description", Column("description")),
+        ("created", DateTimeColumn("created")),
+        ("comments", Link("issue-comments-list", lab_pk="lab_id", issue_number="id")),
+        ("comment_count", Column("comment_count")),
+        (
+            "experiments",
+            LinkList(
+                "experiments", "experiments-detail", lab_pk="lab_id", number="number"
+            ),
+        ),
+        ("lab", Link("lab-detail", pk="lab_id")),
+        ("deleted", Column("deleted")),
+    ]
+
+
+class ExperimentRowSerializer(RowSerializer):
+    model = Experiment
+    fields = [
+        ("number", Column("number")),
+        ("id", Column("id")),
+        ("url", Link("experiments-detail", lab_pk="lab_id", number="number")),
+        ("state", Column("state")),
+        ("title", Column("title")),
+        ("description", Column("description")),
+        ("terms", Column("terms")),
+        ("created", DateTimeColumn("created")),
+        ("end_date", DateColumn("end_date")),
+        (
+            "issues",
+            LinkList("issues", "issues-detail", lab_pk="lab_id", number="number"),
+        ),
+        ("lab", Link("lab-detail", pk="lab_id")),
+        ("deleted", Column("deleted")),
+        (
+            "check_ins",
+            LinkList("check_ins", "check-ins-detail", lab_pk="lab_id", number="number"),
+        ),
+    ]
+
+
+class CheckInRowSerializer(RowSerializer):
+    model = CheckIn
+    fields = [
+        ("number", Column("number")),
+        ("id", Column("id")),
+        ("url", Link("check-ins-detail", lab_pk="lab_id", number="number")),
+        ("complete", Column("complete")),
+        ("retrospective", Column("retrospective")),
+        (
+            "experiments",
+            LinkList(
+                "experiments", "experiments-detail", lab_pk="lab_id", number="number"
+            ),
+        ),
+        ("created", DateTimeColumn("created")),
+        ("lab", Link("lab-detail", pk="lab_id")),
+        ("deleted", Column("deleted")),
+    ]
@@ -0,0 +1,76 @@
+from typing import List, Optional, Tuple
+
+from django.db.models import Prefetch
+
+from api.models import Change, Lab, Issue, Experiment, CheckIn, IssueComment
+
+# Most log entries returned at once. Clients with more to catch up on get
+# more=True and ask again from the returned token
+CHANGES_PAGE_SIZE = 1000
+
+
+def latest_token(lab_id: int) -> int:
+    last = Change.objects.filter(lab=lab_id).order_by("-id").values("id").first()
+    return last["id"] if last else 0
+
+
+def _querysets(lab_id: int) -> dict:
+    # What each record type is loaded with, prefetched as the list views do
+    return {
+        "lab": Lab.objects.filter(pk=lab_id).prefetch_related("queue_items"),
+        "issue": Issue.objects.filter(lab=lab_id)
+        .select_related("lab")
+        .prefetch_related(
+            Prefetch("experiments", queryset=Experiment.objects.select_related("lab"))
+        ),
+        "experiment": Experiment.objects.filter(lab=lab_id)
+        .select_related("lab")
+        .prefetch_related(
+            Prefetch("issues", queryset=Issue.objects.select_related("lab")),
+            Prefetch("check_ins", queryset=CheckIn.objects.select_related("lab")),
+        ),
+        "checkin": CheckIn.objects.filter(lab=lab_id)
+        .select_related("lab")
+        .prefetch_related(
+            Prefetch("experiments", queryset=Experiment.objects.select_related("lab"))
+        ),
+        "issuecomment": IssueComment.objects.filter(issue__lab=lab_id).select_related(
+            "issue__lab"
+        ),
+    }
+
+
+def changes_since(
+    lab_id: int, since: int, limit: int = CHANGES_PAGE_SIZE
+) -> Tuple[int, bool, List[Tuple[str, int, Optional[object]]]]:
+    # Returns the new token, whether there are more changes after it, and the
+    # records that changed after since as (type, id, current record). Each
+    # record is listed once however often it changed, and is None if it no
+    # longer exists
+    entries = list(
+        Change.objects.filter(lab=lab_id, id__gt=since)
+        .order_by("id")
+        .values_list("id", "record_type", "object_id")[: limit + 1]
+    )
+    more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return since, False, []
+
+    # In order of each record's last change
+    changed = list(
+        dict.fromkeys(
+            (record_type, object_id) for _, record_type, object_id in reversed(entries)
+        )
+    )[::-1]
+    records = {}
+    querysets = _querysets(lab_id)
+    for record_type in {record_type for record_type, _ in changed}:
+        ids = [object_id for t, object_id in changed if t == record_type]
+        for pk, record in querysets[record_type].in_bulk(ids).items():
+            records[record_type, pk] = record
+    return (
+        entries[-1][0],
+        more,
+        [(t, pk, records.get((t, pk))) for t, pk in changed],
+    )
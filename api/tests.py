@@ -1,3 +1,1475 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import threading
+from io import StringIO
+from datetime import date, timedelta
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api.backup import export_lab, import_lab
+from api.benchmarks import (
+    asgi_get,
+    compare_results,
+    route_urls,
+    seed_lab,
+    time_event_fanout,
+    time_requests,
+    wire_cost,
+    wsgi_get,
+)
+from api.compression import ENCODINGS, negotiate
+from api.events import get_broker
+from api.handlers import ReadPoolASGIHandler
+from api.models import (
+    Lab,
+    Issue,
+    IssueComment,
+    Experiment,
+    CheckIn,
+    OPEN,
+    CLOSED,
+    LabSequence,
+    LabStats,
+    IssueDescriptionHistoryItem,
+    Change,
+    local_date,
+)
+from lifelab_server.asgi import application
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BENCHMARK_BASELINE = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+
+def make_lab(issue_count: int) -> Lab:
+    lab = Lab.objects.create()
+    experiment = Experiment.objects.create(
+        lab=lab, title="Experiment", terms="", description="", end_date="2020-01-01"
+    )
+    for i in range(issue_count):
+        issue = Issue.objects.create(lab=lab, title=f"Issue {i}")
+        experiment.issues.add(issue)
+        CheckIn.objects.create(
+            lab=lab, local_date=date.today() - timedelta(days=i)
+        ).experiments.add(experiment)
+    return lab
+
+
+class ListQueryCountTest(TestCase):
+    def count_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assert_constant_queries(self, url_template: str) -> None:
+        small_lab = make_lab(1)
+        large_lab = make_lab(20)
+        self.assertEqual(
+            self.count_queries(url_template.format(small_lab.pk)),
+            self.count_queries(url_template.format(large_lab.pk)),
+        )
+
+    def test_issue_list(self):
+        self.assert_constant_queries("/api/dev/labs/{}/issues/")
+
+    def test_experiment_list(self):
+        self.assert_constant_queries("/api/dev/labs/{}/experiments/")
+
+    def test_check_in_list(self):
+        self.assert_constant_queries("/api/dev/labs/{}/check-ins/")
+
+
+class QueueTest(TestCase):
+    def setUp(self):
+        self.lab = Lab.objects.create()
+        self.issues = [
+            Issue.objects.create(lab=self.lab, title=f"Issue {i}") for i in range(5)
+        ]
+        self.url = f"/api/dev/labs/{self.lab.pk}/"
+
+    def get_queue(self):
+        return self.client.get(self.url).json()["queue"]
+
+    def test_queue_follows_issue_state(self):
+        ids = [issue.id for issue in self.issues]
+        self.assertEqual(self.get_queue(), ids)
+
+        self.issues[1].state = CLOSED
+        self.issues[1].save()
+        self.issues[3].deleted = True
+        self.issues[3].save()
+        self.assertEqual(self.get_queue(), [ids[0], ids[2], ids[4]])
+
+        self.issues[1].state = OPEN
+        self.issues[1].save()
+        self.assertEqual(self.get_queue(), [ids[0], ids[2], ids[4], ids[1]])
+
+    def test_read_does_not_write(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get_queue()
+        self.assertFalse(
+            [q for q in context if not q["sql"].startswith("SELECT")], context
+        )
+
+    def test_reorder_moves_only_changed_items(self):
+        ids = [issue.id for issue in self.issues]
+        untouched = {
+            item.issue_id: item.position for item in self.lab.queue_items.all()
+        }
+        new_order = [ids[4]] + ids[:4]
+        response = self.client.patch(
+            self.url, {"queue": new_order}, content_type="application/json"
+        )
+        self.assertEqual(response.json()["queue"], new_order)
+        for item in self.lab.queue_items.exclude(issue_id=ids[4]):
+            self.assertEqual(item.position, untouched[item.issue_id])
+
+    def move(self, **data):
+        return self.client.post(
+            self.url + "queue/move/", data, content_type="application/json"
+        )
+
+    def test_move_writes_one_position(self):
+        ids = [issue.id for issue in self.issues]
+        writes = []
+
+        def log(execute, sql, *args):
+            if not sql.startswith("SELECT"):
+                writes.append(sql)
+            return execute(sql, *args)
+
+        with connection.execute_wrapper(log):
+            response = self.move(issue=ids[4], before=ids[1])
+        self.assertEqual(response.json()["queue"], [ids[0], ids[4], *ids[1:4]])
+        self.assertEqual(
+            len([sql for sql in writes if "api_queueitem" in sql.split("SET")[0]]), 1
+        )
+        response = self.move(issue=ids[0], after=ids[3])
+        self.assertEqual(
+            response.json()["queue"], [ids[4], ids[1], ids[2], ids[3], ids[0]]
+        )
+        response = self.move(issue=ids[3], before=ids[4])
+        self.assertEqual(response.json()["queue"][0], ids[3])
+
+    def test_move_renumbers_when_gap_is_used_up(self):
+        ids = [issue.id for issue in self.issues]
+        # Moving back and forth between the first two halves their gap each time
+        for i in range(12):
+            self.move(issue=ids[4 - i % 2], after=ids[0])
+        self.assertEqual(self.get_queue(), [ids[0], ids[3], ids[4], ids[1], ids[2]])
+        positions = list(self.lab.queue_items.values_list("position", flat=True))
+        self.assertEqual(len(set(positions)), 5)
+
+    def test_move_rejects_unqueued_issues(self):
+        ids = [issue.id for issue in self.issues]
+        self.issues[1].state = CLOSED
+        self.issues[1].save()
+        response = self.move(issue=ids[1], before=ids[0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.move(issue=ids[0]).status_code, 400)
+        self.assertEqual(
+            self.move(issue=ids[0], before=ids[2], after=ids[3]).status_code, 400
+        )
+
+
+class LabSequenceTest(TestCase):
+    def test_numbers_are_per_lab_and_model(self):
+        lab = make_lab(3)
+        other_lab = make_lab(1)
+        self.assertEqual(
+            list(lab.issues.order_by("number").values_list("number", flat=True)),
+            [1, 2, 3],
+        )
+        self.assertEqual(other_lab.issues.get().number, 1)
+        self.assertEqual(lab.check_ins.order_by("-number")[0].number, 3)
+        self.assertEqual(lab.experiments.get().number, 1)
+
+    def test_reserve_block(self):
+        lab = make_lab(2)
+        self.assertEqual(LabSequence.reserve(lab.pk, "issue", 10), range(3, 13))
+        self.assertEqual(Issue.objects.create(lab=lab, title="Next").number, 13)
+
+    def test_sequence_starts_after_existing_numbers(self):
+        lab = make_lab(4)
+        LabSequence.objects.filter(lab=lab).delete()
+        self.assertEqual(Issue.objects.create(lab=lab, title="Next").number, 5)
+
+
+class ConcurrentNumberingTest(TransactionTestCase):
+    thread_count = 8
+    issues_per_thread = 10
+
+    def test_concurrent_creates(self):
+        lab = Lab.objects.create()
+
+        def create_issues(thread: int) -> None:
+            try:
+                for i in range(self.issues_per_thread):
+                    Issue.objects.create(lab=lab, title=f"Issue {thread}.{i}")
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.thread_count) as executor:
+            list(executor.map(create_issues, range(self.thread_count)))
+
+        total = self.thread_count * self.issues_per_thread
+        self.assertEqual(
+            sorted(lab.issues.values_list("number", flat=True)),
+            list(range(1, total + 1)),
+        )
+        # Each in its own place in the queue
+        positions = lab.queue_items.values_list("position", flat=True)
+        self.assertEqual(len(set(positions)), total)
+
+
+class ConcurrentQueueMoveTest(TransactionTestCase):
+    def test_concurrent_moves_merge(self):
+        # Two clients move different issues at once, each from the same
+        # starting queue. Either order gives the same result
+        lab = Lab.objects.create()
+        ids = [Issue.objects.create(lab=lab, title=f"Issue {i}").id for i in range(5)]
+        url = f"/api/dev/labs/{lab.pk}/queue/move/"
+        start = threading.Barrier(2)
+
+        def move(data: dict) -> int:
+            try:
+                client = Client()
+                start.wait()
+                return client.post(
+                    url, data, content_type="application/json"
+                ).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(2) as executor:
+            statuses = list(
+                executor.map(
+                    move,
+                    [
+                        {"issue": ids[0], "after": ids[2]},
+                        {"issue": ids[4], "before": ids[1]},
+                    ],
+                )
+            )
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(
+            Client().get(f"/api/dev/labs/{lab.pk}/").json()["queue"],
+            [ids[4], ids[1], ids[2], ids[0], ids[3]],
+        )
+
+
+class ConcurrentBatchTest(TransactionTestCase):
+    def test_concurrent_batches_all_apply(self):
+        lab = make_lab(8)
+        url = f"/api/dev/labs/{lab.pk}/issues/batch/"
+        start = threading.Barrier(8)
+
+        def batch(number: int) -> int:
+            try:
+                client = Client()
+                start.wait()
+                return client.post(
+                    url,
+                    [
+                        {"op": "update", "number": number, "data": {"state": CLOSED}},
+                        {"op": "create", "data": {"title": f"New {number}"}},
+                    ],
+                    content_type="application/json",
+                ).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(8) as executor:
+            statuses = list(executor.map(batch, range(1, 9)))
+
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(lab.issues.filter(state=CLOSED).count(), 8)
+        self.assertEqual(
+            sorted(lab.issues.values_list("number", flat=True)), list(range(1, 17))
+        )
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(5)
+        self.url = f"/api/dev/labs/{self.lab.pk}/issues/"
+
+    def test_unpaginated_by_default(self):
+        self.assertEqual(len(self.client.get(self.url).json()), 5)
+
+    def test_pages_are_stable_under_inserts_and_deletes(self):
+        page = self.client.get(self.url, {"page_size": 2}).json()
+        self.assertEqual([issue["number"] for issue in page["results"]], [1, 2])
+
+        Issue.objects.filter(lab=self.lab, number=3).update(deleted=True)
+        Issue.objects.create(lab=self.lab, title="New")
+
+        numbers = []
+        while page["next"]:
+            page = self.client.get(page["next"]).json()
+            numbers.extend(issue["number"] for issue in page["results"])
+        self.assertEqual(numbers, [4, 5, 6])
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(3)
+
+    def assert_conditional(self, url: str) -> None:
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Issue.objects.create(lab=self.lab, title="New")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_lab(self):
+        self.assert_conditional(f"/api/dev/labs/{self.lab.pk}/")
+
+    def test_issues(self):
+        self.assert_conditional(f"/api/dev/labs/{self.lab.pk}/issues/")
+
+    def test_check_in_today(self):
+        self.assert_conditional(f"/api/dev/labs/{self.lab.pk}/check-ins/today/")
+
+    def test_comment_delete_changes_etag(self):
+        issue = self.lab.issues.first()
+        comment = IssueComment.objects.create(issue=issue, body="Bye")
+        url = f"/api/dev/labs/{self.lab.pk}/issues/{issue.pk}/comments/"
+        etag = self.client.get(url)["ETag"]
+        response = self.client.delete(f"{url}{comment.pk}/")
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_queue_reorder_changes_etag(self):
+        url = f"/api/dev/labs/{self.lab.pk}/"
+        etag = self.client.get(url)["ETag"]
+        queue = self.client.get(url).json()["queue"]
+        self.client.patch(url, {"queue": queue[::-1]}, content_type="application/json")
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(3)
+        self.url = f"/api/dev/labs/{self.lab.pk}/issues/"
+
+    def get_stats(self):
+        # From another client, so as not to add session queries to self.client's
+        staff = Client()
+        staff.force_login(
+            User.objects.get_or_create(username="staff", is_staff=True)[0]
+        )
+        return staff.get("/api/dev/response-cache/").json()
+
+    def test_hit_until_lab_changes(self):
+        before = self.get_stats()
+        first = self.client.get(self.url).content
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).content, first)
+        after = self.get_stats()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+        Issue.objects.create(lab=self.lab, title="New")
+        self.assertEqual(len(self.client.get(self.url).json()), 4)
+
+    def test_hit_keeps_headers(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Allow"], first["Allow"])
+        self.assertEqual(dict(second.items()), dict(first.items()))
+
+    def test_stats_are_for_staff(self):
+        response = self.client.get("/api/dev/response-cache/")
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTest(TestCase):
+    def test_export_streams_every_record(self):
+        lab = make_lab(3)
+        response = self.client.get(f"/api/dev/labs/{lab.pk}/export/")
+        self.assertTrue(response.streaming)
+        records = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        counts = Counter(record["type"] for record in records)
+        self.assertEqual(counts["lab"], 1)
+        self.assertEqual(counts["issue"], 3)
+        self.assertEqual(counts["queueitem"], 3)
+        self.assertEqual(counts["experiment_issues"], 3)
+        self.assertEqual(counts["checkin_experiments"], 3)
+
+
+class ImportTest(TestCase):
+    @staticmethod
+    def export(lab: Lab) -> list:
+        return list(export_lab(lab))
+
+    def test_round_trip(self):
+        lab = make_lab(5)
+        issue = lab.issues.get(number=3)
+        issue.state = CLOSED
+        issue.save()
+        IssueComment.objects.create(issue=issue, body="Comment")
+        lab.set_queue([i.id for i in lab.issues.order_by("-number")])
+
+        imported = import_lab(self.export(lab), batch_size=2)
+
+        self.assertNotEqual(imported.pk, lab.pk)
+        for related in ("issues", "experiments", "check_ins"):
+            self.assertEqual(
+                list(
+                    getattr(lab, related)
+                    .order_by("number")
+                    .values_list("number", "created")
+                ),
+                list(
+                    getattr(imported, related)
+                    .order_by("number")
+                    .values_list("number", "created")
+                ),
+            )
+        self.assertEqual(
+            [
+                issue.number
+                for issue in Issue.objects.filter(queue_item__lab=lab).order_by(
+                    "queue_item__position"
+                )
+            ],
+            [
+                issue.number
+                for issue in Issue.objects.filter(queue_item__lab=imported).order_by(
+                    "queue_item__position"
+                )
+            ],
+        )
+        self.assertEqual(imported.issues.get(number=3).comments.get().body, "Comment")
+        experiment = imported.experiments.get()
+        self.assertEqual(
+            {issue.lab_id for issue in experiment.issues.all()}, {imported.pk}
+        )
+        self.assertEqual(experiment.issues.count(), 5)
+        self.assertEqual(experiment.check_ins.count(), 5)
+        # New records continue after the imported numbers
+        self.assertEqual(Issue.objects.create(lab=imported, title="New").number, 6)
+
+    def test_keeps_lab_settings(self):
+        lab = make_lab(1)
+        lab.time_zone = "Asia/Tokyo"
+        lab.save()
+
+        imported = import_lab(self.export(lab))
+
+        imported.refresh_from_db()
+        self.assertEqual(imported.time_zone, "Asia/Tokyo")
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(3)
+        self.url = f"/api/dev/labs/{self.lab.pk}/issues/batch/"
+
+    def post(self, operations):
+        return self.client.post(self.url, operations, content_type="application/json")
+
+    def test_batch_applies_every_operation(self):
+        experiment = self.lab.experiments.get()
+        experiment_url = (
+            f"http://testserver/api/dev/labs/{self.lab.pk}"
+            f"/experiments/{experiment.number}/"
+        )
+        response = self.post(
+            [
+                {"op": "create", "data": {"title": "A"}},
+                {
+                    "op": "create",
+                    "data": {"title": "B", "experiments": [experiment_url]},
+                },
+                {"op": "update", "number": 1, "data": {"state": CLOSED}},
+                {"op": "delete", "number": 2},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([r["status"] for r in results], [201, 201, 200, 204])
+        self.assertEqual([r["data"]["number"] for r in results[:2]], [4, 5])
+        self.assertEqual(results[2]["data"]["state"], CLOSED)
+
+        self.assertTrue(Issue.objects.get(lab=self.lab, number=2).deleted)
+        self.assertEqual(
+            list(experiment.issues.filter(number=5)), [self.lab.issues.get(number=5)]
+        )
+        queue = self.client.get(f"/api/dev/labs/{self.lab.pk}/").json()["queue"]
+        self.assertEqual(
+            queue,
+            list(
+                self.lab.issues.filter(number__in=[3, 4, 5])
+                .order_by("number")
+                .values_list("id", flat=True)
+            ),
+        )
+
+    def test_invalid_operation_rolls_back_batch(self):
+        response = self.post(
+            [
+                {"op": "create", "data": {"title": "A"}},
+                {"op": "update", "number": 99, "data": {"title": "B"}},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r["status"] for r in response.json()], [424, 404])
+        self.assertEqual(self.lab.issues.count(), 3)
+
+    def test_batch_can_mark_records_deleted(self):
+        response = self.post(
+            [
+                {"op": "update", "number": 1, "data": {"deleted": True}},
+                {"op": "create", "data": {"title": "A", "deleted": True}},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([r["status"] for r in results], [200, 201])
+        self.assertEqual([r["data"]["deleted"] for r in results], [True, True])
+        self.assertEqual(
+            list(self.lab.issues.filter(deleted=True).values_list("number", flat=True)),
+            [1, 4],
+        )
+
+
+class HistoryTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(1)
+        self.issue = self.lab.issues.get()
+
+    def test_records_only_changes(self):
+        self.assertEqual(
+            list(self.issue.state_history.values_list("state", flat=True)), [OPEN]
+        )
+        issue = Issue.objects.get(pk=self.issue.pk)
+        issue.title = "Renamed"
+        issue.save()
+        issue.state = CLOSED
+        with CaptureQueriesContext(connection) as queries:
+            issue.save()
+        self.assertFalse(
+            any(q["sql"].startswith("SELECT") for q in queries.captured_queries)
+        )
+        self.assertEqual(
+            list(
+                issue.state_history.order_by("created").values_list("state", flat=True)
+            ),
+            [OPEN, CLOSED],
+        )
+        self.assertEqual(issue.description_history.count(), 1)
+
+    def test_batch_inserts_history_together(self):
+        url = f"/api/dev/labs/{self.lab.pk}/issues/batch/"
+        operations = [{"op": "create", "data": {"title": str(i)}} for i in range(5)]
+        operations.append({"op": "update", "number": 1, "data": {"state": CLOSED}})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, operations, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+        inserts = Counter(
+            q["sql"].split('"')[1]
+            for q in queries.captured_queries
+            if q["sql"].startswith("INSERT")
+        )
+        self.assertEqual(inserts["api_issuestatehistoryitem"], 1)
+        self.assertEqual(inserts["api_issuedescriptionhistoryitem"], 1)
+        self.assertEqual(self.issue.state_history.count(), 2)
+
+    def test_history_endpoint_pages_newest_first(self):
+        for description in ["a", "b", "c"]:
+            self.issue.description = description
+            self.issue.save()
+        response = self.client.get(
+            f"/api/dev/labs/{self.lab.pk}/issues/{self.issue.number}"
+            f"/description-history/?page_size=2"
+        )
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([r["description"] for r in page["results"]], ["c", "b"])
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([r["description"] for r in page["results"]], ["a", ""])
+
+
+class DeltaHistoryTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(1)
+        self.issue = self.lab.issues.get()
+        self.url = (
+            f"/api/dev/labs/{self.lab.pk}/issues/{self.issue.number}"
+            "/description-history/"
+        )
+
+    def edit(self, issue, count):
+        descriptions = []
+        for i in range(count):
+            words = [f"word{j}" for j in range(500)]
+            words[i * 7 % 500] = f"edit{i}"
+            issue.description = " ".join(words)
+            issue.save()
+            descriptions.append(issue.description)
+        return descriptions
+
+    def history(self):
+        response = self.client.get(self.url + "?page_size=1000")
+        return [r["description"] for r in reversed(response.json()["results"])]
+
+    def test_stores_snapshots_and_deltas(self):
+        descriptions = self.edit(self.issue, 40)
+        rows = self.issue.description_history.order_by("pk")
+        depths = list(rows.values_list("depth", flat=True))
+        self.assertEqual(depths[:19], [0] + list(range(16)) + [0, 1])
+        stored = sum(len(row.description) + len(row.delta) for row in rows)
+        self.assertLess(stored, sum(map(len, descriptions)) / 4)
+        self.assertEqual(self.history(), [""] + descriptions)
+
+    def test_stale_base_falls_back_to_snapshot(self):
+        first = Issue.objects.get(pk=self.issue.pk)
+        second = Issue.objects.get(pk=self.issue.pk)
+        self.edit(first, 2)
+        descriptions = self.edit(second, 2)
+        rows = self.issue.description_history.order_by("pk")
+        self.assertEqual(list(rows.values_list("depth", flat=True)), [0, 0, 1, 0, 1])
+        self.assertEqual(self.history()[-2:], descriptions)
+
+    def test_compact(self):
+        descriptions = self.edit(self.issue, 20)
+        # Rows as they were stored before deltas, each a full copy
+        rows = self.issue.description_history.order_by("pk")
+        for row, description in zip(rows, [""] + descriptions):
+            IssueDescriptionHistoryItem.objects.filter(pk=row.pk).update(
+                depth=0, delta="", text_hash="", description=description
+            )
+
+        output = StringIO()
+        call_command("compact_history", stdout=output)
+        self.assertIn("issuedescriptionhistoryitem", output.getvalue())
+        rows = self.issue.description_history.all()
+        stored = sum(len(row.description) + len(row.delta) for row in rows)
+        self.assertLess(stored, sum(map(len, descriptions)) / 4)
+        self.assertEqual(self.history(), [""] + descriptions)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(1)
+        self.issue = Issue.objects.create(
+            lab=self.lab, title="Sleep schedule", description="Go to bed <early>"
+        )
+        self.experiment = Experiment.objects.create(
+            lab=self.lab,
+            title="No coffee",
+            description="",
+            terms="No caffeine after noon, to help sleep",
+            end_date="2020-01-01",
+        )
+        self.comment = IssueComment.objects.create(
+            issue=self.issue, body="Tried sleeping earlier"
+        )
+        self.url = f"/api/dev/labs/{self.lab.pk}/search/"
+
+    def search(self, query, lab=None):
+        lab = lab or self.lab
+        response = self.client.get(f"/api/dev/labs/{lab.pk}/search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_ranks_and_highlights(self):
+        results = self.search("sleep")
+        self.assertEqual(
+            [(r["type"], r["number"]) for r in results],
+            [
+                ("issue", self.issue.number),
+                ("comment", self.issue.number),
+                ("experiment", self.experiment.number),
+            ],
+        )
+        self.assertEqual(results[0]["title"], "<mark>Sleep</mark> schedule")
+        self.assertIn("<mark>sleeping</mark>", results[1]["snippet"])
+        self.assertIn("<mark>sleep</mark>", results[2]["snippet"])
+        # Every word has to match, the last also as a prefix, and text is escaped
+        results = self.search("bed ear")
+        self.assertEqual(
+            [r["snippet"] for r in results],
+            ["Go to <mark>bed</mark> &lt;<mark>early</mark>&gt;"],
+        )
+        self.assertEqual(self.search("caffeine")[0]["type"], "experiment")
+        self.assertEqual(self.search('"unbalanced OR')[:1], [])
+        other = make_lab(0)
+        self.assertEqual(self.search("sleep", lab=other), [])
+        Issue.objects.create(lab=other, title="Sleep")
+        self.assertEqual(len(self.search("sleep")), 3)
+
+    def test_pages(self):
+        for i in range(5):
+            Issue.objects.create(lab=self.lab, title=f"Nap {i}")
+        response = self.client.get(self.url, {"q": "nap", "limit": 3}).json()
+        self.assertEqual(len(response["results"]), 3)
+        response = self.client.get(response["next"]).json()
+        self.assertEqual(len(response["results"]), 2)
+        self.assertIsNone(response["next"])
+
+    def test_follows_saves_and_archiving(self):
+        self.issue.title = "Wake schedule"
+        self.issue.save()
+        self.assertEqual(self.search("wake")[0]["number"], self.issue.number)
+        self.issue.deleted = True
+        self.issue.save()
+        # Along with the issue's comments
+        self.assertEqual([r["type"] for r in self.search("sleep")], ["experiment"])
+
+        batch_url = f"/api/dev/labs/{self.lab.pk}/issues/batch/"
+        self.client.post(
+            batch_url,
+            [{"op": "create", "data": {"title": "Batch nap"}}],
+            content_type="application/json",
+        )
+        self.assertEqual(len(self.search("nap")), 1)
+
+        imported = import_lab(export_lab(self.lab))
+        self.assertEqual(len(self.search("nap", lab=imported)), 1)
+
+    def test_follows_deletes(self):
+        url = f"/api/dev/labs/{self.lab.pk}/issues/{self.issue.pk}/comments/"
+        response = self.client.delete(f"{url}{self.comment.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            [r["type"] for r in self.search("sleep")], ["issue", "experiment"]
+        )
+
+        self.lab.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM api_search WHERE lab_id = %s", [self.lab.pk]
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM api_search")
+        self.assertEqual(self.search("sleep"), [])
+        output = StringIO()
+        call_command("rebuild_search_index", stdout=output)
+        self.assertEqual(len(self.search("sleep")), 3)
+
+
+class ChangesTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(2)
+        self.url = f"/api/dev/labs/{self.lab.pk}/changes/"
+        self.token = self.client.get(self.url).json()["token"]
+
+    def changes(self):
+        response = self.client.get(self.url, {"since": self.token})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.token = body["token"]
+        return [(c["type"], c["id"]) for c in body["changes"]]
+
+    def test_up_to_date_client_costs_one_log_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.changes(), [])
+        # The lab's version for the ETag, and the log
+        self.assertEqual(len(queries), 2)
+
+    def test_returns_each_changed_record_once(self):
+        issue = self.lab.issues.get(number=1)
+        issue.title = "Renamed"
+        issue.save()
+        issue.state = CLOSED
+        issue.save()
+        IssueComment.objects.create(issue=issue, body="Done")
+        comment = issue.comments.get()
+        response = self.client.get(self.url, {"since": self.token}).json()
+        self.assertEqual(
+            [(c["type"], c["id"]) for c in response["changes"]],
+            [("issue", issue.pk), ("lab", self.lab.pk), ("issuecomment", comment.pk)],
+        )
+        self.assertEqual(response["changes"][0]["data"]["state"], CLOSED)
+        self.token = response["token"]
+
+        comment_pk = comment.pk
+        comment.delete()
+        response = self.client.get(self.url, {"since": self.token}).json()
+        self.assertEqual(
+            response["changes"],
+            [{"type": "issuecomment", "id": comment_pk, "data": None}],
+        )
+        self.token = response["token"]
+        self.assertEqual(self.changes(), [])
+
+    def test_logs_relations_and_batches(self):
+        experiment = self.lab.experiments.get()
+        issue = Issue.objects.create(lab=self.lab, title="New")
+        experiment.issues.add(issue)
+        self.assertEqual(
+            self.changes(),
+            [
+                ("lab", self.lab.pk),
+                ("experiment", experiment.pk),
+                ("issue", issue.pk),
+            ],
+        )
+        self.client.post(
+            f"/api/dev/labs/{self.lab.pk}/issues/batch/",
+            [{"op": "update", "number": issue.number, "data": {"experiments": []}}],
+            content_type="application/json",
+        )
+        self.assertEqual(
+            sorted(self.changes()),
+            [("experiment", experiment.pk), ("issue", issue.pk)],
+        )
+
+    def test_deleting_a_lab_deletes_its_log(self):
+        IssueComment.objects.create(issue=self.lab.issues.first(), body="Bye")
+        self.lab.delete()
+        # Checks the foreign keys of the log entries that deleting the
+        # comment logged
+        connection.check_constraints()
+        self.assertFalse(Change.objects.exists())
+
+
+class EventStreamTest(TransactionTestCase):
+    def run_app(self, coroutine):
+        return asyncio.run(asyncio.wait_for(coroutine, timeout=30))
+
+    def test_fans_out_without_a_thread_per_subscriber(self):
+        lab = Lab.objects.create()
+        threads = threading.active_count()
+        result = self.run_app(
+            time_event_fanout(
+                application,
+                lab.pk,
+                500,
+                2,
+                lambda: Issue.objects.create(lab=lab, title="New"),
+            )
+        )
+        # Only sync_to_async's thread for database access
+        self.assertLessEqual(result["threads"], threads + 1)
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    def test_missing_lab(self):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/api/dev/labs/999/events/"}
+        self.run_app(application(scope, None, send))
+        self.assertEqual(messages[0]["status"], 404)
+
+
+class ReadPoolTest(TransactionTestCase):
+    def test_hot_reads_are_pooled_and_unchanged(self):
+        lab = make_lab(3)
+        IssueComment.objects.create(issue=lab.issues.first(), body="Comment")
+        handler = ReadPoolASGIHandler(threads=2)
+        for path in [
+            f"/api/dev/labs/{lab.pk}/",
+            f"/api/dev/labs/{lab.pk}/issues/",
+            f"/api/dev/labs/{lab.pk}/experiments/",
+            f"/api/dev/labs/{lab.pk}/check-ins/",
+            f"/api/dev/labs/{lab.pk}/issues/1/comments/",
+        ]:
+            expected = wsgi_get(WSGIHandler(), path)
+            self.assertEqual(expected[0], 200)
+            self.assertEqual(asyncio.run(asgi_get(handler, path)), expected)
+        self.assertTrue(handler.executor._threads)
+
+    def test_streams_exports_off_the_event_loop(self):
+        lab = make_lab(3)
+        path = f"/api/dev/labs/{lab.pk}/export/"
+        status, body = asyncio.run(asgi_get(application, path))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, wsgi_get(WSGIHandler(), path)[1])
+        self.assertEqual(
+            Counter(json.loads(line)["type"] for line in body.splitlines())["issue"], 3
+        )
+
+    def test_other_requests_keep_to_the_shared_thread(self):
+        lab = make_lab(1)
+        handler = ReadPoolASGIHandler(threads=2)
+        for path in [
+            f"/api/dev/labs/{lab.pk}/issues/1/",
+            # Which can create today's check-in
+            f"/api/dev/labs/{lab.pk}/check-ins/today/",
+        ]:
+            status, _ = asyncio.run(asgi_get(handler, path))
+            self.assertIn(status, (200, 201))
+        self.assertFalse(handler.executor._threads)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.staff = Client()
+        self.staff.force_login(
+            User.objects.get_or_create(username="staff", is_staff=True)[0]
+        )
+
+    def sample(self, name: str, **labels) -> float:
+        text = self.staff.get("/metrics").content.decode()
+        prefix = name + "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+        for line in text.splitlines():
+            if line.startswith(prefix + " "):
+                return float(line.split()[-1])
+        return 0.0
+
+    def test_records_requests_per_route(self):
+        lab = make_lab(2)
+        route = {"method": "GET", "route": "issues-list"}
+        before = {
+            name: self.sample(name, **route)
+            for name in [
+                "lifelab_http_request_duration_seconds_count",
+                "lifelab_http_request_queries_sum",
+                "lifelab_http_request_serialize_seconds_total",
+                "lifelab_http_request_render_seconds_total",
+                "lifelab_http_response_bytes_sum",
+            ]
+        }
+        requests = self.sample("lifelab_http_requests_total", **route, status=200)
+        queries = []
+
+        def count(execute, *args):
+            queries.append(args)
+            return execute(*args)
+
+        with connection.execute_wrapper(count):
+            response = self.client.get(f"/api/dev/labs/{lab.pk}/issues/")
+
+        after = {name: self.sample(name, **route) for name in before}
+        self.assertEqual(
+            self.sample("lifelab_http_requests_total", **route, status=200),
+            requests + 1,
+        )
+        self.assertEqual(
+            after["lifelab_http_request_duration_seconds_count"],
+            before["lifelab_http_request_duration_seconds_count"] + 1,
+        )
+        self.assertEqual(
+            after["lifelab_http_request_queries_sum"],
+            before["lifelab_http_request_queries_sum"] + len(queries),
+        )
+        self.assertEqual(
+            after["lifelab_http_response_bytes_sum"],
+            before["lifelab_http_response_bytes_sum"] + len(response.content),
+        )
+        for phase in ["serialize", "render"]:
+            name = f"lifelab_http_request_{phase}_seconds_total"
+            self.assertGreater(after[name], before[name])
+        self.assertEqual(
+            self.sample(
+                "lifelab_http_request_duration_seconds_bucket", **route, le="+Inf"
+            ),
+            after["lifelab_http_request_duration_seconds_count"],
+        )
+
+    def test_only_served_to_staff(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        self.assertEqual(self.staff.get("/metrics").status_code, 200)
+
+    def test_warns_over_budget(self):
+        lab = make_lab(1)
+        with self.assertLogs("api.metrics", "WARNING") as logs:
+            with override_settings(REQUEST_QUERY_BUDGET=0):
+                self.client.get(f"/api/dev/labs/{lab.pk}/issues/")
+        self.assertIn(f"GET /api/dev/labs/{lab.pk}/issues/ took", logs.output[0])
+
+
+class QueryPlanTest(TestCase):
+    @skipUnless(connection.vendor == "sqlite", "SQLite only")
+    def test_reads_use_live_indexes(self):
+        lab = make_lab(3)
+        out = StringIO()
+        call_command("explain_queries", "--check", "--lab", lab.pk, stdout=out)
+        for index in [
+            "issue_live_lab_number",
+            "experiment_live_lab_number",
+            "experiment_live_lab_state",
+            "check_in_live_lab_number",
+            "check_in_unique_local_date_in_lab",
+        ]:
+            self.assertIn(f"USING INDEX {index} ", out.getvalue())
+        # Lists are read in the order of the index, not sorted afterwards
+        name = None
+        for line in out.getvalue().splitlines():
+            if not line.startswith(" "):
+                name = line
+            elif name.endswith(("list:", "page:")):
+                self.assertNotIn("TEMP B-TREE", line, name)
+
+
+class DatabaseProfileTest(TestCase):
+    @skipUnless(connection.vendor == "sqlite", "SQLite only")
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(
+                cursor.fetchone()[0], settings.SQLITE_PRAGMAS["busy_timeout"]
+            )
+
+    def test_persistent_connections(self):
+        self.assertEqual(
+            connection.settings_dict["CONN_MAX_AGE"], settings.CONN_MAX_AGE
+        )
+
+
+@override_settings(RESPONSE_CACHE=None)
+class RowSerializerParityTest(TestCase):
+    # Row serializers against the DRF serializers' responses, byte for byte
+    def setUp(self):
+        self.lab = make_lab(4)
+        issues = list(self.lab.issues.order_by("number"))
+        issues[0].description = 'Quotes " and \\, a\u2028line and \u00e9\U0001f600\x01'
+        issues[0].save()
+        issues[1].deleted = True
+        issues[1].save()
+        IssueComment.objects.create(issue=issues[2], body="Comment")
+        experiment = Experiment.objects.create(
+            lab=self.lab,
+            title="Second",
+            terms="Terms",
+            description="",
+            end_date=date.today(),
+        )
+        # Linked out of number order, including the archived issue
+        experiment.issues.add(issues[3], issues[1], issues[0])
+        check_in = self.lab.check_ins.order_by("number").last()
+        check_in.experiments.add(experiment)
+        self.base = f"/api/dev/labs/{self.lab.pk}/"
+
+    def get(self, url: str, **headers):
+        with override_settings(ROW_SERIALIZERS=False):
+            expected = self.client.get(url, **headers)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, expected.status_code, url)
+        self.assertEqual(response.content, expected.content, url)
+        self.assertEqual(response.get("Content-Type"), expected.get("Content-Type"))
+        self.assertEqual(response.get("Vary"), expected.get("Vary"))
+        return response, queries
+
+    def paths(self):
+        for name in ["issues", "experiments", "check-ins"]:
+            yield f"{self.base}{name}/"
+            yield f"{self.base}{name}/?page_size=2"
+            for number in range(1, 7):
+                yield f"{self.base}{name}/{number}/"
+            yield f"{self.base}{name}/abc/"
+        yield f"{self.base}check-ins/today/"
+
+    def test_same_responses(self):
+        for path in self.paths():
+            self.get(path)
+
+    def test_same_paginated_responses(self):
+        for name in ["issues", "experiments", "check-ins"]:
+            url = f"{self.base}{name}/?page_size=2"
+            while url:
+                response, _ = self.get(url)
+                url = response.json()["next"]
+
+    def test_same_responses_for_other_hosts_and_formats(self):
+        for headers in [
+            {"HTTP_HOST": "example.com:8080", "secure": True},
+            {"HTTP_ACCEPT": "application/json; indent=2"},
+        ]:
+            for path in self.paths():
+                self.get(path, **headers)
+        self.get(f"{self.base}issues.json")
+
+    def test_same_responses_with_standard_json(self):
+        with mock.patch("api.rows.orjson", None):
+            for path in self.paths():
+                self.get(path)
+
+    def test_queries_do_not_grow_with_rows(self):
+        _, queries = self.get(f"{self.base}experiments/")
+        # The lab's state, the experiments, and each of their two relations
+        self.assertEqual(len(queries), 4)
+
+
+class CheckInTodayTest(TestCase):
+    def test_today_is_per_lab(self):
+        lab = Lab.objects.create()
+        other_lab = make_lab(1)
+        response = self.client.get(f"/api/dev/labs/{lab.pk}/check-ins/today/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(lab.check_ins.get().local_date, local_date(lab.time_zone))
+        self.assertEqual(other_lab.check_ins.count(), 1)
+
+        response = self.client.get(f"/api/dev/labs/{lab.pk}/check-ins/today/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lab.check_ins.count(), 1)
+
+    def test_today_uses_lab_time_zone(self):
+        lab = Lab.objects.create(time_zone="Pacific/Kiritimati")
+        self.client.get(f"/api/dev/labs/{lab.pk}/check-ins/today/")
+        self.assertEqual(
+            lab.check_ins.get().local_date, local_date("Pacific/Kiritimati")
+        )
+
+    def test_today_reads_the_lab_once(self):
+        lab = make_lab(1)
+        queries = []
+
+        def record(execute, sql, *args):
+            queries.append(sql)
+            return execute(sql, *args)
+
+        with override_settings(RESPONSE_CACHE=None), connection.execute_wrapper(record):
+            response = self.client.get(f"/api/dev/labs/{lab.pk}/check-ins/today/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([sql for sql in queries if 'FROM "api_lab"' in sql]), 1)
+
+    def test_today_of_missing_lab(self):
+        response = self.client.get("/api/dev/labs/0/check-ins/today/")
+        self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentCheckInTodayTest(TransactionTestCase):
+    def test_concurrent_first_requests(self):
+        lab = Lab.objects.create()
+        url = f"/api/dev/labs/{lab.pk}/check-ins/today/"
+
+        def get_today(_) -> int:
+            try:
+                return Client().get(url).json()["number"]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(8) as executor:
+            numbers = set(executor.map(get_today, range(8)))
+
+        self.assertEqual(lab.check_ins.filter(deleted=False).count(), 1)
+        self.assertEqual(numbers, {lab.check_ins.get().number})
+
+
+class BenchmarkTest(TestCase):
+    # Runs every route once at the baseline's size, failing on errors and on
+    # queries the baseline doesn't have. Timings are left to benchmark_routes
+    def test_routes_match_baseline(self):
+        with open(BENCHMARK_BASELINE) as f:
+            baseline = json.load(f)
+        config = baseline["config"]
+        lab = seed_lab(
+            issues=config["issues"],
+            comments_per_issue=config["comments_per_issue"],
+            experiments=config["experiments"],
+            check_ins=config["check_ins"],
+        )
+        results = {}
+        with override_settings(RESPONSE_CACHE=None):
+            for name, url in route_urls(lab).items():
+                self.client.get(url)
+                results[name] = time_requests(self.client, url, 1)
+                self.assertLess(results[name]["status"], 500, name)
+
+        self.assertEqual(set(results), set(baseline["routes"]))
+        regressions = compare_results(results, baseline["routes"], tolerance=100)
+        self.assertEqual(regressions, [])
+
+
+class StatsTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(3)
+        self.url = f"/api/dev/labs/{self.lab.pk}/stats/"
+        # Built on the first read; counters keep it up to date from then on
+        self.client.get(self.url)
+
+    def assertCounted(self):
+        stats = LabStats.objects.values().get(lab=self.lab)
+        self.assertEqual(
+            {name: stats[name] for name in LabStats.count(self.lab.pk)},
+            LabStats.count(self.lab.pk),
+        )
+
+    def test_counters_follow_state_changes(self):
+        issue = self.lab.issues.get(number=1)
+        issue.state = CLOSED
+        issue.save()
+        self.lab.issues.get(number=2).comments.create(body="A")
+        self.lab.issues.get(number=3).comments.create(body="B")
+        comment = issue.comments.create(body="C")
+        comment.deleted = True
+        comment.save()
+        archived = self.lab.issues.get(number=3)
+        archived.deleted = True
+        archived.save()
+        experiment = self.lab.experiments.get()
+        experiment.state = Experiment.COMMITTED
+        experiment.save()
+        self.client.post(
+            f"/api/dev/labs/{self.lab.pk}/issues/batch/",
+            [
+                {"op": "create", "data": {"title": "New"}},
+                {"op": "update", "number": 2, "data": {"state": CLOSED}},
+            ],
+            content_type="application/json",
+        )
+        self.assertCounted()
+
+        stats = self.client.get(self.url).json()
+        self.assertEqual(stats["issues"], {"open": 1, "closed": 2})
+        self.assertEqual(
+            stats["experiments"], {"inactive": 0, "active": 0, "committed": 1}
+        )
+        self.assertEqual(stats["comments"], 2)
+
+    def test_stale_copies_count_a_change_once(self):
+        # As when concurrent requests make the same change
+        first, second = self.lab.issues.get(number=1), self.lab.issues.get(number=1)
+        first.state = second.state = CLOSED
+        first.save()
+        second.save()
+        comments = self.lab.issues.get(number=2).comments
+        comments.create(body="A")
+        first, second = comments.get(), comments.get()
+        first.deleted = second.deleted = True
+        first.save()
+        second.save()
+        comment = comments.create(body="B")
+        first, second = comments.get(pk=comment.pk), comments.get(pk=comment.pk)
+        first.delete()
+        second.delete()
+        self.assertCounted()
+        self.assertEqual(self.lab.issues.get(number=2).comment_count, 0)
+
+        # A stale copy that writes back an old state counts it as a change
+        second = self.lab.issues.get(number=2)
+        first = self.lab.issues.get(number=2)
+        first.state = CLOSED
+        first.save()
+        second.title = "Renamed"
+        second.save()
+        self.assertCounted()
+
+    def test_streak_follows_check_ins(self):
+        # make_lab's check-ins are for today and the two days before
+        check_ins = list(self.lab.check_ins.order_by("-local_date"))
+        for check_in in check_ins:
+            check_in.complete = True
+            check_in.save()
+        streak = self.client.get(self.url).json()["checkIns"]
+        self.assertEqual(streak["streak"], 3)
+        self.assertEqual(streak["lastComplete"], date.today().isoformat())
+
+        check_ins[1].deleted = True
+        check_ins[1].save()
+        self.assertCounted()
+        streak = self.client.get(self.url).json()["checkIns"]
+        self.assertEqual((streak["total"], streak["complete"]), (2, 2))
+        self.assertEqual(streak["streak"], 1)
+
+        check_ins[0].complete = False
+        check_ins[0].save()
+        # Ended two days ago
+        self.assertEqual(self.client.get(self.url).json()["checkIns"]["streak"], 0)
+
+    def test_issues_show_comment_count(self):
+        issue = self.lab.issues.get(number=1)
+        comments = [issue.comments.create(body=str(i)) for i in range(3)]
+        comments[0].delete()
+        url = f"/api/dev/labs/{self.lab.pk}/issues/"
+        queries = []
+
+        def log(execute, sql, *args):
+            queries.append(sql)
+            return execute(sql, *args)
+
+        for row_serializers in [True, False]:
+            with override_settings(ROW_SERIALIZERS=row_serializers):
+                with connection.execute_wrapper(log):
+                    results = self.client.get(url).json()
+                self.assertEqual([r["commentCount"] for r in results], [2, 0, 0])
+        self.assertTrue(queries)
+        self.assertFalse([sql for sql in queries if "COUNT(" in sql])
+        # Saving an issue loaded before the comments keeps their count
+        issue.title = "Renamed"
+        issue.save()
+        self.assertEqual(Issue.objects.get(pk=issue.pk).comment_count, 2)
+
+    def test_reconcile_fixes_drift(self):
+        LabStats.objects.filter(lab=self.lab).update(open_issues=10, streak=4)
+        Issue.objects.filter(lab=self.lab, number=1).update(comment_count=5)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("reconcile_stats", "--check", stdout=out)
+        call_command("reconcile_stats", "--lab", self.lab.pk, stdout=out)
+        self.assertIn("open_issues: 10 counted as 3", out.getvalue())
+        self.assertIn("issue 1 comment_count: 5 counted as 0", out.getvalue())
+        self.assertCounted()
+        self.assertEqual(Issue.objects.get(lab=self.lab, number=1).comment_count, 0)
+
+    def test_import_counts_imported_records(self):
+        self.lab.issues.get(number=1).comments.create(body="A")
+        imported = import_lab(export_lab(self.lab))
+        self.assertEqual(
+            LabStats.objects.values().get(lab=imported),
+            {**LabStats.objects.values().get(lab=self.lab), "lab_id": imported.pk},
+        )
+        self.assertEqual(imported.issues.get(number=1).comment_count, 1)
+
+
+@override_settings(RESPONSE_CACHE=None)
+class FieldSelectionTest(TestCase):
+    def setUp(self):
+        self.lab = seed_lab(issues=4, comments_per_issue=2, experiments=2, check_ins=2)
+        self.url = f"/api/dev/labs/{self.lab.pk}/issues/"
+
+    def get(self, url, **params):
+        queries = []
+
+        def log(execute, sql, *args):
+            queries.append(sql)
+            return execute(sql, *args)
+
+        with connection.execute_wrapper(log):
+            response = self.client.get(url, params, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, queries
+
+    def test_fields_trim_response_and_queries(self):
+        _, all_queries = self.get(self.url)
+        for row_serializers in [True, False]:
+            with override_settings(ROW_SERIALIZERS=row_serializers):
+                response, queries = self.get(self.url, fields="title,commentCount")
+            self.assertEqual(
+                response.json()[0], {"title": "Issue 0", "commentCount": 2}
+            )
+            # Without the experiments' prefetch
+            self.assertEqual(len(queries), len(all_queries) - 1)
+
+        # Cursors still come from the number, which isn't serialized
+        response, _ = self.get(self.url, fields="title", page_size=3)
+        next_page, _ = self.get(response.json()["next"])
+        self.assertEqual(next_page.json()["results"], [{"title": "Issue 3"}])
+
+    def test_expand_embeds_with_a_prefetch_per_relation(self):
+        response, queries = self.get(self.url, expand="experiments,comments")
+        _, links = self.get(self.url)
+        self.assertEqual(len(queries), len(links) + 1)
+        issue = response.json()[0]
+        self.assertEqual(
+            [c["body"] for c in issue["comments"]], ["Comment 0", "Comment 1"]
+        )
+        self.assertEqual([e["title"] for e in issue["experiments"]], ["Experiment 0"])
+        # Without their own to-many links
+        self.assertNotIn("issues", issue["experiments"][0])
+
+        response, _ = self.get(
+            f"/api/dev/labs/{self.lab.pk}/experiments/1/",
+            fields="title",
+            expand="checkIns",
+        )
+        self.assertEqual([c["number"] for c in response.json()["checkIns"]], [1, 2])
+        self.assertEqual(set(response.json()), {"title", "checkIns"})
+
+    def test_rejects_unknown_names(self):
+        response = self.client.get(self.url, {"fields": "nope", "expand": "title"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"fields", "expand"})
+
+
+class CompressionTest(TestCase):
+    def setUp(self):
+        self.lab = make_lab(20)
+        self.url = f"/api/dev/labs/{self.lab.pk}/issues/"
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(negotiate("*"), next(iter(ENCODINGS)))
+        self.assertIsNone(negotiate("gzip;q=0, deflate"))
+        self.assertIsNone(negotiate("*;q=0"))
+        self.assertIsNone(negotiate(""))
+
+    def test_compresses_large_responses(self):
+        plain = self.client.get(self.url)
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", plain["Vary"])
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        # Lab ETags are weak already, as a compressed body's must be
+        self.assertEqual(response["ETag"], plain["ETag"])
+        self.assertTrue(response["ETag"].startswith("W/"))
+
+        # Weak comparison, so the compressed response's ETag still matches
+        response = self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_leaves_small_responses(self):
+        with override_settings(COMPRESSION_MIN_SIZE=10**6):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertNotIn("Accept-Encoding", response.get("Vary", ""))
+
+    def test_compresses_streams_chunk_by_chunk(self):
+        url = f"/api/dev/labs/{self.lab.pk}/export/"
+        plain = b"".join(self.client.get(url).streaming_content)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertFalse(response.has_header("Content-Length"))
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        # Each chunk is flushed, so what's arrived so far can be decompressed
+        partial = gzip.zlib.decompressobj(16 + gzip.zlib.MAX_WBITS)
+        self.assertTrue(plain.startswith(partial.decompress(chunks[0])))
+        self.assertEqual(gzip.decompress(b"".join(chunks)), plain)
+
+    def test_wire_cost(self):
+        result = wire_cost(self.client, self.url, 2, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(result["encoding"], "gzip")
+        self.assertEqual(result["status"], 200)
+
+    @skipUnless(msgpack, "msgpack isn't installed")
+    def test_message_pack(self):
+        for row_serializers in [True, False]:
+            with override_settings(ROW_SERIALIZERS=row_serializers):
+                response = self.client.get(self.url, HTTP_ACCEPT="application/msgpack")
+            self.assertEqual(response["Content-Type"], "application/msgpack")
+            self.assertEqual(
+                msgpack.unpackb(response.content), self.client.get(self.url).json()
+            )
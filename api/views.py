@@ -1,19 +1,75 @@
+import hashlib
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-from rest_framework import viewsets, mixins, status
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from djangorestframework_camel_case.util import camel_to_underscore
+from rest_framework import viewsets, mixins, serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
-from api.models import Issue, Lab, IssueComment, Experiment, CheckIn
+from api.backup import export_lab
+from api.batch import BatchMixin
+from api.cache import get_response_cache
+from api.models import (
+    Issue,
+    Lab,
+    IssueComment,
+    Experiment,
+    CheckIn,
+    QueueItem,
+    LabStats,
+    DeltaEncoded,
+    local_date,
+)
+from api.pagination import (
+    NumberCursorPagination,
+    CreatedCursorPagination,
+    HistoryCursorPagination,
+)
+from api.rows import Prepared
+from api.search import search_lab, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
 from api.serializers import (
+    EMBEDDED,
     IssueSerializer,
     LabSerializer,
     IssueCommentSerializer,
     ExperimentSerializer,
     CheckInSerializer,
+    IssueDescriptionHistoryItemSerializer,
+    IssueStateHistoryItemSerializer,
+    IssueCommentHistoryItemSerializer,
+    ExperimentTermsHistoryItemSerializer,
+    ExperimentEndDateHistoryItemSerializer,
+    IssueRowSerializer,
+    ExperimentRowSerializer,
+    CheckInRowSerializer,
+    QueueMoveSerializer,
 )
+from api.sync import changes_since, latest_token
+
+# Actions whose responses serialize the queryset's relations, and so are worth
+# prefetching for
+READ_ACTIONS = ("list", "retrieve", "batch", "today")
+
+# Actions whose GETs take ?fields= and ?expand=
+SPARSE_ACTIONS = ("list", "retrieve", "today")
+
+
+# Serializers for each record type in the change log
+CHANGE_SERIALIZERS = {
+    "lab": LabSerializer,
+    "issue": IssueSerializer,
+    "experiment": ExperimentSerializer,
+    "checkin": CheckInSerializer,
+    "issuecomment": IssueCommentSerializer,
+}
 
 
 class ArchiveDeleteMixin:
@@ -22,31 +78,459 @@ class ArchiveDeleteMixin:
         instance.save()
 
 
-class LabViewSet(viewsets.ModelViewSet):
-    queryset = Lab.objects.all()
+class HistoryMixin:
+    def history_response(self, related_name: str, serializer_class) -> Response:
+        # A page of one of the object's histories, read off its (parent,
+        # created) index
+        queryset = getattr(self.get_object(), related_name).all()
+        paginator = HistoryCursorPagination()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        if issubclass(queryset.model, DeltaEncoded):
+            queryset.model.decode(page)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+
+class SparseFieldsMixin:
+    # ?fields= trims GET responses to the given fields, and ?expand= embeds the
+    # given relations' records in place of links to them (see
+    # FieldSelectionMixin). Both take comma-separated names, in camelCase or
+    # not. Relations that aren't rendered aren't prefetched either
+
+    # Prefetches for the relations whose links need their records
+    link_prefetches: Dict[str, Prefetch] = {}
+    # Prefetches for the other relations, when they're embedded
+    expand_prefetches: Dict[str, Prefetch] = {}
+
+    def get_field_selection(self) -> Tuple[Optional[List[str]], List[str]]:
+        # The requested (fields, expand); fields is None for all of them
+        if not hasattr(self, "_field_selection"):
+            self._field_selection = (None, [])
+            # Views built without a request, as by explain_queries, get it all
+            request = getattr(self, "request", None)
+            if request and request.method == "GET" and self.action in SPARSE_ACTIONS:
+                self._field_selection = self.parse_field_selection(request.query_params)
+        return self._field_selection
+
+    def parse_field_selection(self, params) -> Tuple[Optional[List[str]], List[str]]:
+        serializer_class = self.get_serializer_class()
+        names = {
+            "fields": (serializer_class.Meta.fields, "Unknown field {!r}."),
+            "expand": (EMBEDDED.get(serializer_class, {}), "Can't expand {!r}."),
+        }
+        selection = {}
+        errors = {}
+        for param, (allowed, message) in names.items():
+            value = params.get(param)
+            if value is None:
+                continue
+            selection[param] = [
+                camel_to_underscore(name.strip())
+                for name in value.split(",")
+                if name.strip()
+            ]
+            unknown = [name for name in selection[param] if name not in allowed]
+            if unknown:
+                errors[param] = [message.format(name) for name in unknown]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return selection.get("fields"), selection.get("expand", [])
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.get_field_selection()
+        if fields is not None or expand:
+            kwargs.update(fields=fields, expand=expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def prefetch_relations(self, queryset):
+        fields, expand = self.get_field_selection()
+        prefetches = [
+            prefetch
+            for name, prefetch in self.link_prefetches.items()
+            if fields is None or name in fields or name in expand
+        ]
+        prefetches += [
+            prefetch
+            for name, prefetch in self.expand_prefetches.items()
+            if name in expand
+        ]
+        return queryset.select_related("lab").prefetch_related(*prefetches)
+
+
+class RowSerializerMixin:
+    # Serves JSON lists and retrieves from row_serializer_class, which skips
+    # DRF's field machinery but gives the same output as serializer_class
+    row_serializer_class = None
+
+    def use_row_serializer(self, request) -> bool:
+        return (
+            settings.ROW_SERIALIZERS
+            and getattr(request.accepted_renderer, "renders_prepared", False)
+            # A format suffix would change the hyperlinks
+            and self.format_kwarg is None
+            # Embedded records are left to the DRF serializers
+            and not self.get_field_selection()[1]
+        )
+
+    def get_row_serializer(self, request):
+        return self.row_serializer_class(request, fields=self.get_field_selection()[0])
+
+    def list(self, request, *args, **kwargs) -> Response:
+        if not self.use_row_serializer(request):
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_row_serializer(request)
+        # The cursor is read from the ordering column, whichever fields are
+        # serialized
+        ordering = getattr(self.paginator, "ordering", None)
+        queryset = serializer.values(
+            self.filter_queryset(self.get_queryset()),
+            *([ordering.lstrip("-")] if isinstance(ordering, str) else []),
+        )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(Prepared(serializer.to_representation(list(queryset))))
+        response = self.get_paginated_response(serializer.to_representation(page))
+        response.data = Prepared(response.data)
+        return response
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if not self.use_row_serializer(request) or not str(lookup).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        rows = self.get_row_serializer(request).rows(
+            self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: lookup}
+            )
+        )
+        if not rows:
+            # For the same 404
+            return super().retrieve(request, *args, **kwargs)
+        return Response(Prepared(rows[0]))
+
+
+class LabVersionMixin:
+    # Answers conditional requests from the lab's change version, so unchanged
+    # polls get a 304 without running the queryset or serializers, and serves
+    # other GETs from the response cache while the version stays the same
+    lab_lookup_url_kwarg = "lab_pk"
+    # For views whose responses also depend on the date in the lab's time zone
+    etag_includes_date = False
+
+    def dispatch(self, request, *args, **kwargs):
+        conditional = condition(
+            etag_func=self.get_etag, last_modified_func=self.get_last_modified
+        )
+        return conditional(self.cached_dispatch)(request, *args, **kwargs)
+
+    def cached_dispatch(self, request, *args, **kwargs):
+        cache = get_response_cache()
+        if (
+            cache is None
+            or request.method != "GET"
+            or self.get_lab_state(request, kwargs) is None
+        ):
+            return super().dispatch(request, *args, **kwargs)
+
+        lab_pk = int(kwargs[self.lab_lookup_url_kwarg])
+        modified = self.get_lab_state(request, kwargs)["modified"]
+        # modified tells apart labs that reuse the pk of a deleted one, and the
+        # absolute URI covers the host and scheme the hyperlinks are built from
+        key = "{}-{}:{}".format(
+            "-".join(self.get_etag_parts(request, kwargs)),
+            modified.timestamp(),
+            request.build_absolute_uri(),
+        )
+        cached = cache.get(lab_pk, key)
+        if cached is not None:
+            content, headers = cached
+            # Authenticating as DRF would, for SessionMiddleware to vary the
+            # response on Cookie as it does uncached ones
+            request.user.is_authenticated
+            response = HttpResponse(content)
+            for name, value in headers:
+                response[name] = value
+            return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        renderer = getattr(response, "accepted_renderer", None)
+        # The browsable API embeds per-request details like CSRF tokens
+        if response.status_code == 200 and renderer and renderer.format == "json":
+            response.render()
+            # With every header the view set, like Allow, so that hits match
+            cache.set(lab_pk, key, (response.content, list(response.items())))
+        return response
+
+    def get_lab_state(self, request, kwargs) -> Optional[dict]:
+        if not hasattr(request, "_lab_state"):
+            lab_pk = kwargs.get(self.lab_lookup_url_kwarg)
+            request._lab_state = (
+                Lab.objects.filter(pk=lab_pk)
+                .values("version", "modified", "time_zone")
+                .first()
+                if lab_pk is not None and str(lab_pk).isdigit()
+                else None
+            )
+        return request._lab_state
+
+    def get_etag_parts(self, request, kwargs) -> List[str]:
+        state = self.get_lab_state(request, kwargs)
+        # The same version renders differently for different Accept headers
+        accept = request.META.get("HTTP_ACCEPT", "").encode()
+        parts = [
+            kwargs[self.lab_lookup_url_kwarg],
+            str(state["version"]),
+            hashlib.md5(accept).hexdigest()[:8],
+        ]
+        if self.etag_includes_date:
+            parts.append(local_date(state["time_zone"]).isoformat())
+        return parts
+
+    def get_etag(self, request, *args, **kwargs) -> Optional[str]:
+        if self.get_lab_state(request, kwargs) is None:
+            return None
+        return 'W/"{}"'.format("-".join(self.get_etag_parts(request, kwargs)))
+
+    def get_last_modified(self, request, *args, **kwargs) -> Optional[datetime]:
+        state = self.get_lab_state(request, kwargs)
+        return state["modified"] if state else None
+
+
+class LabViewSet(LabVersionMixin, viewsets.ModelViewSet):
+    queryset = Lab.objects.prefetch_related("queue_items")
     serializer_class = LabSerializer
     pagination_class = None
+    lab_lookup_url_kwarg = "pk"
+    # Whether the check-in streak is current depends on the date
+    etag_includes_date = True
 
+    @action(detail=True, methods=["post"], url_path="queue/move", url_name="queue-move")
+    def queue_move(self, request, *args, **kwargs) -> Response:
+        # Moves one issue, rather than PATCHing the whole queue. Moves from
+        # different clients don't undo each other
+        lab = self.get_object()
+        move = QueueMoveSerializer(data=request.data)
+        move.is_valid(raise_exception=True)
+        try:
+            lab.move_in_queue(
+                move.validated_data["issue"],
+                before=move.validated_data.get("before"),
+                after=move.validated_data.get("after"),
+            )
+        except QueueItem.DoesNotExist as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(self.get_object()).data)
+
+    @action(detail=True, methods=["get"])
+    def export(self, request, *args, **kwargs) -> StreamingHttpResponse:
+        response = StreamingHttpResponse(
+            export_lab(self.get_object()), content_type="application/x-ndjson"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="lab-{kwargs["pk"]}.ndjson"'
+        )
+        return response
+
+    @action(detail=True, methods=["get"])
+    def changes(self, request, *args, **kwargs) -> Response:
+        # Without since, only the current token: clients get it before
+        # downloading the lab, and then ask for the changes since
+        if self.get_lab_state(request, kwargs) is None:
+            raise Http404
+        lab_pk = int(kwargs["pk"])
+        since = request.query_params.get("since")
+        if since is None:
+            return Response(
+                {"token": latest_token(lab_pk), "more": False, "changes": []}
+            )
+        if not since.isdigit():
+            return Response(
+                {"detail": "since must be a token from a previous response."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        token, more, changed = changes_since(lab_pk, int(since))
+        context = self.get_serializer_context()
+        return Response(
+            {
+                "token": token,
+                "more": more,
+                "changes": [
+                    {
+                        "type": record_type,
+                        "id": pk,
+                        "data": (
+                            CHANGE_SERIALIZERS[record_type](
+                                record, context=context
+                            ).data
+                            if record is not None
+                            else None
+                        ),
+                    }
+                    for record_type, pk, record in changed
+                ],
+            }
+        )
+
+    @action(detail=True, methods=["get"])
+    def stats(self, request, *args, **kwargs) -> Response:
+        # From counters kept as records are written, rather than counting them
+        state = self.get_lab_state(request, kwargs)
+        if state is None:
+            raise Http404
+        stats = LabStats.for_lab(int(kwargs["pk"]))
+        return Response(
+            {
+                "issues": {"open": stats.open_issues, "closed": stats.closed_issues},
+                "experiments": {
+                    "inactive": stats.inactive_experiments,
+                    "active": stats.active_experiments,
+                    "committed": stats.committed_experiments,
+                },
+                "check_ins": {
+                    "total": stats.check_ins,
+                    "complete": stats.complete_check_ins,
+                    "streak": stats.current_streak(local_date(state["time_zone"])),
+                    "last_complete": stats.streak_end,
+                },
+                "comments": stats.comments,
+            }
+        )
+
+    @action(detail=True, methods=["get"])
+    def search(self, request, *args, **kwargs) -> Response:
+        lab = self.get_object()
+        query = request.query_params.get("q", "")
+        try:
+            limit = min(
+                int(request.query_params.get("limit", SEARCH_DEFAULT_LIMIT)),
+                SEARCH_MAX_LIMIT,
+            )
+            offset = int(request.query_params.get("offset", 0))
+        except ValueError:
+            return Response(
+                {"detail": "limit and offset must be integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if limit < 1 or offset < 0:
+            return Response(
+                {"detail": "limit must be positive and offset not negative."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # One extra row tells whether there's a next page
+        results = search_lab(lab.pk, query, limit + 1, offset)
+        url = request.build_absolute_uri()
+        return Response(
+            {
+                "next": (
+                    replace_query_param(url, "offset", offset + limit)
+                    if len(results) > limit
+                    else None
+                ),
+                "previous": (
+                    replace_query_param(url, "offset", max(offset - limit, 0))
+                    if offset
+                    else None
+                ),
+                "results": results[:limit],
+            }
+        )
+
+
+class LabIssueViewSet(
+    LabVersionMixin,
+    SparseFieldsMixin,
+    RowSerializerMixin,
+    BatchMixin,
+    HistoryMixin,
+    ArchiveDeleteMixin,
+    viewsets.ModelViewSet,
+):
+    link_prefetches = {
+        "experiments": Prefetch(
+            "experiments", queryset=Experiment.objects.select_related("lab")
+        )
+    }
+    expand_prefetches = {
+        "comments": Prefetch(
+            "comments", queryset=IssueComment.objects.order_by("created")
+        )
+    }
 
-class LabIssueViewSet(ArchiveDeleteMixin, viewsets.ModelViewSet):
     def get_queryset(self):
-        return Issue.objects.filter(lab=self.kwargs["lab_pk"], deleted=False)
+        queryset = Issue.objects.filter(
+            lab=self.kwargs["lab_pk"], deleted=False
+        ).order_by("number")
+        if self.action in READ_ACTIONS:
+            queryset = self.prefetch_relations(queryset)
+        return queryset
 
     lookup_field = "number"
     serializer_class = IssueSerializer
-    pagination_class = None
+    row_serializer_class = IssueRowSerializer
+    pagination_class = NumberCursorPagination
+
+    def batch_written(self, instances: List[Issue]) -> List[Tuple[type, int]]:
+        if QueueItem.sync_issues(instances):
+            return [(Lab, int(self.kwargs["lab_pk"]))]
+        return []
+
+    @action(detail=True, methods=["get"], url_path="description-history")
+    def description_history(self, request, *args, **kwargs) -> Response:
+        return self.history_response(
+            "description_history", IssueDescriptionHistoryItemSerializer
+        )
+
+    @action(detail=True, methods=["get"], url_path="state-history")
+    def state_history(self, request, *args, **kwargs) -> Response:
+        return self.history_response("state_history", IssueStateHistoryItemSerializer)
+
 
+class LabExperimentViewSet(
+    LabVersionMixin,
+    SparseFieldsMixin,
+    RowSerializerMixin,
+    BatchMixin,
+    HistoryMixin,
+    ArchiveDeleteMixin,
+    viewsets.ModelViewSet,
+):
+    link_prefetches = {
+        "issues": Prefetch("issues", queryset=Issue.objects.select_related("lab")),
+        "check_ins": Prefetch(
+            "check_ins", queryset=CheckIn.objects.select_related("lab")
+        ),
+    }
 
-class LabExperimentViewSet(ArchiveDeleteMixin, viewsets.ModelViewSet):
     def get_queryset(self):
-        return Experiment.objects.filter(lab=self.kwargs["lab_pk"], deleted=False)
+        queryset = Experiment.objects.filter(
+            lab=self.kwargs["lab_pk"], deleted=False
+        ).order_by("number")
+        if self.action in READ_ACTIONS:
+            queryset = self.prefetch_relations(queryset)
+        return queryset
 
     lookup_field = "number"
     serializer_class = ExperimentSerializer
-    pagination_class = None
+    row_serializer_class = ExperimentRowSerializer
+    pagination_class = NumberCursorPagination
+
+    @action(detail=True, methods=["get"], url_path="terms-history")
+    def terms_history(self, request, *args, **kwargs) -> Response:
+        return self.history_response(
+            "terms_history", ExperimentTermsHistoryItemSerializer
+        )
+
+    @action(detail=True, methods=["get"], url_path="end-date-history")
+    def end_date_history(self, request, *args, **kwargs) -> Response:
+        return self.history_response(
+            "end_date_history", ExperimentEndDateHistoryItemSerializer
+        )
 
 
 class LabCheckInViewSet(
+    LabVersionMixin,
+    SparseFieldsMixin,
+    RowSerializerMixin,
     ArchiveDeleteMixin,
     mixins.RetrieveModelMixin,
     mixins.ListModelMixin,
@@ -54,19 +538,41 @@ class LabCheckInViewSet(
     mixins.DestroyModelMixin,
     viewsets.GenericViewSet,
 ):
+    link_prefetches = {
+        "experiments": Prefetch(
+            "experiments", queryset=Experiment.objects.select_related("lab")
+        )
+    }
+
     def get_queryset(self) -> List[CheckIn]:
-        return CheckIn.objects.filter(lab=self.kwargs["lab_pk"], deleted=False)
+        queryset = CheckIn.objects.filter(
+            lab=self.kwargs["lab_pk"], deleted=False
+        ).order_by("number")
+        if self.action in READ_ACTIONS:
+            queryset = self.prefetch_relations(queryset)
+        return queryset
 
     lookup_field = "number"
     serializer_class = CheckInSerializer
-    pagination_class = None
+    row_serializer_class = CheckInRowSerializer
+    pagination_class = NumberCursorPagination
+    # Which check-in is "today" changes with the date, not just the lab
+    etag_includes_date = True
 
     @action(detail=False, methods=["get", "put", "options", "patch", "delete"])
     def today(self, request, *args, **kwargs) -> Response:
-        instances = CheckIn.objects.filter(
-            created__date=datetime.today().date(), deleted=False
-        )
-        instance = instances[0] if len(instances) > 0 else None
+        # Loaded for the ETag already
+        state = self.get_lab_state(request, kwargs)
+        if state is None:
+            raise Http404
+        today = local_date(state["time_zone"])
+        # A single lookup on the (lab, local_date) unique index
+        queryset = self.get_queryset().filter(local_date=today)
+        if request.method == "GET" and self.use_row_serializer(request):
+            rows = self.get_row_serializer(request).rows(queryset)
+            if rows:
+                return Response(Prepared(rows[0]))
+        instance = queryset.first()
 
         if request.method == "GET":
             if instance:
@@ -75,7 +581,13 @@ class LabCheckInViewSet(
             else:
                 serializer = self.get_serializer(data={})
                 serializer.is_valid(raise_exception=True)
-                serializer.save()
+                try:
+                    with transaction.atomic():
+                        serializer.save(local_date=today)
+                except IntegrityError:
+                    # Another request created today's check-in first
+                    instance = self.get_queryset().get(local_date=today)
+                    return Response(self.get_serializer(instance).data)
                 headers = self.get_success_headers(serializer.data)
                 return Response(
                     serializer.data, status=status.HTTP_201_CREATED, headers=headers
@@ -100,6 +612,8 @@ class LabCheckInViewSet(
                 return Response(status=status.HTTP_404_NOT_FOUND)
 
         if request.method == "DELETE":
+            if not instance:
+                return Response(status=status.HTTP_404_NOT_FOUND)
             instance.deleted = True
             instance.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
@@ -115,11 +629,25 @@ class LabCheckInViewSet(
             return {}
 
 
-class IssueCommentViewSet(viewsets.ModelViewSet):
+class IssueCommentViewSet(LabVersionMixin, HistoryMixin, viewsets.ModelViewSet):
     def get_queryset(self):
-        return IssueComment.objects.filter(
+        queryset = IssueComment.objects.filter(
             issue__lab=self.kwargs["lab_pk"], issue=self.kwargs["issue_number"]
         )
+        if self.action in READ_ACTIONS:
+            queryset = queryset.select_related("issue__lab")
+        return queryset
 
     serializer_class = IssueCommentSerializer
-    pagination_class = None
+    pagination_class = CreatedCursorPagination
+
+    @action(detail=True, methods=["get"])
+    def history(self, request, *args, **kwargs) -> Response:
+        return self.history_response("history", IssueCommentHistoryItemSerializer)
+
+
+def response_cache_stats(request) -> JsonResponse:
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    cache = get_response_cache()
+    return JsonResponse(cache.stats() if cache is not None else {})
@@ -8,9 +8,29 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
+import re
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lifelab_server.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Imported once Django is set up
+from api.events import lab_events  # noqa: E402
+from api.handlers import ReadPoolASGIHandler  # noqa: E402
+from lifelab_server.urls import API_BASE  # noqa: E402
+
+# Event streams are served outside Django, which would give each one a thread
+LAB_EVENTS_PATH = re.compile(rf"^/{API_BASE}labs/(?P<lab_id>\d+)/events/$")
+
+# Django's ASGI application, with hot reads served from a thread pool
+django_application = ReadPoolASGIHandler()
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http":
+        match = LAB_EVENTS_PATH.match(scope["path"])
+        if match:
+            return await lab_events(scope, receive, send, int(match["lab_id"]))
+    return await django_application(scope, receive, send)
@@ -7,4 +7,5 @@ class AllowCorsMiddleware:
         response["Access-Control-Allow-Origin"] = "*"
         response["Access-Control-Allow-Methods"] = "*"
         response["Access-Control-Allow-Headers"] = "*"
+        response["Access-Control-Expose-Headers"] = "ETag, Last-Modified"
         return response
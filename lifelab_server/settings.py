@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
 from distutils.util import strtobool
+from importlib.util import find_spec
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
+    "api.compression.CompressionMiddleware",
     "lifelab_server.cors.AllowCorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -78,19 +82,56 @@ WSGI_APPLICATION = "lifelab_server.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-database_name = (
-    "db-dev.sqlite3"
-    if "LL_DEV" in os.environ
-    else "db.sqlite3"
-)
-
-print(f"Using database {database_name}")
-
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": os.path.join(BASE_DIR, database_name),
+# "sqlite" (the default) or "postgres", configured by the LL_DB_* variables
+DATABASE_PROFILE = os.environ.get("LL_DATABASE", "sqlite")
+
+# How long to keep database connections open between requests, in seconds
+CONN_MAX_AGE = int(os.environ.get("LL_DB_CONN_MAX_AGE", 600))
+
+if DATABASE_PROFILE == "postgres":
+    database_name = os.environ.get("LL_DB_NAME", "lifelab")
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": database_name,
+            "USER": os.environ.get("LL_DB_USER", ""),
+            "PASSWORD": os.environ.get("LL_DB_PASSWORD", ""),
+            "HOST": os.environ.get("LL_DB_HOST", ""),
+            "PORT": os.environ.get("LL_DB_PORT", ""),
+            "CONN_MAX_AGE": CONN_MAX_AGE,
+            # Transaction-pooling proxies like PgBouncer don't support the
+            # server-side cursors that .iterator() would otherwise use
+            "DISABLE_SERVER_SIDE_CURSORS": bool(
+                strtobool(os.environ.get("LL_DB_POOLER", "false"))
+            ),
+        }
     }
+else:
+    database_name = "db-dev.sqlite3" if "LL_DEV" in os.environ else "db.sqlite3"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(BASE_DIR, database_name),
+            "CONN_MAX_AGE": CONN_MAX_AGE,
+            # File-backed so that tests can open concurrent connections, which an
+            # in-memory SQLite test database doesn't allow
+            "TEST": {"NAME": os.path.join(BASE_DIR, f"test-{database_name}")},
+        }
+    }
+
+# On stderr, so it doesn't end up in the output of commands like export_lab
+print(f"Using database {database_name}", file=sys.stderr)
+
+# Applied to every new SQLite connection (see api.db). WAL lets readers carry on
+# while a write is in progress, and busy_timeout makes writers wait for the lock
+# instead of failing with "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.environ.get("LL_SQLITE_BUSY_TIMEOUT", 5000)),
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
 }
 
 # Password validation
@@ -128,7 +169,13 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_RENDERER_CLASSES": (
-        "djangorestframework_camel_case.render.CamelCaseJSONRenderer",
+        "api.renderers.CamelCaseJSONRenderer",
+        # For clients that send Accept: application/msgpack
+        *(
+            ["api.renderers.CamelCaseMessagePackRenderer"]
+            if find_spec("msgpack")
+            else []
+        ),
         "djangorestframework_camel_case.render.CamelCaseBrowsableAPIRenderer",
     ),
     "DEFAULT_PARSER_CLASSES": (
@@ -138,5 +185,35 @@ REST_FRAMEWORK = {
     ),
 }
 
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+# Cache of rendered lab responses. Use "api.cache.DjangoResponseCache" (with
+# OPTIONS like {"alias": "default", "timeout": 300}) to store them in CACHES,
+# e.g. a file-based cache shared between workers
+RESPONSE_CACHE = {
+    "BACKEND": "api.cache.LRUResponseCache",
+    "OPTIONS": {"max_entries": 1000},
+}
+
+# Serves JSON reads of issues, experiments and check-ins from .values() rows
+# instead of DRF serializers (see api.rows). The output is the same either way
+ROW_SERIALIZERS = True
+
+# Requests over either budget are logged as warnings by api.metrics
+REQUEST_QUERY_BUDGET = int(os.environ.get("LL_REQUEST_QUERY_BUDGET", 50))
+REQUEST_LATENCY_BUDGET = float(os.environ.get("LL_REQUEST_LATENCY_BUDGET", 1.0))
+
+# Smallest response body worth compressing (see api.compression)
+COMPRESSION_MIN_SIZE = int(os.environ.get("LL_COMPRESSION_MIN_SIZE", 1024))
+
+# Threads serving GETs of the hot read endpoints under ASGI (see api.handlers)
+ASGI_READ_THREADS = int(os.environ.get("LL_ASGI_READ_THREADS", 8))
+
+# Fans lab change events out to event stream subscribers (see api.events).
+# The local broker only reaches subscribers in the same process
+EVENT_BROKER = {"BACKEND": "api.events.LocalBroker"}
+
 # TODO: This may be a security issue
 CORS_ORIGIN_ALLOW_ALL = True
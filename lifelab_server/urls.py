@@ -6,6 +6,7 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
 
 from api import views
+from api.metrics import metrics_view
 from api.views import LabIssueViewSet, IssueCommentViewSet, LabExperimentViewSet, \
     LabCheckInViewSet
 
@@ -28,5 +29,7 @@ urlpatterns = [
     path(API_BASE, include(router.urls)),
     path(API_BASE, include(labs_router.urls)),
     path(API_BASE, include(issues_router.urls)),
+    path(API_BASE + "response-cache/", views.response_cache_stats),
+    path("metrics", metrics_view, name="metrics"),
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
     ]